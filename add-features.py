@@ -1,31 +1,20 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import os
 import sys
 import argparse
-import math
+import itertools
+import collections
+import multiprocessing
 
-from features import *
+import runstats
+import compressed
+import featcache
+from featurizer import CHUNK_SIZE, FEATURES, create_features, extend_line, \
+    get_feature_class, is_line_aligned, iterate_prepared_sentences, \
+    iterate_sentence_groups, log_scores, DedupScorer
 
 
-FEATURE_FIELD = 2
-
-
-def get_feature_classes(cls=base.FeatureBase):
-    subclasses = []
-    for subcls in cls.__subclasses__():
-        subclasses.append(subcls)
-        subclasses.extend(get_feature_classes(subcls))
-    return list(set(subclasses))
-
-
-def has_file_based_features(fs):
-    return any(callable(getattr(f, "prepare", None)) for f in fs)
-
-
-FEATURES = {cls.name: cls.desc for cls in get_feature_classes()}
-
 FEATURE_LIST = "Available features:\n" + \
     '\n'.join("{} - {}".format(f, FEATURES[f]) for f in FEATURES)
 
@@ -36,78 +25,226 @@ def main():
         print(FEATURE_LIST)
         exit()
 
-    feats = [f() for f in get_feature_classes() if f.name in args.features]
-
-    if has_file_based_features(feats):
-        src_file, trg_file = create_parallel_files(
-            args.nbest, args.source, args.work_dir)
-        for f in feats:
-            if callable(getattr(f, "prepare", None)):
-                f.prepare(src_file, trg_file, args.work_dir)
-
-    for trg, src, line in iterate_nbest_sentences(args.nbest, args.source):
-        scores = [feat.run(trg, src) for feat in feats]
-        if args.log:
-            log_scores = []
-            for elem in ' '.join(scores).split():
-                if elem.endswith('='):
-                    log_scores.append(elem)
-                else:
-                    val = float(elem)
-                    log_scores.append(str(math.log(val)) if val else '-100.0')
-            scores = log_scores
-        fields = [f.strip() for f in line.split('|||')]
-        fields[FEATURE_FIELD] += ' ' + ' '.join(scores)
-        args.output.write(' ||| '.join(fields) + '\n')
-
-
-def create_parallel_files(nbest, source, work_dir):
-    if not os.path.exists(work_dir):
-        os.mkdir(work_dir)
-    src_file = os.path.join(work_dir, 'source.txt')
-    trg_file = os.path.join(work_dir, 'target.txt')
-    with open(src_file, 'w') as src_io, open(trg_file, 'w') as trg_io:
-        for trg, src, _ in iterate_nbest_sentences(nbest, source):
-            src_io.write(src + '\n')
-            trg_io.write(trg + '\n')
-    nbest.seek(0)
-    source.seek(0)
-    return src_file, trg_file
-
-
-def iterate_nbest_sentences(nbest, source):
-    sid = 0
-    prev_sid = -1
-    for line in nbest:
-        line = line.rstrip('\n')
-        sid, trg, _ = line.split(' ||| ', 2)
-        sid = int(sid)
-        if sid > prev_sid:
-            src = source.next().strip()
-        yield trg, src, line
-        prev_sid = sid
+    feats = create_features(args.features)
+
+    stats = None
+    if args.stats:
+        stats = runstats.Stats(args.stats, args.stats_interval)
+
+    cache = None
+    if args.cache:
+        cache = featcache.FeatureCache(args.cache, args.cache_size)
+
+    if stats:
+        args.nbest = runstats.CountingFile(
+            args.nbest, stats, 'bytes_read', 'candidates')
+        args.source = runstats.CountingFile(
+            args.source, stats, 'bytes_read', 'sentences')
+        args.output = runstats.CountingFile(
+            args.output, stats, 'bytes_written')
+
+    # File-based features are prepared on chunks while reading the n-best list
+    lines = iterate_prepared_sentences(args.nbest, args.source, feats,
+                                       args.work_dir, args.chunk_size, stats)
+    if stats:
+        feats = [runstats.TimedFeature(f, stats.timer('feature:' + f.name))
+                 for f in feats]
+
+    # Values computed before a failure are kept in the cache
+    try:
+        if args.jobs > 1:
+            add_features_parallel(lines, feats, args, stats, cache)
+        else:
+            add_features(lines, feats, args, stats, cache)
+    finally:
+        if cache:
+            cache.close()
+
+    if cache and stats:
+        stats.count('cache_hits', cache.hits)
+        stats.count('cache_misses', cache.misses)
+
+
+def add_features(lines, feats, args, stats=None, cache=None):
+    if cache:
+        # Values of line-aligned features are prepared for chunks
+        feats = [f if is_line_aligned(f)
+                 else featcache.CachedFeature(f, cache) for f in feats]
+    scorer = DedupScorer(feats)
+    # Features are run for all hypotheses of each source sentence at once
+    for src, group in iterate_sentence_groups(lines):
+        all_scores = scorer.run_batch([trg for trg, _ in group], src)
+        for (_, line), scores in zip(group, all_scores):
+            args.output.write(format_line(line, scores, feats, args.log,
+                                          stats))
+    if stats:
+        stats.count('duplicates', scorer.duplicates)
+
+
+def format_line(line, scores, feats, log, stats):
+    if log:
+        with runstats.timer(stats, 'log'):
+            scores = log_scores(scores, feats)
+    with runstats.timer(stats, 'format'):
+        return extend_line(line, scores)
+
+
+def add_features_parallel(lines, feats, args, stats=None, cache=None):
+    # Workers create their own feature objects in the same order as the main
+    # process, line-aligned features are run here so that their per-line output
+    # is consumed sequentially and shipped together with the shard. Cached
+    # values are also looked up here and values computed by workers are added
+    # to the cache, so that only the main process accesses the cache
+    names = [f.name for f in feats]
+    pool = multiprocessing.Pool(args.jobs,
+                                initializer=init_worker,
+                                initargs=(names, args.log, bool(stats)))
+    pending = collections.deque()
+
+    def write_result():
+        shard, result = pending.popleft()
+        output, new_scores, duplicates, timers = result.get()
+        args.output.write(output)
+        if stats:
+            stats.count('duplicates', duplicates)
+            stats.merge_timers(timers)
+        if cache:
+            added = set()
+            for (_, trg, src, _, scores), computed in zip(shard, new_scores):
+                if (src, trg) in added:
+                    continue
+                added.add((src, trg))
+                for feat, score, value in zip(feats, scores, computed):
+                    if score is None:
+                        cache.put(feat, src, trg, value)
+
+    for shard in iterate_shards(lines, feats, args.shard_size, cache):
+        pending.append((shard, pool.apply_async(process_shard, (shard,))))
+        # Keep a bounded number of shards in flight and write results in
+        # input order
+        while len(pending) > 2 * args.jobs:
+            write_result()
+    while pending:
+        write_result()
+    pool.close()
+    pool.join()
+
+
+def iterate_shards(lines, feats, size, cache=None):
+    # Cached values are looked up once for each unique hypothesis of a source
+    # sentence, as features are run by DedupScorer
+    shard = []
+    n_sents = 0
+    cached = {}
+    prev_src = None
+    for trg, src, line in lines:
+        sid = line.split(' ||| ', 1)[0]
+        if not shard or shard[-1][0] != sid:
+            if n_sents == size:
+                yield shard
+                shard = []
+                n_sents = 0
+            n_sents += 1
+        if src != prev_src:
+            cached = {}
+            prev_src = src
+        if cache and trg not in cached:
+            cached[trg] = [None if is_line_aligned(f)
+                           else cache.get(f, src, trg) for f in feats]
+        values = cached.get(trg)
+        scores = [f.run(trg, src) if is_line_aligned(f)
+                  else values[i] if values else None
+                  for i, f in enumerate(feats)]
+        shard.append((sid, trg, src, line, scores))
+    if shard:
+        yield shard
+
+
+_worker_feats = None
+_worker_log = False
+_worker_stats = False
+
+
+def init_worker(names, log, stats):
+    global _worker_feats, _worker_log, _worker_stats
+    _worker_feats = [get_feature_class(name)() for name in names]
+    _worker_log = log
+    _worker_stats = stats
+
+
+def process_shard(shard):
+    # Timers are collected per shard and merged by the main process
+    feats = _worker_feats
+    timers = None
+    if _worker_stats:
+        timers = runstats.TimerSet()
+        feats = [runstats.TimedFeature(f, timers.timer('feature:' + f.name))
+                 for f in feats]
+    scorer = DedupScorer(feats)
+    output = []
+    new_scores = []
+    for _, group in itertools.groupby(shard, key=lambda item: item[0]):
+        group = list(group)
+        all_scores = scorer.run_batch([trg for _, trg, _, _, _ in group],
+                                      group[0][2],
+                                      [scores for _, _, _, _, scores in group])
+        for (_, _, _, line, _), scores in zip(group, all_scores):
+            new_scores.append(scores)
+            output.append(format_line(line, scores, feats, _worker_log,
+                                      timers))
+    return ''.join(output), new_scores, scorer.duplicates, \
+        timers.timers if timers else {}
 
 
 def parse_user_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-s', '--source', metavar='FILE', required=True,
-                        type=argparse.FileType('r'),
+    parser.add_argument('-s', '--source', metavar='FILE',
+                        type=compressed.FileType('r'),
                         help='source sentences')
-    parser.add_argument('-f', '--features', required=True, nargs='+',
+    parser.add_argument('-f', '--features', nargs='+',
                         metavar='FEATURE', choices=FEATURES.keys(),
                         help='features to be added to n-best list')
     parser.add_argument('-n', '--nbest', metavar='FILE', nargs='?',
-                        type=argparse.FileType('r'), default=sys.stdin,
+                        type=compressed.FileType('r'), default=sys.stdin,
                         help='input n-best list, default: STDIN')
     parser.add_argument('-o', '--output', metavar='FILE', nargs='?',
-                        type=argparse.FileType('w'), default=sys.stdout,
+                        type=compressed.FileType('w'), default=sys.stdout,
                         help='output n-best list with new features, default: STDOUT')
     parser.add_argument('-w', '--work-dir', metavar='DIR', default='featdir',
                         help='working directory, default: %(default)s')
-    parser.add_argument('--log', action='store_true')
+    parser.add_argument('--chunk-size', metavar='N', default=CHUNK_SIZE,
+                        type=int,
+                        help='number of lines for which file-based and '
+                        'co-process features are prepared at once, '
+                        'default: %(default)s')
+    parser.add_argument('--log', action='store_true',
+                        help='replace feature values with their natural '
+                        'logarithms, except for values that are logarithms '
+                        'already')
+    parser.add_argument('-j', '--jobs', metavar='N', default=1, type=int,
+                        help='number of parallel processes, default: %(default)s')
+    parser.add_argument('--shard-size', metavar='N', default=100, type=int,
+                        help='number of sentences per shard sent to a single '
+                        'process, default: %(default)s')
     parser.add_argument('--show-features', action='store_true',
                         help='list available features and exit')
-    return parser.parse_args()
+    parser.add_argument('--cache', metavar='FILE',
+                        help='persistent cache of feature values')
+    parser.add_argument('--cache-size', metavar='N', type=int,
+                        default=featcache.DEFAULT_MAX_SIZE,
+                        help='maximum number of cached values, the least '
+                        'recently used are removed, default: %(default)s')
+    parser.add_argument('--stats', metavar='FILE',
+                        help='save timing, throughput and memory statistics '
+                        'as JSON')
+    parser.add_argument('--stats-interval', metavar='SEC', default=60,
+                        type=float,
+                        help='update statistics every SEC seconds, '
+                        'default: %(default)s')
+    args = parser.parse_args()
+    if not args.show_features and not (args.source and args.features):
+        parser.error('arguments -s/--source and -f/--features are required')
+    return args
 
 
 if __name__ == '__main__':
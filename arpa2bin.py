@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import argparse
+
+import compressed
+from features import ngramlm
+
+
+def main():
+    args = parse_user_args()
+
+    header, duplicates = ngramlm.build(args.input, args.output, args.bits)
+    sys.stderr.write('Order: {}, n-grams: {}\n'
+                     .format(header['order'],
+                             ' '.join(str(c) for c in header['counts'])))
+    if duplicates:
+        sys.stderr.write('Warning: {} n-grams with duplicate keys\n'
+                         .format(duplicates))
+
+
+def parse_user_args():
+    parser = argparse.ArgumentParser(
+        description='Converts an ARPA language model into the binary format '
+        'of the lm feature')
+    parser.add_argument('-i', '--input', metavar='FILE', nargs='?',
+                        type=compressed.FileType('r'), default=sys.stdin,
+                        help='input ARPA file, default: STDIN')
+    parser.add_argument('-o', '--output', metavar='FILE', required=True,
+                        type=argparse.FileType('wb'),
+                        help='output binary language model')
+    parser.add_argument('-b', '--bits', type=int, default=8, choices=[8, 16],
+                        help='bits of quantized probabilities and backoff '
+                        'weights, default: %(default)s')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import argparse
+
+import compressed
+import nbestbin
+
+
+def main():
+    args = parse_user_args()
+    nbestbin.write_text(nbestbin.load(args.input), args.output)
+
+
+def parse_user_args():
+    parser = argparse.ArgumentParser(
+        description='Converts a binary n-best list into the text format')
+    parser.add_argument('-i', '--input', metavar='FILE', required=True,
+                        help='input binary n-best list')
+    parser.add_argument('-o', '--output', metavar='FILE', nargs='?',
+                        type=compressed.FileType('w'), default=sys.stdout,
+                        help='output n-best list, default: STDOUT')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+# Transparent reading and writing of files compressed with gzip, bzip2 or xz,
+# recognized by their extensions. Compressed files are read from and written to
+# pipes of gzip, bzip2 or xz processes, so decompression and compression run
+# on another CPU and overlap with parsing and feature computation, with large
+# pipe buffers in between. Pipes are sequential, so compressed n-best lists
+# cannot be memory-mapped as binary n-best lists.
+
+import os
+import sys
+import fcntl
+import atexit
+import argparse
+import subprocess
+
+COMMANDS = {
+    '.gz': 'gzip',
+    '.bz2': 'bzip2',
+    '.xz': 'xz',
+}
+BUFFER_SIZE = 1 << 20
+
+
+def is_compressed(path):
+    return os.path.splitext(path)[1] in COMMANDS
+
+
+def open_file(path, mode='r'):
+    if not is_compressed(path):
+        return open(path, mode)
+    return CompressedFile(path, mode)
+
+
+class FileType(argparse.FileType):
+    # The same as argparse.FileType, but opens compressed files
+
+    def __call__(self, string):
+        if string == '-' or not is_compressed(string):
+            return argparse.FileType.__call__(self, string)
+        try:
+            return CompressedFile(string, self._mode)
+        except (IOError, OSError) as e:
+            raise argparse.ArgumentTypeError(
+                "can't open '{}': {}".format(string, e))
+
+
+class CompressedFile(object):
+
+    def __init__(self, path, mode='r'):
+        self.name = path
+        self.mode = mode
+        self.closed = False
+        self.command = COMMANDS[os.path.splitext(path)[1]]
+        text = 'b' not in mode
+        if 'r' in mode:
+            # Fails here rather than with an empty input
+            self.raw = open(path, 'rb')
+            self.proc = subprocess.Popen([self.command, '-dc'],
+                                         stdin=self.raw,
+                                         stdout=subprocess.PIPE,
+                                         bufsize=BUFFER_SIZE, close_fds=True,
+                                         universal_newlines=text)
+            self.file = self.proc.stdout
+        else:
+            self.raw = open(path, 'ab' if 'a' in mode else 'wb')
+            self.proc = subprocess.Popen([self.command, '-c'],
+                                         stdin=subprocess.PIPE,
+                                         stdout=self.raw,
+                                         bufsize=BUFFER_SIZE, close_fds=True,
+                                         universal_newlines=text)
+            self.file = self.proc.stdin
+        # Other processes started later, e.g. co-process workers, must not
+        # keep the pipe open, otherwise the compressor never finishes
+        fcntl.fcntl(self.file.fileno(), fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+        # Scripts do not always close their outputs, so the compressor is
+        # waited for at exit to write the whole file
+        atexit.register(self.close)
+
+    def __iter__(self):
+        for line in self.file:
+            yield line
+        self._check()
+
+    def next(self):
+        try:
+            return next(self.file)
+        except StopIteration:
+            self._check()
+            raise
+
+    __next__ = next
+
+    def read(self, *args):
+        data = self.file.read(*args)
+        if not data:
+            self._check()
+        return data
+
+    def readline(self, *args):
+        line = self.file.readline(*args)
+        if not line:
+            self._check()
+        return line
+
+    def _check(self):
+        # A truncated or corrupted input is an error, not the end of input
+        code = self.proc.wait()
+        if code:
+            raise IOError('Cannot decompress {}: {} exited with code {}'
+                          .format(self.name, self.command, code))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.file.close()
+        except IOError:
+            pass
+        if 'r' in self.mode and self.proc.poll() is None:
+            # Not read to the end
+            self.proc.terminate()
+        code = self.proc.wait()
+        self.raw.close()
+        if code and 'r' not in self.mode:
+            sys.stderr.write('Error: compression of {} failed with code {}\n'
+                             .format(self.name, code))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+# Evaluates feature weights from rescore.ini on a dev n-best list with metric
+# statistics computed in-process, optionally for a grid of values of the length
+# normalization parameter of rescore.py.
+
+import sys
+import argparse
+
+import numpy as np
+
+import compressed
+import mira
+import metrics
+import nbestbin
+import rescore
+from train import IN_PROCESS_METRICS, METRICS
+
+# M2 statistics are estimated from Levenshtein edits, not computed with the
+# edit alignment of the M2 scorer, so the metric is available only under its
+# own name and its scores may select different settings than the M2 scorer
+APPROXIMATE_METRICS = {
+    'm2-approx': 'm2',
+}
+
+
+def main():
+    args = parse_user_args()
+
+    weights = rescore.read_feature_weights(args.config)
+    metric = METRICS[APPROXIMATE_METRICS.get(args.metric, args.metric)]
+    label = metric['sctype']
+    if args.metric in APPROXIMATE_METRICS:
+        label += ' (approximation)'
+        sys.stderr.write('Warning: {} scores are approximated, use train.py '
+                         'with the extractor for exact scores\n'
+                         .format(metric['sctype']))
+    try:
+        evaluator = mira.Metric(metric['sctype'], metric['scconfig'])
+        scorer = metrics.create_scorer(metric['sctype'], evaluator.config,
+                                       args.reference.split(','))
+    except ValueError as e:
+        sys.stderr.write('Error: {}\n'.format(e))
+        sys.exit(1)
+
+    sent_ids, texts, scores = read_nbest(args.nbest, weights)
+    stats = metrics.compute_stats(scorer, sent_ids, texts, args.filter)
+    sent_idx = np.unique(sent_ids, return_inverse=True)[1]
+
+    # Normalization only changes scores, so each value needs just the best
+    # candidates and summed statistics
+    results = []
+    for normalize in args.normalize:
+        norm_scores = scores
+        if normalize:
+            norm_scores = rescore.normalize_scores(scores, texts, normalize)
+        best = [i for i, _ in rescore.select_candidates(norm_scores,
+                                                         sent_idx, 1)]
+        score = evaluator.score(stats[best].sum(axis=0))
+        results.append((score, normalize))
+        args.output.write('{}\t{:.6f}\n'
+                          .format(normalize, metric_value(label, score)))
+    if len(results) > 1:
+        score, normalize = max(results, key=lambda r: (r[0], -r[1]))
+        args.output.write('Best normalization: {} with {} = {:.6f}\n'
+                          .format(normalize, label,
+                                  metric_value(label, score)))
+
+
+# Scores of mira.Metric are maximized, so TER is scored as 1 - TER
+def metric_value(label, score):
+    return 1.0 - score if label == 'TER' else score
+
+
+def read_nbest(nbest_file, weights):
+    if nbestbin.is_binary(nbest_file):
+        nbest = nbestbin.load(nbest_file)
+        sent_ids = np.repeat(nbest.sent_ids, np.diff(nbest.offsets))
+        texts = [nbest.hyp_text(i) for i in range(nbest.n_hyps)]
+        scores = np.asarray(nbest.features).dot(
+            rescore.binary_weight_vector(nbest, weights))
+        return sent_ids.tolist(), texts, scores
+
+    sent_ids = []
+    texts = []
+    feats = []
+    with compressed.open_file(nbest_file) as inp:
+        for line in inp:
+            fields = [f.strip() for f in line.split('|||')]
+            sent_ids.append(int(fields[0]))
+            texts.append(fields[rescore.TEXT_FIELD])
+            feats.append(fields[rescore.FEATURE_FIELD])
+    scores = rescore.BatchScorer(weights).score_texts(feats)
+    return sent_ids, texts, scores
+
+
+def parse_grid(value):
+    # A single value or a range START:STOP:STEP including STOP
+    if ':' not in value:
+        return [float(value)]
+    start, stop, step = [float(v) for v in value.split(':')]
+    n = int(round((stop - start) / step)) + 1
+    return [round(start + i * step, 10) for i in range(n)]
+
+
+def parse_user_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--nbest', metavar='FILE', required=True,
+                        help='n-best list with features')
+    parser.add_argument('-c', '--config', metavar='FILE', required=True,
+                        type=argparse.FileType('r'),
+                        help='rescore.ini')
+    parser.add_argument('-r', '--reference', metavar='FILE', required=True,
+                        help='reference, or comma-separated references')
+    parser.add_argument('-m', '--metric', default='bleu', metavar='METRIC',
+                        choices=[name for name, metric in METRICS.items()
+                                 if metric['sctype'] in IN_PROCESS_METRICS]
+                        + sorted(APPROXIMATE_METRICS),
+                        help='evaluation metric, default: %(default)s')
+    parser.add_argument('-f', '--filter', default='default', metavar='FILTER',
+                        choices=metrics.FILTERS.keys(),
+                        help='postprocessing filter, default: %(default)s')
+    parser.add_argument('-g', '--normalize', metavar='VALUE', nargs='+',
+                        default=[0.0],
+                        help='values of the length normalization parameter '
+                        'or ranges START:STOP:STEP, 0 for no normalization')
+    parser.add_argument('-o', '--output', metavar='FILE', nargs='?',
+                        type=argparse.FileType('w'), default=sys.stdout,
+                        help='output scores, default: STDOUT')
+    args = parser.parse_args()
+    args.normalize = [v for value in args.normalize
+                      for v in parse_grid(str(value))]
+    return args
+
+
+if __name__ == '__main__':
+    main()
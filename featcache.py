@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+# Persistent cache of feature values stored in an SQLite database. Values are
+# keyed by a hash of the feature name and version, the source sentence and the
+# hypothesis, so that feature values of hypotheses seen in previous runs are
+# not computed again. The number of cached values is limited, and the least
+# recently used values are evicted whenever new values are written.
+
+import hashlib
+import sqlite3
+
+DEFAULT_MAX_SIZE = 10000000
+BATCH_SIZE = 10000
+
+
+class FeatureCache(object):
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS cache '
+                        '(key BLOB PRIMARY KEY, value TEXT, used INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS cache_used '
+                        'ON cache (used)')
+        # Access times are consecutive numbers continued from previous runs
+        self.tick = self.db.execute('SELECT MAX(used) FROM cache') \
+            .fetchone()[0] or 0
+        # An upper bound of the number of values, counted exactly only when
+        # it exceeds the limit
+        self.size = self.count()
+        self.hits = 0
+        self.misses = 0
+        self.new_values = []
+        self.used_keys = []
+
+    def get(self, feat, src, trg):
+        key = make_key(feat, src, trg)
+        row = self.db.execute('SELECT value FROM cache WHERE key = ?',
+                              (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.tick += 1
+        self.used_keys.append((self.tick, key))
+        if len(self.used_keys) >= BATCH_SIZE:
+            self.flush()
+        return str(row[0])
+
+    def put(self, feat, src, trg, value):
+        self.tick += 1
+        self.new_values.append((make_key(feat, src, trg), value, self.tick))
+        if len(self.new_values) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.db.executemany('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)',
+                            self.new_values)
+        self.db.executemany('UPDATE cache SET used = ? WHERE key = ?',
+                            self.used_keys)
+        self.size += len(self.new_values)
+        self.new_values = []
+        self.used_keys = []
+        if self.size > self.max_size:
+            self.evict()
+        else:
+            self.db.commit()
+
+    def count(self):
+        return self.db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def evict(self):
+        size = self.count()
+        if size > self.max_size:
+            self.db.execute('DELETE FROM cache WHERE key IN (SELECT key '
+                            'FROM cache ORDER BY used LIMIT ?)',
+                            (size - self.max_size,))
+            size = self.max_size
+        self.db.commit()
+        self.size = size
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+class CachedFeature(object):
+    # Feature wrapper looking up values in the cache before calling run()
+
+    def __init__(self, feat, cache):
+        self.feat = feat
+        self.cache = cache
+
+    def run(self, trg, src):
+        value = self.cache.get(self.feat, src, trg)
+        if value is None:
+            value = self.feat.run(trg, src)
+            self.cache.put(self.feat, src, trg, value)
+        return value
+
+    def run_batch(self, trgs, src):
+        values = [self.cache.get(self.feat, src, trg) for trg in trgs]
+        missing = [n for n, value in enumerate(values) if value is None]
+        if missing:
+            new_values = self.feat.run_batch([trgs[n] for n in missing], src)
+            for n, value in zip(missing, new_values):
+                values[n] = value
+                self.cache.put(self.feat, src, trgs[n], value)
+        return values
+
+    def __getattr__(self, name):
+        return getattr(self.feat, name)
+
+
+def make_key(feat, src, trg):
+    data = b'\0'.join(_encode(text) for text in
+                      [feat.name, str(feat.version), src, trg])
+    return sqlite3.Binary(hashlib.sha1(data).digest())
+
+
+def _encode(text):
+    return text if isinstance(text, bytes) else text.encode('utf-8')
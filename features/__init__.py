@@ -1,7 +1,48 @@
 # -*- coding: utf-8 -*-
 
-import glob
+# Registry of features mapping feature names to modules and classes, so that
+# only modules of requested features are imported. New features need to be
+# added here.
 
-modules = glob.glob(os.path.dirname(__file__) + "/*.py")
-__all__ = [os.path.basename(f)[:-3] for f in modules
-           if os.path.isfile(f) and not f.endswith('__init__.py')]
+import importlib
+from collections import OrderedDict
+
+FEATURES = OrderedDict([
+    # name           module       class                       description
+    ('edits',       ('editops',   'FeatureEdits',
+                     'counts of word-based edit operations')),
+    ('charedits',   ('editops',   'FeatureChars',
+                     'counts of character-based edit operations')),
+    ('lvedits',     ('editops',   'FeatureEditsLevenshtein',
+                     'counts of word-based edit operations, '
+                     'bit-parallel alignment')),
+    ('lvcharedits', ('editops',   'FeatureCharsLevenshtein',
+                     'counts of character-based edit operations, '
+                     'bit-parallel alignment')),
+    ('fastedits',   ('editops',   'FeatureEditsMatching',
+                     'counts of word-based edit operations, same as edits, '
+                     'faster')),
+    ('fastcharedits', ('editops', 'FeatureCharsMatching',
+                       'counts of character-based edit operations, same as '
+                       'charedits, faster')),
+    ('ratio',       ('lenratio',  'LengthRatio',
+                     'word length ratio')),
+    ('chratio',     ('lenratio',  'LengthRatioChars',
+                     'character length ratio')),
+    ('wprec',       ('precrec',   'WordPrecisionAndRecall',
+                     'word precision and recall')),
+    ('ter',         ('terstats',  'TERStats',
+                     'TER statistics')),
+    ('lm',          ('langmodel', 'LanguageModel',
+                     'n-gram language model score and number of unknown '
+                     'words, see arpa2bin.py')),
+])
+
+
+def describe(name):
+    return FEATURES[name][2]
+
+
+def load(name):
+    module, cls, _ = FEATURES[name]
+    return getattr(importlib.import_module(__name__ + '.' + module), cls)
@@ -1,4 +1,56 @@
 # -*- coding: utf-8 -*-
 
 class FeatureBase(object):
-    pass
+    # Increase the version of a feature whenever its values change, so that
+    # values cached by add-features.py --cache are not reused
+    version = 1
+    # Names of values returned by values(), None if unknown
+    labels = None
+    # Names of values which are already logarithms, e.g. log probabilities,
+    # and are not logged again by --log
+    log_labels = ()
+
+    # Returns a list of numeric feature values, by default parsed from the
+    # output of run()
+    def values(self, trg, src):
+        return [float(tok) for tok in self.run(trg, src).split()
+                if not tok.endswith('=')]
+
+    # Returns data computed from the source sentence once for all of its
+    # hypotheses
+    def prepare_source(self, src):
+        return src
+
+    # Returns outputs of run() for hypotheses of the same source sentence, by
+    # default calling run() for each of them
+    def run_batch(self, trgs, src):
+        return [self.run(trg, src) for trg in trgs]
+
+    def values_batch(self, trgs, src):
+        return [self.values(trg, src) for trg in trgs]
+
+
+class BatchFeature(FeatureBase):
+    # Base class of features computing values of hypotheses from source-side
+    # data prepared once per source sentence with prepare_source(). Subclasses
+    # implement values_prepared() and set the template formatting values.
+    # Tokens are kept as strings: interning them to integer ids, as arrays or
+    # NumPy vectors of whole groups, was slower for sentences of typical
+    # length, since split strings cache their hashes and encoding costs more
+    # than set lookups and sequence matching save, see the intern benchmarks
+    # of tools/benchmark.py.
+    template = None
+
+    def run(self, trg, src):
+        return self.template.format(*self.values(trg, src))
+
+    def values(self, trg, src):
+        return self.values_prepared(trg, self.prepare_source(src))
+
+    def run_batch(self, trgs, src):
+        return [self.template.format(*values)
+                for values in self.values_batch(trgs, src)]
+
+    def values_batch(self, trgs, src):
+        prepared = self.prepare_source(src)
+        return [self.values_prepared(trg, prepared) for trg in trgs]
@@ -0,0 +1,268 @@
+from base import FeatureBase
+
+import sys
+import threading
+import subprocess
+from collections import OrderedDict, deque
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+
+class CoprocessFeature(FeatureBase):
+    # Base class of features computed by external tools running as long-lived
+    # worker processes. A worker reads one request per line from STDIN and
+    # writes one response per line to STDOUT, flushing it after each line.
+    # Subclasses set name, labels and command, and may override
+    # format_request() and parse_response().
+    #
+    # Requests of chunks of the n-best list are given to prefetch(), which
+    # returns immediately. A dispatcher thread sends the requests of each chunk
+    # in order, split into contiguous batches for the workers and written to
+    # them asynchronously, while responses are read in separate threads.
+    # Results are returned by run() in order as soon as they arrive, so the
+    # workers run while other features are computed for the same chunk.
+    # Workers not responding in timeout seconds or exiting are restarted and
+    # the remaining requests sent again, at most retries times.
+    #
+    # Co-process features are run for every line of the n-best list, so they
+    # are not deduplicated by DedupScorer and their values are not stored in
+    # the cache of add-features.py --cache. Instead, identical requests of a
+    # chunk are sent only once.
+
+    command = None
+    processes = 1
+    timeout = 60
+    retries = 2
+
+    def __init__(self):
+        self.workers = None
+        self.results = deque()
+        self.chunks = None
+        self.dispatcher = None
+
+    def __del__(self):
+        self.close()
+
+    def format_request(self, trg, src):
+        return '{} ||| {}'.format(src, trg)
+
+    # Returns a list of feature values from a response line
+    def parse_response(self, line):
+        return [float(tok) for tok in line.split()]
+
+    def prefetch(self, pairs):
+        requests = [self.format_request(trg, src) for trg, src in pairs]
+        unique = OrderedDict()
+        index = [unique.setdefault(r, len(unique)) for r in requests]
+        pending = PendingResponses(index)
+        self.results.append(pending)
+        if self.dispatcher is None:
+            self.chunks = Queue()
+            self.dispatcher = threading.Thread(target=self._dispatch,
+                                               args=(self.chunks,))
+            self.dispatcher.daemon = True
+            self.dispatcher.start()
+        self.chunks.put((list(unique), pending))
+
+    def run(self, trg, src):
+        return ' '.join('{}= {}'.format(label, value) for label, value
+                        in zip(self.labels, self.values(trg, src)))
+
+    def values(self, trg, src):
+        while self.results and self.results[0].exhausted():
+            self.results.popleft()
+        if not self.results:
+            # Not prefetched, e.g. when run for single hypotheses
+            self.prefetch([(trg, src)])
+        line = self.results[0].next()
+        if line is None:
+            raise Exception("Feature '{}' failed: {}"
+                            .format(self.name, self.results[0].error))
+        return self.parse_response(line)
+
+    # Returns responses to requests, waiting for all of them
+    def query(self, requests):
+        pending = PendingResponses(list(range(len(requests))))
+        self._query(requests, pending)
+        if pending.error:
+            raise Exception("Feature '{}' failed: {}"
+                            .format(self.name, pending.error))
+        return [pending.next() for _ in requests]
+
+    def _dispatch(self, chunks):
+        while True:
+            requests, pending = chunks.get()
+            if pending is None:
+                return
+            try:
+                self._query(requests, pending)
+            except Exception as e:
+                pending.fail(e)
+
+    def _query(self, requests, pending):
+        if not requests:
+            return
+        if self.workers is None:
+            self.workers = [Worker(self.command)
+                            for _ in range(self.processes)]
+        size = -(-len(requests) // len(self.workers))
+        batches = [requests[i:i + size]
+                   for i in range(0, len(requests), size)]
+        results = pending.start(len(batches), size)
+        errors = []
+        threads = [threading.Thread(target=self._query_worker,
+                                    args=(w, b, r, errors))
+                   for w, b, r in zip(self.workers, batches, results)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            pending.fail(errors[0])
+
+    def _query_worker(self, worker, requests, results, errors):
+        for attempt in range(self.retries + 1):
+            try:
+                worker.query(requests[len(results):], results, self.timeout)
+                return
+            except WorkerError as e:
+                error = e
+                if attempt < self.retries:
+                    sys.stderr.write("Warning: Restarting worker of feature "
+                                     "'{}': {}\n".format(self.name, e))
+                    worker.restart()
+        errors.append('{} after {} restarts'.format(error, self.retries))
+
+    def close(self):
+        if self.dispatcher is not None:
+            self.chunks.put((None, None))
+            self.dispatcher.join()
+            self.dispatcher = None
+        for worker in self.workers or []:
+            worker.stop()
+        self.workers = None
+
+
+class PendingResponses(object):
+    # Responses to a chunk of requests, filled in batches by threads of the
+    # workers and taken in order of requests, where index maps each request to
+    # the position of its response among responses to unique requests
+
+    def __init__(self, index):
+        self.index = index
+        self.taken = 0
+        self.batches = None
+        self.size = None
+        self.error = None
+        self.cond = threading.Condition()
+
+    def start(self, n_batches, size):
+        with self.cond:
+            self.size = size
+            self.batches = [Responses(self.cond) for _ in range(n_batches)]
+            self.cond.notify_all()
+        return self.batches
+
+    def fail(self, error):
+        with self.cond:
+            self.error = error
+            self.cond.notify_all()
+
+    def exhausted(self):
+        return self.taken == len(self.index)
+
+    # Returns the response to the next request, waiting for it, or None if
+    # the request failed
+    def next(self):
+        with self.cond:
+            while True:
+                if self.batches is not None:
+                    batch, pos = divmod(self.index[self.taken], self.size)
+                    if pos < len(self.batches[batch]):
+                        self.taken += 1
+                        return self.batches[batch][pos]
+                if self.error is not None:
+                    return None
+                # With a timeout, so that waiting can be interrupted
+                self.cond.wait(1.0)
+
+
+class Responses(list):
+    # A list of responses notifying waiting consumers
+
+    def __init__(self, cond):
+        list.__init__(self)
+        self.cond = cond
+
+    def append(self, line):
+        with self.cond:
+            list.append(self, line)
+            self.cond.notify_all()
+
+
+class WorkerError(Exception):
+    pass
+
+
+class Worker(object):
+
+    def __init__(self, command):
+        self.command = command
+        self.start()
+
+    def start(self):
+        self.proc = subprocess.Popen(self.command, stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     universal_newlines=True)
+        self.responses = Queue()
+        reader = threading.Thread(target=self._read,
+                                  args=(self.proc, self.responses))
+        reader.daemon = True
+        reader.start()
+
+    def _read(self, proc, responses):
+        for line in iter(proc.stdout.readline, ''):
+            responses.put(line.rstrip('\n'))
+        responses.put(None)
+
+    def _write(self, proc, requests):
+        try:
+            for request in requests:
+                proc.stdin.write(request + '\n')
+            proc.stdin.flush()
+        except (IOError, OSError, ValueError):
+            # A failed worker is detected by the reader
+            pass
+
+    def query(self, requests, results, timeout):
+        # Requests are written in another thread, so that workers never block
+        # on full pipes
+        writer = threading.Thread(target=self._write,
+                                  args=(self.proc, requests))
+        writer.daemon = True
+        writer.start()
+        for _ in requests:
+            try:
+                line = self.responses.get(timeout=timeout)
+            except Empty:
+                raise WorkerError('no response in {} seconds'.format(timeout))
+            if line is None:
+                raise WorkerError('worker exited with code {}'
+                                  .format(self.proc.wait()))
+            results.append(line)
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def stop(self):
+        try:
+            self.proc.stdin.close()
+            if self.proc.poll() is None:
+                self.proc.kill()
+        except (IOError, OSError):
+            pass
+        self.proc.wait()
@@ -1,28 +1,96 @@
-from base import FeatureBase
+from base import BatchFeature
 from difflib import SequenceMatcher
 
+import levenshtein
+import matching
 
-class FeatureEdits(FeatureBase):
+
+class FeatureEdits(BatchFeature):
     name = 'edits'
-    desc = 'counts of word-based edit operations'
+    labels = ['EditIns', 'EditDel', 'EditSub']
+    template = "EditIns= {} EditDel= {} EditSub= {}"
+
+    def tokenize(self, text):
+        return text.split()
+
+    def prepare_source(self, src):
+        return self.tokenize(src)
 
-    def run(self, trg, src):
-        matcher = SequenceMatcher(None, src.split(), trg.split())
-        ops = [tag for tag, _, _, _, _ in matcher.get_opcodes()]
-        return "EditIns= {} EditDel= {} EditSub= {}" \
-            .format(ops.count('insert'),
-                    ops.count('delete'),
-                    ops.count('replace'))
+    def values_prepared(self, trg, src):
+        ops = [tag for tag, _, _, _, _ in self.opcodes(src,
+                                                        self.tokenize(trg))]
+        return [ops.count('insert'), ops.count('delete'),
+                ops.count('replace')]
 
+    # Aligns the prepared source sentence with the hypothesis
+    def opcodes(self, src, trg):
+        return SequenceMatcher(None, src, trg).get_opcodes()
 
-class FeatureChars(FeatureBase):
+
+class FeatureChars(FeatureEdits):
     name = 'charedits'
-    desc = 'counts of character-based edit operations'
-
-    def run(self, trg, src):
-        matcher = SequenceMatcher(None, src, trg)
-        ops = [tag for tag, _, _, _, _ in matcher.get_opcodes()]
-        return "CharIns= {} CharDel= {} CharSub= {}" \
-            .format(ops.count('insert'),
-                    ops.count('delete'),
-                    ops.count('replace'))
+    labels = ['CharIns', 'CharDel', 'CharSub']
+    template = "CharIns= {} CharDel= {} CharSub= {}"
+
+    def tokenize(self, text):
+        return text
+
+
+# Features computed from a minimal Levenshtein alignment instead of difflib
+# matching blocks. Counts of opcodes differ from the difflib-based features for
+# many pairs, see features/levenshtein.py, so the features have their own names
+# and weights tuned for edits or charedits do not apply to them; fastedits and
+# fastcharedits below can be used instead to keep the weights. Bit masks of the
+# source sentence are computed once for all hypotheses
+
+class FeatureEditsLevenshtein(FeatureEdits):
+    name = 'lvedits'
+    # Cached values have the names of difflib-based features
+    version = 2
+    labels = ['LvEditIns', 'LvEditDel', 'LvEditSub']
+    template = "LvEditIns= {} LvEditDel= {} LvEditSub= {}"
+
+    def prepare_source(self, src):
+        return levenshtein.Pattern(self.tokenize(src))
+
+    def opcodes(self, src, trg):
+        return levenshtein.opcodes(src.seq, trg, src)
+
+
+class FeatureCharsLevenshtein(FeatureChars):
+    name = 'lvcharedits'
+    # Cached values have the names of difflib-based features
+    version = 2
+    labels = ['LvCharIns', 'LvCharDel', 'LvCharSub']
+    template = "LvCharIns= {} LvCharDel= {} LvCharSub= {}"
+
+    def prepare_source(self, src):
+        return levenshtein.Pattern(self.tokenize(src))
+
+    def opcodes(self, src, trg):
+        return levenshtein.opcodes(src.seq, trg, src)
+
+
+# Features with the same names and values as edits and charedits, i.e. the
+# difflib-compatible mode of the fast features, computed by a reimplementation
+# of difflib matching, see features/matching.py. Positions of items of the
+# source sentence are computed once for all hypotheses
+
+class FeatureEditsMatching(FeatureEdits):
+    name = 'fastedits'
+
+    def prepare_source(self, src):
+        return matching.Index(self.tokenize(src))
+
+    def opcodes(self, src, trg):
+        return matching.opcodes(src.seq, trg, src)
+
+
+class FeatureCharsMatching(FeatureChars):
+    name = 'fastcharedits'
+
+    def prepare_source(self, src):
+        return matching.Index(self.tokenize(src))
+
+    def opcodes(self, src, trg):
+        return matching.opcodes(src.seq, trg, src)
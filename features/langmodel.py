@@ -0,0 +1,35 @@
+from base import BatchFeature
+
+import os
+
+import ngramlm
+
+# Path to a binary language model built with arpa2bin.py
+MODEL_VARIABLE = 'YARESCORER_LM'
+
+
+class LanguageModel(BatchFeature):
+    name = 'lm'
+    labels = ['LM', 'LMOOV']
+    log_labels = ['LM']
+    template = "LM= {:.4f} LMOOV= {}"
+
+    def __init__(self):
+        path = os.environ.get(MODEL_VARIABLE)
+        if not path:
+            raise Exception('Set {} to a binary language model built with '
+                            'arpa2bin.py'.format(MODEL_VARIABLE))
+        self.model = ngramlm.load(path)
+        # Cached values of another model are not reused
+        self.version = '{}:{}'.format(type(self).version, self.model.checksum)
+
+    def prepare_source(self, src):
+        return None
+
+    def values_prepared(self, trg, src):
+        return self.values_batch([trg], src)[0]
+
+    # All hypotheses of a source sentence are scored at once
+    def values_batch(self, trgs, src):
+        scores, oovs = self.model.score_batch([trg.split() for trg in trgs])
+        return [list(values) for values in zip(scores, oovs)]
@@ -1,22 +1,27 @@
-from base import FeatureBase
-from difflib import SequenceMatcher
+from base import BatchFeature
 
 
-class LengthRatio(FeatureBase):
+class LengthRatio(BatchFeature):
     name = 'ratio'
-    desc = 'word length ratio'
+    labels = ['LenRatio']
+    template = "LenRatio= {:.4f}"
 
-    def run(self, trg, src):
+    def prepare_source(self, src):
+        return len(src.split()) + 1
+
+    def values_prepared(self, trg, src_size):
         trg_size = len(trg.split()) + 1
-        src_size = len(src.split()) + 1
-        return "LenRatio= {:.4f}".format(trg_size / float(src_size))
+        return [trg_size / float(src_size)]
 
 
-class LengthRatioChars(FeatureBase):
+class LengthRatioChars(BatchFeature):
     name = 'chratio'
-    desc = 'character length ratio'
+    labels = ['CharRatio']
+    template = "CharRatio= {:.4f}"
+
+    def prepare_source(self, src):
+        return len(''.join(src.split())) + 1
 
-    def run(self, trg, src):
+    def values_prepared(self, trg, src_size):
         trg_size = len(''.join(trg.split())) + 1
-        src_size = len(''.join(src.split())) + 1
-        return "CharRatio= {:.4f}".format(trg_size / float(src_size))
+        return [trg_size / float(src_size)]
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+# Bit-parallel Levenshtein alignment (Myers 1999, Hyyrö 2004) of two sequences
+# of hashable items, i.e. words or characters. All rows of a column of the
+# dynamic programming table are processed at once as bits of Python integers,
+# and the vertical and horizontal score deltas of each column are kept to
+# recover a minimal alignment by backtracing.
+#
+# Differences from difflib: opcodes() groups the alignment into opcodes in the
+# same way as difflib.SequenceMatcher.get_opcodes() does with its matching
+# blocks, i.e. a maximal gap between two matched blocks is one 'replace' if it
+# spans both sequences, otherwise one 'delete' or 'insert'. Ties are resolved
+# in favour of the earliest matches. The counts of opcodes are the same only
+# if the longest matching blocks found by difflib form a minimal alignment,
+# which is often not the case, e.g. for about a fifth of pairs of sentences
+# compared by characters, and for sequences longer than 200 items, for which
+# difflib ignores frequent items due to its autojunk heuristic. Counts the
+# same as difflib's are computed by features/matching.py.
+
+MATCH = 'M'
+SUB = 'S'
+DEL = 'D'
+INS = 'I'
+
+
+class Pattern(object):
+    # The first sequence with bit masks of positions of its items, which can be
+    # shared by alignments with many second sequences
+
+    def __init__(self, seq):
+        self.seq = seq
+        self.peq = {}
+        # Positions in the reversed sequence, see align()
+        for i, item in enumerate(reversed(seq)):
+            self.peq[item] = self.peq.get(item, 0) | (1 << i)
+
+
+# Returns the edit distance and the alignment as a string of operations, where
+# DEL removes an item of the first sequence and INS adds an item of the second
+# sequence. The pattern of the first sequence is created if not given.
+def align(seq1, seq2, pattern=None):
+    if pattern is None:
+        pattern = Pattern(seq1)
+    # Backtracing prefers matches at the end of the sequences, so reversed
+    # sequences are aligned to prefer earliest matches instead
+    seq1 = seq1[::-1]
+    seq2 = seq2[::-1]
+    m = len(seq1)
+    n = len(seq2)
+    if m == 0:
+        return n, INS * n
+    if n == 0:
+        return m, DEL * m
+
+    peq = pattern.peq
+    mask = (1 << m) - 1
+    high = 1 << (m - 1)
+    vp = mask
+    vn = 0
+    dist = m
+    columns = [(vp, vn, 0, 0)]
+    for item in seq2:
+        eq = peq.get(item, 0)
+        xv = eq | vn
+        xh = ((((eq & vp) + vp) & mask) ^ vp) | eq
+        hp = vn | (~(xh | vp) & mask)
+        hn = vp & xh
+        if hp & high:
+            dist += 1
+        elif hn & high:
+            dist -= 1
+        hp_shift = ((hp << 1) | 1) & mask
+        hn_shift = (hn << 1) & mask
+        vp = hn_shift | (~(xv | hp_shift) & mask)
+        vn = hp_shift & xv
+        columns.append((vp, vn, hp, hn))
+
+    trace = []
+    i = m
+    j = n
+    score = dist
+    while i > 0 and j > 0:
+        vp, vn, hp, hn = columns[j]
+        bit = 1 << (i - 1)
+        # D[i-1][j] from the vertical delta in column j
+        up = score - (1 if vp & bit else -1 if vn & bit else 0)
+        # D[i-1][j-1] from the horizontal delta in row i-1
+        if i == 1:
+            diag = up - 1
+        else:
+            bit >>= 1
+            diag = up - (1 if hp & bit else -1 if hn & bit else 0)
+        if seq1[i - 1] == seq2[j - 1] and diag == score:
+            trace.append(MATCH)
+            i -= 1
+            j -= 1
+        elif diag + 1 == score:
+            trace.append(SUB)
+            i -= 1
+            j -= 1
+        elif up + 1 == score:
+            trace.append(DEL)
+            i -= 1
+        else:
+            trace.append(INS)
+            j -= 1
+        score = diag if trace[-1] in (MATCH, SUB) else \
+            up if trace[-1] == DEL else score - 1
+    trace.extend(DEL * i)
+    trace.extend(INS * j)
+    # Reversed sequences have been aligned, so the trace is already in the
+    # original order
+    return dist, ''.join(trace)
+
+
+# Returns numbers of inserted, deleted and substituted items
+def edit_counts(seq1, seq2, pattern=None):
+    _, trace = align(seq1, seq2, pattern)
+    return trace.count(INS), trace.count(DEL), trace.count(SUB)
+
+
+# Returns opcodes in the format of difflib.SequenceMatcher.get_opcodes()
+def opcodes(seq1, seq2, pattern=None):
+    _, trace = align(seq1, seq2, pattern)
+    codes = []
+    i = j = 0
+    i_gap = j_gap = 0
+    for op in trace + MATCH:
+        if op == MATCH:
+            if i_gap < i or j_gap < j:
+                if i_gap < i and j_gap < j:
+                    tag = 'replace'
+                elif i_gap < i:
+                    tag = 'delete'
+                else:
+                    tag = 'insert'
+                codes.append((tag, i_gap, i, j_gap, j))
+            if codes and codes[-1][0] == 'equal':
+                codes[-1] = ('equal', codes[-1][1], i + 1, codes[-1][3], j + 1)
+            else:
+                codes.append(('equal', i, i + 1, j, j + 1))
+            i += 1
+            j += 1
+            i_gap = i
+            j_gap = j
+        else:
+            if op != INS:
+                i += 1
+            if op != DEL:
+                j += 1
+    # Remove the sentinel match
+    tag, i1, i2, j1, j2 = codes.pop()
+    if i2 - i1 > 1:
+        codes.append((tag, i1, i2 - 1, j1, j2 - 1))
+    return codes
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# Matching blocks and opcodes of two sequences of hashable items exactly as
+# computed by difflib.SequenceMatcher(None, seq1, seq2), i.e. the longest
+# matching block is found and the parts of the sequences before and after it
+# are matched recursively. Ties are resolved in favour of the block starting
+# earliest in the first sequence, then in the second sequence, and the
+# autojunk heuristic is applied: if the second sequence has at least 200
+# items, items occurring in it more than 1% of times plus one cannot start a
+# match, but matches can be extended over them.
+#
+# Unlike difflib, which indexes the second sequence (the hypothesis), the
+# positions of items of the first sequence (the source sentence) are indexed,
+# so that the index is shared by all hypotheses of a source sentence.
+
+AUTOJUNK_LENGTH = 200
+
+
+class Index(object):
+    # The first sequence with bit masks of positions of its items
+
+    def __init__(self, seq):
+        self.seq = seq
+        self.masks = {}
+        for i, item in enumerate(seq):
+            self.masks[item] = self.masks.get(item, 0) | (1 << i)
+
+
+def find_longest_match(seq1, seq2, masks, popular, alo, ahi, blo, bhi):
+    besti, bestj, bestsize = alo, blo, 0
+    region = (1 << ahi) - (1 << alo)
+    prev = 0
+    for j in range(blo, bhi):
+        if bhi - j < bestsize:
+            break
+        # Positions of matches with the item, of which only those that cannot
+        # be extended backwards and can be at least as long as the best match
+        # are measured
+        cur = masks.get(seq2[j], 0) & region
+        starts = cur & ~(prev << 1)
+        prev = cur
+        if starts and bestsize > 1:
+            starts &= (masks.get(seq2[j + bestsize - 1], 0) & region) >> \
+                (bestsize - 1)
+        while starts:
+            low = starts & -starts
+            starts ^= low
+            i = low.bit_length() - 1
+            limit = min(ahi - i, bhi - j)
+            if limit < bestsize or bestsize and \
+                    seq1[i + bestsize - 1] != seq2[j + bestsize - 1]:
+                continue
+            k = 1
+            while k < limit and seq1[i + k] == seq2[j + k] and \
+                    seq2[j + k] not in popular:
+                k += 1
+            # Matches are visited by their starts in the second sequence, so
+            # of equally long ones the earliest in the first sequence is kept
+            if k > bestsize or k == bestsize and i < besti:
+                besti, bestj, bestsize = i, j, k
+    # Extends the match over ignored frequent items
+    while besti > alo and bestj > blo and seq1[besti - 1] == seq2[bestj - 1]:
+        besti, bestj, bestsize = besti - 1, bestj - 1, bestsize + 1
+    while besti + bestsize < ahi and bestj + bestsize < bhi and \
+            seq1[besti + bestsize] == seq2[bestj + bestsize]:
+        bestsize += 1
+    return besti, bestj, bestsize
+
+
+# Returns matching blocks in the format of
+# difflib.SequenceMatcher.get_matching_blocks(). The index of the first
+# sequence is created if not given.
+def matching_blocks(seq1, seq2, index=None):
+    if index is None:
+        index = Index(seq1)
+    masks = index.masks
+    n = len(seq2)
+    if n >= AUTOJUNK_LENGTH:
+        limit = n // 100 + 1
+        popular = set(item for item in masks if seq2.count(item) > limit)
+        if popular:
+            masks = dict(masks)
+            for item in popular:
+                del masks[item]
+    else:
+        popular = ()
+
+    m = len(seq1)
+    queue = [(0, m, 0, n)]
+    blocks = []
+    while queue:
+        alo, ahi, blo, bhi = queue.pop()
+        i, j, k = block = find_longest_match(seq1, seq2, masks, popular,
+                                             alo, ahi, blo, bhi)
+        if k:
+            blocks.append(block)
+            if alo < i and blo < j:
+                queue.append((alo, i, blo, j))
+            if i + k < ahi and j + k < bhi:
+                queue.append((i + k, ahi, j + k, bhi))
+    blocks.sort()
+
+    # Adjacent blocks are joined
+    i1 = j1 = k1 = 0
+    joined = []
+    for i2, j2, k2 in blocks:
+        if i1 + k1 == i2 and j1 + k1 == j2:
+            k1 += k2
+        else:
+            if k1:
+                joined.append((i1, j1, k1))
+            i1, j1, k1 = i2, j2, k2
+    if k1:
+        joined.append((i1, j1, k1))
+    joined.append((m, n, 0))
+    return joined
+
+
+# Returns opcodes in the format of difflib.SequenceMatcher.get_opcodes()
+def opcodes(seq1, seq2, index=None):
+    codes = []
+    i = j = 0
+    for ai, bj, size in matching_blocks(seq1, seq2, index):
+        if i < ai and j < bj:
+            codes.append(('replace', i, ai, j, bj))
+        elif i < ai:
+            codes.append(('delete', i, ai, j, bj))
+        elif j < bj:
+            codes.append(('insert', i, ai, j, bj))
+        i = ai + size
+        j = bj + size
+        if size:
+            codes.append(('equal', ai, i, bj, j))
+    return codes
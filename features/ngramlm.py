@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+
+# Binary n-gram language model with backoff, built from an ARPA file and
+# memory-mapped for querying.
+#
+# N-grams are identified by 64-bit keys hashed from the key of their context
+# and the hash of their last word, so that keys of all n-grams of a sentence
+# are computed at once from hashes of its words. The file starts with a magic
+# string, the length of a JSON header and the header itself, followed by
+# arrays aligned to 64 bytes for each order n:
+#
+#   keys_n              uint64[count_n]   sorted keys of n-grams
+#   probs_n             uint8/16[...]     quantized log10 probabilities
+#   prob_codebook_n     float32[levels]   values of quantized probabilities
+#   backoffs_n          uint8/16[...]     quantized log10 backoff weights,
+#   backoff_codebook_n  float32[levels]   except for the highest order
+#
+# Keys are looked up by binary search, so a model is opened without loading
+# anything, and processes querying the same model share the page cache.
+# Different n-grams with the same key are practically impossible, but not
+# detected.
+
+import json
+import zlib
+import struct
+import hashlib
+
+import numpy as np
+
+MAGIC = b'YARNGRAM'
+VERSION = 1
+ALIGNMENT = 64
+
+BOS = '<s>'
+EOS = '</s>'
+UNK = '<unk>'
+
+# The log10 probability of unknown words if the model has no <unk>
+DEFAULT_UNK_PROB = -100.0
+MAX_HASH_CACHE = 1000000
+
+
+def load(path):
+    return NGramModel(path)
+
+
+class NGramModel(object):
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic = f.read(len(MAGIC))
+            if magic != MAGIC:
+                raise Exception('Not a binary language model: {}'
+                                .format(path))
+            size, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(size).decode('utf-8'))
+        if header['version'] != VERSION:
+            raise Exception('Unsupported version of binary language model: '
+                            '{}'.format(header['version']))
+        self.header = header
+        self.order = header['order']
+        self.unk_prob = header['unk_prob']
+        self.checksum = str(header['checksum'])
+        self.arrays = {}
+        for name, (offset, dtype, shape) in header['arrays'].items():
+            if not all(shape):
+                array = np.zeros(shape, dtype=dtype)
+            else:
+                array = np.memmap(path, dtype=str(dtype), mode='r',
+                                  offset=offset, shape=tuple(shape))
+            self.arrays[str(name)] = array
+        self.hash_cache = {}
+
+    def word_hashes(self, words):
+        cache = self.hash_cache
+        if len(cache) > MAX_HASH_CACHE:
+            cache.clear()
+        hashes = []
+        for word in words:
+            h = cache.get(word)
+            if h is None:
+                h = cache[word] = word_hash(word)
+            hashes.append(h)
+        return np.array(hashes, dtype=np.uint64)
+
+    # Returns log10 probabilities of sentences, given as lists of words, with
+    # sentence boundaries, and numbers of unknown words
+    def score_batch(self, sentences):
+        words = []
+        lengths = []
+        for sent in sentences:
+            words.append(BOS)
+            words.extend(sent)
+            words.append(EOS)
+            lengths.append(len(sent) + 2)
+        sent_idx = np.repeat(np.arange(len(sentences)), lengths)
+        # Position of each word in its sentence, i.e. the length of history
+        pos = np.arange(len(words)) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths)
+
+        hashes = self.word_hashes(words)
+        # Unknown words are replaced with <unk> also in contexts
+        with np.errstate(over='ignore'):
+            unknown = ~self.find(1, mix(hashes))[0]
+        hashes[unknown] = word_hash(UNK)
+        keys = ngram_keys(hashes, self.order)
+
+        n_words = len(words)
+        hits = np.zeros((self.order, n_words), dtype=bool)
+        probs = np.zeros((self.order, n_words))
+        # Backoff weights of contexts of each order ending before each word
+        context_backoffs = np.zeros((self.order + 1, n_words))
+        for n in range(1, self.order + 1):
+            hit, idx = self.find(n, keys[n - 1])
+            hit &= pos >= n - 1
+            hits[n - 1] = hit
+            probs[n - 1, hit] = self.lookup('prob', n, idx[hit])
+            if n < self.order:
+                backoffs = np.zeros(n_words)
+                backoffs[hit] = self.lookup('backoff', n, idx[hit])
+                context_backoffs[n, 1:] = backoffs[:-1]
+
+        # The longest n-gram ending at each word, 0 for unknown words if the
+        # model has no <unk>
+        longest = np.zeros(n_words, dtype=np.int64)
+        for n in range(1, self.order + 1):
+            longest[hits[n - 1]] = n
+        cols = np.arange(n_words)
+        logprobs = np.where(longest > 0, probs[np.maximum(longest - 1, 0),
+                                               cols], self.unk_prob)
+        # Backoff weights of all contexts at least as long as the history of
+        # the longest n-gram
+        backoff_sums = np.cumsum(context_backoffs[::-1], axis=0)[::-1]
+        logprobs += backoff_sums[np.maximum(longest, 1), cols]
+
+        scored = pos > 0
+        scores = np.bincount(sent_idx[scored], weights=logprobs[scored],
+                             minlength=len(sentences))
+        oovs = np.bincount(sent_idx[scored & unknown],
+                           minlength=len(sentences))
+        return scores.tolist(), oovs.tolist()
+
+    # Returns a mask of keys of n-grams of order n found in the model, and
+    # their indices
+    def find(self, n, keys):
+        table = self.arrays['keys_{}'.format(n)]
+        if not len(table):
+            return np.zeros(len(keys), dtype=bool), np.zeros(len(keys), int)
+        idx = np.searchsorted(table, keys)
+        idx[idx == len(table)] = 0
+        return table[idx] == keys, idx
+
+    def lookup(self, kind, n, idx):
+        codes = self.arrays['{}s_{}'.format(kind, n)][idx]
+        return self.arrays['{}_codebook_{}'.format(kind, n)][codes]
+
+
+def word_hash(word):
+    data = _encode(word)
+    return (zlib.crc32(data) & 0xffffffff) << 32 | \
+        (zlib.adler32(data) & 0xffffffff)
+
+
+def mix(x):
+    # The finalizer of splitmix64 on arrays of unsigned 64-bit integers
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+# Returns keys of n-grams of orders 1 to max_order ending at each word of the
+# sequence of word hashes, keys of n-grams starting before the sequence are
+# not valid
+def ngram_keys(hashes, max_order):
+    keys = np.zeros((max_order, len(hashes)), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        keys[0] = mix(hashes)
+        for n in range(2, max_order + 1):
+            keys[n - 1, 1:] = mix(keys[n - 2, :-1] ^ hashes[1:])
+    return keys
+
+
+# Builds a binary model from an ARPA file with values quantized to the given
+# number of bits
+def build(arpa, output, bits=8):
+    checksum = hashlib.sha1()
+    ngrams = read_arpa(arpa, checksum)
+    order = len(ngrams)
+    code_dtype = np.uint8 if bits <= 8 else np.uint16
+
+    arrays = []
+    unk_prob = DEFAULT_UNK_PROB
+    duplicates = 0
+    for n in range(1, order + 1):
+        words, probs, backoffs = ngrams[n - 1]
+        if n == 1 and UNK in words:
+            unk_prob = probs[words.index(UNK)]
+        hashes = np.array([word_hash(w) for ngram in words
+                           for w in ngram.split(' ')],
+                          dtype=np.uint64).reshape(-1, n)
+        with np.errstate(over='ignore'):
+            keys = mix(hashes[:, 0])
+            for j in range(1, n):
+                keys = mix(keys ^ hashes[:, j])
+        keys, first = np.unique(keys, return_index=True)
+        duplicates += len(words) - len(keys)
+        prob_codes, prob_codebook = quantize(np.array(probs)[first], bits)
+        arrays.append(('keys_{}'.format(n), keys))
+        arrays.append(('probs_{}'.format(n), prob_codes.astype(code_dtype)))
+        arrays.append(('prob_codebook_{}'.format(n), prob_codebook))
+        if n < order:
+            backoff_codes, backoff_codebook = quantize(
+                np.array(backoffs)[first], bits)
+            arrays.append(('backoffs_{}'.format(n),
+                           backoff_codes.astype(code_dtype)))
+            arrays.append(('backoff_codebook_{}'.format(n),
+                           backoff_codebook))
+
+    header = {
+        'version': VERSION,
+        'order': order,
+        'bits': bits,
+        'unk_prob': unk_prob,
+        'counts': [len(words) for words, _, _ in ngrams],
+        'checksum': checksum.hexdigest(),
+        'arrays': {},
+    }
+    write_arrays(output, header, arrays)
+    return header, duplicates
+
+
+def quantize(values, bits):
+    # Codebook values are means of bins with equal numbers of values
+    values = values.astype(np.float32)
+    levels = 1 << bits
+    uniq = np.unique(values)
+    if len(uniq) <= levels:
+        return np.searchsorted(uniq, values), uniq
+    order = np.argsort(values, kind='mergesort')
+    bins = np.minimum(np.arange(len(values)) * levels // len(values),
+                      levels - 1)
+    codebook = (np.bincount(bins, weights=values[order], minlength=levels) /
+                np.maximum(np.bincount(bins, minlength=levels), 1))
+    codes = np.empty(len(values), dtype=np.int64)
+    codes[order] = bins
+    return codes, codebook.astype(np.float32)
+
+
+def read_arpa(arpa, checksum=None):
+    # Returns lists of n-grams, log10 probabilities and backoff weights of
+    # each order
+    ngrams = []
+    section = None
+    for line in arpa:
+        if checksum is not None:
+            checksum.update(_encode(line))
+        line = line.strip()
+        if not line or line.startswith('ngram ') or line == '\\data\\':
+            continue
+        if line == '\\end\\':
+            break
+        if line.startswith('\\') and line.endswith('-grams:'):
+            section = ([], [], [])
+            ngrams.append(section)
+            n = int(line[1:line.index('-')])
+            if n != len(ngrams):
+                raise Exception('Unexpected ARPA section: {}'.format(line))
+            continue
+        if section is None:
+            continue
+        fields = line.split()
+        words, probs, backoffs = section
+        probs.append(float(fields[0]))
+        words.append(' '.join(fields[1:n + 1]))
+        backoffs.append(float(fields[n + 1]) if len(fields) > n + 1 else 0.0)
+    if not ngrams:
+        raise Exception('No n-grams found in ARPA file')
+    return ngrams
+
+
+def write_arrays(output, header, arrays):
+    # The size of the header depends on offsets of arrays, so offsets are
+    # computed for a header padded to the alignment
+    header_size = 0
+    while True:
+        offset = _align(len(MAGIC) + 8 + header_size)
+        for name, array in arrays:
+            header['arrays'][name] = [offset, array.dtype.name,
+                                      list(array.shape)]
+            offset = _align(offset + array.nbytes)
+        data = json.dumps(header, sort_keys=True).encode('utf-8')
+        if len(data) <= header_size:
+            break
+        header_size = _align(len(data))
+    data += b' ' * (header_size - len(data))
+
+    output.write(MAGIC)
+    output.write(struct.pack('<Q', len(data)))
+    output.write(data)
+    position = len(MAGIC) + 8 + len(data)
+    for name, array in arrays:
+        position = _pad(output, position, header['arrays'][name][0])
+        buf = np.ascontiguousarray(array).tobytes()
+        output.write(buf)
+        position += len(buf)
+    _pad(output, position, _align(position))
+
+
+def _align(position):
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _pad(output, position, target):
+    output.write(b'\0' * (target - position))
+    return target
+
+
+def _encode(text):
+    return text if isinstance(text, bytes) else text.encode('utf-8')
@@ -1,18 +1,21 @@
-from base import FeatureBase
-from difflib import SequenceMatcher
+from base import BatchFeature
 
 
-class WordPrecisionAndRecall(FeatureBase):
+class WordPrecisionAndRecall(BatchFeature):
     name = 'wprec'
-    desc = 'word precision and recall'
+    labels = ['WordPrecision', 'WordRecall']
+    template = "WordPrecision= {:.4f} WordRecall= {:.4f}"
 
-    def run(self, trg, src):
+    def prepare_source(self, src):
         src_toks = src.split()
+        return src_toks, set(src_toks)
+
+    def values_prepared(self, trg, prepared):
+        src_toks, src_set = prepared
         trg_toks = trg.split()
-        src_set = set(src_toks)
         prec = len([t for t in trg_toks if t in src_set]) / \
             float(len(trg_toks) + 1)
         trg_set = set(trg_toks)
         recl = len([t for t in src_toks if t in trg_set]) / \
             float(len(src_toks) + 1)
-        return "WordPrecision= {:.4f} WordRecall= {:.4f}".format(prec, recl)
+        return [prec, recl]
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+# In-process computation of TER statistics following the heuristics of
+# tercom 0.7.25: greedy search for word shifts reducing the beam-restricted
+# edit distance, with the shift limits and the ranking of candidate shifts
+# used by tercom. Sentences are compared case-sensitively without any
+# normalization, as in tools/runTER.py.
+
+MAX_SHIFT_SIZE = 10
+MAX_SHIFT_DIST = 50
+MAX_SHIFT_CANDIDATES = 1000
+BEAM_WIDTH = 25
+
+INF = float('inf')
+
+OP_MATCH = ' '
+OP_SUB = 'S'
+OP_INS = 'I'
+OP_DEL = 'D'
+
+
+# Returns numbers of insertions, deletions, substitutions, shifts and shifted
+# words needed to turn the list of hypothesis words into the list of reference
+# words
+def ter_stats(hyp, ref):
+    if not ref:
+        return len(hyp), 0, 0, 0, 0
+
+    edit_dist = EditDistance(ref, len(hyp))
+    shifts = 0
+    shifted_words = 0
+    checked = 0
+    while True:
+        delta, new_hyp, length, checked = find_best_shift(
+            hyp, ref, edit_dist, checked)
+        if checked >= MAX_SHIFT_CANDIDATES or delta <= 0:
+            break
+        hyp = new_hyp
+        shifts += 1
+        shifted_words += length
+
+    _, trace = edit_dist(hyp)
+    return (trace.count(OP_INS), trace.count(OP_DEL), trace.count(OP_SUB),
+            shifts, shifted_words)
+
+
+# Word-level edit distance restricted to a beam around the diagonal. Rows of
+# the dynamic programming table computed for the previous hypothesis are reused
+# for the common prefix, which makes scoring of consecutive shift candidates
+# cheap.
+class EditDistance(object):
+
+    def __init__(self, ref, hyp_len):
+        self.ref = ref
+        self.ratio = len(ref) / float(hyp_len) if hyp_len else 1.0
+        self.hyp = []
+        self.costs = [list(range(len(ref) + 1))]
+        self.ops = [[OP_MATCH] + [OP_DEL] * len(ref)]
+        self.spans = [(0, len(ref) + 1)]
+
+    def __call__(self, hyp):
+        prefix = 0
+        for w1, w2 in zip(self.hyp, hyp):
+            if w1 != w2:
+                break
+            prefix += 1
+        del self.hyp[prefix:]
+        del self.costs[prefix + 1:]
+        del self.ops[prefix + 1:]
+        del self.spans[prefix + 1:]
+        for i in range(prefix, len(hyp)):
+            self._add_row(hyp[i], i + 1, len(hyp))
+        return self.costs[-1][-1], self._trace()
+
+    def _add_row(self, word, i, hyp_len):
+        ref = self.ref
+        ref_len = len(ref)
+        prev = self.costs[-1]
+        _, prev_end = self.spans[-1]
+
+        diag = int(i * self.ratio)
+        # Make sure the beam overlaps with the previous row, otherwise the
+        # last cell becomes unreachable for very different lengths
+        start = max(0, min(diag - BEAM_WIDTH, prev_end - 1))
+        if i == hyp_len:
+            end = ref_len + 1
+        else:
+            end = max(start + 1, min(ref_len + 1, diag + BEAM_WIDTH))
+
+        costs = [INF] * (ref_len + 1)
+        ops = [None] * (ref_len + 1)
+        for j in range(start, end):
+            if j == 0:
+                costs[0] = prev[0] + 1
+                ops[0] = OP_INS
+                continue
+            # Ties are resolved in the order: match/substitution, insertion,
+            # deletion
+            if word == ref[j - 1]:
+                cost, op = prev[j - 1], OP_MATCH
+            else:
+                cost, op = prev[j - 1] + 1, OP_SUB
+            if prev[j] + 1 < cost:
+                cost, op = prev[j] + 1, OP_INS
+            if costs[j - 1] + 1 < cost:
+                cost, op = costs[j - 1] + 1, OP_DEL
+            costs[j] = cost
+            ops[j] = op
+
+        self.hyp.append(word)
+        self.costs.append(costs)
+        self.ops.append(ops)
+        self.spans.append((start, end))
+
+    def _trace(self):
+        trace = []
+        i = len(self.hyp)
+        j = len(self.ref)
+        while i > 0 or j > 0:
+            op = self.ops[i][j]
+            trace.append(op)
+            if op == OP_INS:
+                i -= 1
+            elif op == OP_DEL:
+                j -= 1
+            else:
+                i -= 1
+                j -= 1
+        trace.reverse()
+        return ''.join(trace)
+
+
+def find_best_shift(hyp, ref, edit_dist, checked):
+    score, trace = edit_dist(hyp)
+    align, hyp_err, ref_err = trace_to_alignment(trace)
+
+    best = None
+    for hyp_start, ref_start, length in find_shift_candidates(hyp, ref):
+        # Shift only words that are wrong to a position where the reference
+        # is not matched yet
+        if not any(hyp_err[hyp_start:hyp_start + length]):
+            continue
+        if not any(ref_err[ref_start:ref_start + length]):
+            continue
+        if hyp_start <= align[ref_start] < hyp_start + length:
+            continue
+
+        prev_idx = -1
+        for offset in range(-1, length):
+            if ref_start + offset == -1:
+                idx = 0
+            elif ref_start + offset in align:
+                idx = align[ref_start + offset] + 1
+            else:
+                break
+            if idx == prev_idx:
+                continue
+            prev_idx = idx
+
+            shifted = perform_shift(hyp, hyp_start, length, idx)
+            # The ranking of shifts as in tercom: the largest gain, then the
+            # longest shift, then the earliest hypothesis and target positions
+            cand = (score - edit_dist(shifted)[0],
+                    length, -hyp_start, -idx, shifted)
+            checked += 1
+            if best is None or cand > best:
+                best = cand
+        if checked >= MAX_SHIFT_CANDIDATES:
+            break
+
+    if best is None:
+        return 0, hyp, 0, checked
+    return best[0], best[4], best[1], checked
+
+
+def find_shift_candidates(hyp, ref):
+    hyp_len = len(hyp)
+    ref_len = len(ref)
+    for hyp_start in range(hyp_len):
+        for ref_start in range(ref_len):
+            if abs(ref_start - hyp_start) > MAX_SHIFT_DIST:
+                continue
+            length = 0
+            while length < MAX_SHIFT_SIZE \
+                    and hyp[hyp_start + length] == ref[ref_start + length]:
+                length += 1
+                yield hyp_start, ref_start, length
+                if hyp_start + length == hyp_len \
+                        or ref_start + length == ref_len:
+                    break
+
+
+def perform_shift(words, start, length, target):
+    if target < start:
+        return words[:target] + words[start:start + length] \
+            + words[target:start] + words[start + length:]
+    elif target > start + length:
+        return words[:start] + words[start + length:target] \
+            + words[start:start + length] + words[target:]
+    return words[:start] + words[start + length:length + target] \
+        + words[start:start + length] + words[length + target:]
+
+
+def trace_to_alignment(trace):
+    hyp_pos = -1
+    ref_pos = -1
+    align = {}
+    hyp_err = []
+    ref_err = []
+    for op in trace:
+        if op == OP_INS:
+            hyp_pos += 1
+            hyp_err.append(1)
+        elif op == OP_DEL:
+            ref_pos += 1
+            align[ref_pos] = hyp_pos
+            ref_err.append(1)
+        else:
+            hyp_pos += 1
+            ref_pos += 1
+            align[ref_pos] = hyp_pos
+            err = int(op == OP_SUB)
+            hyp_err.append(err)
+            ref_err.append(err)
+    return align, hyp_err, ref_err
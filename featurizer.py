@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+# Helpers for adding features to n-best lists shared by add-features.py,
+# rescore-with-features.py and rescore-server.py
+
+import os
+import math
+import itertools
+from collections import OrderedDict
+
+import features
+import runstats
+
+
+FEATURE_FIELD = 2
+# Number of n-best lines for which line-aligned features are prepared at once
+CHUNK_SIZE = 10000
+
+FEATURES = OrderedDict((name, features.describe(name))
+                       for name in features.FEATURES)
+
+
+def get_feature_class(name):
+    return features.load(name)
+
+
+def is_file_based(feat):
+    return callable(getattr(feat, "prepare", None))
+
+
+def is_prefetching(feat):
+    return callable(getattr(feat, "prefetch", None))
+
+
+# Values of file-based and prefetching features are prepared for chunks of the
+# n-best list and consumed by run() line by line
+def is_line_aligned(feat):
+    return is_file_based(feat) or is_prefetching(feat)
+
+
+def has_line_aligned_features(fs):
+    return any(is_line_aligned(f) for f in fs)
+
+
+def create_features(names):
+    # Keep features in the given order
+    uniq_names = []
+    for name in names:
+        if name not in uniq_names:
+            uniq_names.append(name)
+    return [get_feature_class(name)() for name in uniq_names]
+
+
+class DedupScorer(object):
+    # Runs features once for identical hypotheses of the same source sentence
+    # and reuses their values for duplicates. Line-aligned features return
+    # values prepared for lines of the n-best list, so they are run for every
+    # line. Values already known, e.g. from a cache,
+    # can be given in scores with None for features to be run.
+
+    def __init__(self, feats):
+        self.feats = feats
+        self.line_aligned = [is_line_aligned(f) for f in feats]
+        self.src = None
+        self.memo = {}
+        self.duplicates = 0
+
+    def run(self, trg, src, scores=None):
+        if src != self.src:
+            self.src = src
+            self.memo = {}
+        memo = self.memo.get(trg)
+        if memo is not None:
+            self.duplicates += 1
+        result = []
+        for i, feat in enumerate(self.feats):
+            if scores is not None and scores[i] is not None:
+                result.append(scores[i])
+            elif memo is not None and not self.line_aligned[i]:
+                result.append(memo[i])
+            else:
+                result.append(feat.run(trg, src))
+        if memo is None:
+            self.memo[trg] = result
+        return result
+
+    # The same as run() for hypotheses of the same source sentence, where
+    # features are run with run_batch() on unique hypotheses not seen before
+    def run_batch(self, trgs, src, scores=None):
+        if src != self.src:
+            self.src = src
+            self.memo = {}
+        results = [list(s) if s else [None] * len(self.feats)
+                   for s in scores or [None] * len(trgs)]
+        for trg, result in zip(trgs, results):
+            if trg in self.memo:
+                self.duplicates += 1
+            memo = self.memo.setdefault(trg, [None] * len(self.feats))
+            for i, value in enumerate(result):
+                if memo[i] is None:
+                    memo[i] = value
+
+        for i, feat in enumerate(self.feats):
+            missing = [n for n, result in enumerate(results)
+                       if result[i] is None]
+            if self.line_aligned[i]:
+                for n in missing:
+                    results[n][i] = feat.run(trgs[n], src)
+                continue
+            new_trgs = list(OrderedDict((trgs[n], None) for n in missing
+                                        if self.memo[trgs[n]][i] is None))
+            if new_trgs:
+                for trg, value in zip(new_trgs, feat.run_batch(new_trgs, src)):
+                    self.memo[trg][i] = value
+            for n in missing:
+                results[n][i] = self.memo[trgs[n]][i]
+        return results
+
+
+# Returns outputs of features with values replaced by their logarithms,
+# except for values which are logarithms already
+def log_scores(scores, feats):
+    result = []
+    for score, feat in zip(scores, feats):
+        label = None
+        for elem in score.split():
+            if elem.endswith('='):
+                label = elem[:-1]
+                result.append(elem)
+            elif label in feat.log_labels:
+                result.append(elem)
+            else:
+                result.append(str(log_value(float(elem), label)))
+    return result
+
+
+def log_value(val, label=None):
+    if val < 0:
+        raise ValueError('Cannot log negative value {} of feature {}'
+                         .format(val, label))
+    return math.log(val) if val else -100.0
+
+
+def extend_line(line, scores):
+    fields = [f.strip() for f in line.split('|||')]
+    fields[FEATURE_FIELD] += ' ' + ' '.join(scores)
+    return ' ||| '.join(fields) + '\n'
+
+
+def iterate_nbest_sentences(nbest, source):
+    sid = 0
+    prev_sid = -1
+    for line in nbest:
+        line = line.rstrip('\n')
+        sid, trg, _ = line.split(' ||| ', 2)
+        sid = int(sid)
+        if sid > prev_sid:
+            src = next(source).strip()
+        yield trg, src, line
+        prev_sid = sid
+
+
+def iterate_sentence_groups(lines):
+    # Groups items of iterate_nbest_sentences() by sentences, yielding source
+    # sentences with lists of pairs of hypotheses and n-best lines
+    for _, group in itertools.groupby(
+            lines, key=lambda item: item[2].split(' ||| ', 1)[0]):
+        group = list(group)
+        yield group[0][1], [(trg, line) for trg, _, line in group]
+
+
+def iterate_prepared_sentences(nbest, source, feats, work_dir,
+                               size=CHUNK_SIZE, stats=None):
+    # The same as iterate_nbest_sentences, but line-aligned features are
+    # prepared for chunks of at most size lines before the lines of each chunk
+    # are yielded, so the n-best list is read only once and can be a pipe.
+    # File-based features are prepared with prepare() on parallel files of
+    # each chunk, and prefetching features with prefetch() on pairs of
+    # hypotheses and source sentences. Then run() is called for each line of
+    # the chunk in order
+    lines = iterate_nbest_sentences(nbest, source)
+    aligned_feats = [f for f in feats if is_line_aligned(f)]
+    if not aligned_feats:
+        return lines
+    return _iterate_chunks(lines, aligned_feats, work_dir, size, stats)
+
+
+def _iterate_chunks(lines, feats, work_dir, size, stats):
+    file_feats = [f for f in feats if is_file_based(f)]
+    if file_feats and not os.path.exists(work_dir):
+        os.mkdir(work_dir)
+    src_file = os.path.join(work_dir, 'source.txt')
+    trg_file = os.path.join(work_dir, 'target.txt')
+    while True:
+        chunk = list(itertools.islice(lines, size))
+        if not chunk:
+            break
+        if file_feats:
+            with open(src_file, 'w') as src_io, \
+                    open(trg_file, 'w') as trg_io:
+                for trg, src, _ in chunk:
+                    src_io.write(src + '\n')
+                    trg_io.write(trg + '\n')
+        for f in feats:
+            if is_file_based(f):
+                with runstats.timer(stats, 'prepare:' + f.name):
+                    f.prepare(src_file, trg_file, work_dir)
+            else:
+                with runstats.timer(stats, 'prefetch:' + f.name):
+                    f.prefetch([(trg, src) for trg, src, _ in chunk])
+        for item in chunk:
+            yield item
@@ -4,12 +4,19 @@
 import sys
 import argparse
 
+import compressed
+import nbestbin
+
 FEATURE_FIELD = 2
 
 
 def main():
     args = parse_user_args()
 
+    if nbestbin.is_binary(args.input):
+        merge_binary(nbestbin.load(args.input.name), args)
+        return
+
     for i, line in enumerate(args.input):
         fields = line.strip().split(' ||| ')
         feats = fields[FEATURE_FIELD].split()
@@ -26,10 +33,9 @@ def main():
         old_feats = []
         for feat in feats:
             if feat.endswith('='):
-                if feat[:-1] in args.features:
-                    keep = True
-                    if not name:
-                        name = feat[:-1]
+                keep = feat[:-1] in args.features
+                if keep and not name:
+                    name = feat[:-1]
             elif keep:
                 scores.append(float(feat))
             if not keep:
@@ -41,13 +47,44 @@ def main():
         args.output.write(' ||| '.join(fields) + '\n')
 
 
+def merge_binary(nbest, args):
+    feat_names = [name for name, _ in nbest.schema]
+    for f in args.features:
+        if f not in feat_names:
+            sys.stderr.write("Warning: Feature '{}' not found\n".format(f))
+
+    name = args.new_name
+    merged = []
+    kept = []
+    for i, feat in enumerate(nbest.columns()):
+        if feat in args.features:
+            merged.append(i)
+            if not name:
+                name = feat
+        else:
+            kept.append(i)
+    schema = [(name, 1)] + [(f, n) for f, n in nbest.schema
+                            if f not in args.features]
+
+    output = getattr(args.output, 'buffer', args.output)
+    writer = nbestbin.NBestWriter(output, schema, dtype=nbest.dtype)
+    for sid, start, end in nbest.iterate_sentences():
+        feats = nbest.features[start:end]
+        scores = feats[:, merged].sum(axis=1).round(4)
+        for i, score, values in zip(range(start, end), scores,
+                                    feats[:, kept].tolist()):
+            writer.add(sid, nbest.hyp_text(i), schema, [score] + values,
+                       nbest.scores[i], nbest.hyp_extra(i))
+    writer.close()
+
+
 def parse_user_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', '--input', metavar='FILE', nargs='?',
-                        type=argparse.FileType('r'), default=sys.stdin,
+                        type=compressed.FileType('r'), default=sys.stdin,
                         help='input n-best list, default: STDIN')
     parser.add_argument('-o', '--output', metavar='FILE', nargs='?',
-                        type=argparse.FileType('w'), default=sys.stdout,
+                        type=compressed.FileType('w'), default=sys.stdout,
                         help='output n-best list, default: STDOUT')
     parser.add_argument('-f', '--features', metavar='FEATURE', nargs='+',
                         required=True,
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+# In-process sufficient statistics of hypotheses for metrics of mira.Metric,
+# so that weights can be evaluated without the Moses extractor:
+#
+#   BLEU      matched and total n-grams for n = 1..4 and the closest reference
+#             length, as in the Moses BLEU scorer
+#   TER       the smallest number of edits including shifts among references
+#             and the average reference length
+#   M2SCORER  numbers of correct, proposed and gold edits. Edits of the
+#             hypothesis are extracted from its minimal Levenshtein alignment
+#             with the source sentence instead of searching for the edits
+#             matching gold edits best as the MaxMatch scorer does, so the
+#             statistics are an approximation of M2 scores
+#
+# The M2 approximation is used only by evaluate.py -m m2-approx, train.py runs
+# the extractor for M2. Post-processing filters are shared with train.py, which
+# applies them to hypotheses also for the extractor.
+
+import re
+from collections import Counter
+
+import numpy as np
+
+import compressed
+from features.levenshtein import opcodes
+from features.tercalc import ter_stats
+
+BLEU_ORDER = 4
+
+
+def _uppercase_first(match):
+    first = match.group(2)
+    if isinstance(first, bytes):
+        # Multibyte characters are matched byte by byte in Python 2
+        return match.group(1) + first.decode('utf-8').upper().encode('utf-8')
+    return match.group(1) + first.upper()
+
+
+UPPERCASE_FIRST = (re.compile(r'^( *)([\x00-\x7f]|[\xc0-\xff][\x80-\xbf]*)'
+                              if str is bytes else r'^( *)(.)'),
+                   _uppercase_first)
+DEBPE = (re.compile(r'@@ '), '')
+
+FILTERS = {
+    'none': [],
+    'default': [UPPERCASE_FIRST, DEBPE],
+    'debpe': [DEBPE],
+    'ape': [(re.compile(r'<step>'), ''), UPPERCASE_FIRST, DEBPE,
+            (re.compile(r'  '), ' ')],
+}
+
+
+def apply_filter(name, text):
+    for regex, repl in FILTERS[name]:
+        text = regex.sub(repl, text)
+    return text
+
+
+def create_scorer(sctype, config, ref_files):
+    if sctype == 'BLEU':
+        return BleuStats(ref_files, config)
+    if sctype == 'TER':
+        return TerStats(ref_files, config)
+    if sctype == 'M2SCORER':
+        return M2Stats(ref_files, config)
+    raise ValueError('Metric {} is not supported in-process'.format(sctype))
+
+
+class BleuStats(object):
+
+    def __init__(self, ref_files, config):
+        self.lowercase = config.get('case', 'true') == 'false'
+        refs = zip(*[read_lines(path) for path in ref_files])
+        self.ref_counts = []
+        self.ref_lengths = []
+        for sent_refs in refs:
+            max_counts = Counter()
+            lengths = []
+            for ref in sent_refs:
+                toks = self.tokenize(ref)
+                lengths.append(len(toks))
+                for ngram, count in ngram_counts(toks).items():
+                    max_counts[ngram] = max(max_counts[ngram], count)
+            self.ref_counts.append(max_counts)
+            self.ref_lengths.append(lengths)
+
+    def tokenize(self, text):
+        return (text.lower() if self.lowercase else text).split()
+
+    def stats(self, sid, hyp):
+        toks = self.tokenize(hyp)
+        ref_counts = self.ref_counts[sid]
+        correct = [0] * BLEU_ORDER
+        for ngram, count in ngram_counts(toks).items():
+            correct[len(ngram) - 1] += min(count, ref_counts[ngram])
+        stats = []
+        for n in range(BLEU_ORDER):
+            stats.extend([correct[n], max(len(toks) - n, 0)])
+        # The closest reference length, the shorter one for ties
+        stats.append(min(self.ref_lengths[sid],
+                         key=lambda length: (abs(length - len(toks)),
+                                             length)))
+        return stats
+
+
+def ngram_counts(toks):
+    counts = Counter()
+    for n in range(1, BLEU_ORDER + 1):
+        for i in range(len(toks) - n + 1):
+            counts[tuple(toks[i:i + n])] += 1
+    return counts
+
+
+class TerStats(object):
+
+    def __init__(self, ref_files, config):
+        self.lowercase = config.get('case', 'true') == 'false'
+        self.refs = [[self.tokenize(ref) for ref in sent_refs]
+                     for sent_refs in zip(*[read_lines(path)
+                                            for path in ref_files])]
+
+    def tokenize(self, text):
+        return (text.lower() if self.lowercase else text).split()
+
+    def stats(self, sid, hyp):
+        toks = self.tokenize(hyp)
+        refs = self.refs[sid]
+        edits = min(sum(ter_stats(toks, ref)[:4]) for ref in refs)
+        return [edits, sum(len(ref) for ref in refs) / float(len(refs))]
+
+
+class M2Stats(object):
+
+    def __init__(self, ref_files, config):
+        self.lowercase = config.get('case', 'true') == 'false'
+        self.sources = []
+        self.gold = []
+        # All annotators are given in a single M2 file
+        for source, annotators in read_m2(ref_files[0]):
+            self.sources.append(self.tokenize(source))
+            self.gold.append([set(self._normalize(e) for e in edits)
+                              for edits in annotators])
+
+    def tokenize(self, text):
+        return (text.lower() if self.lowercase else text).split()
+
+    def _normalize(self, edit):
+        start, end, correction = edit
+        return start, end, correction.lower() if self.lowercase \
+            else correction
+
+    def stats(self, sid, hyp):
+        source = self.sources[sid]
+        toks = self.tokenize(hyp)
+        edits = set((i1, i2, ' '.join(toks[j1:j2]))
+                    for tag, i1, i2, j1, j2 in opcodes(source, toks)
+                    if tag != 'equal')
+        # The annotator with the most correct edits, then the fewest edits
+        best = max(([len(edits & gold), len(edits), len(gold)]
+                    for gold in self.gold[sid]),
+                   key=lambda s: (s[0], -s[2]))
+        return best
+
+
+def read_m2(path):
+    # Yields source sentences with lists of gold edits of each annotator
+    source = None
+    annotators = {}
+    with compressed.open_file(path) as inp:
+        for line in inp:
+            line = line.strip()
+            if line.startswith('S '):
+                source = line[2:]
+                annotators = {}
+            elif line.startswith('A '):
+                fields = line[2:].split('|||')
+                start, end = [int(i) for i in fields[0].split()]
+                annotator = fields[-1]
+                edits = annotators.setdefault(annotator, [])
+                if start < 0 or fields[1] == 'noop':
+                    continue
+                correction = fields[2].strip()
+                if correction == '-NONE-':
+                    correction = ''
+                edits.append((start, end, correction))
+            elif not line and source is not None:
+                yield source, list(annotators.values()) or [[]]
+                source = None
+    if source is not None:
+        yield source, list(annotators.values()) or [[]]
+
+
+def read_lines(path):
+    with compressed.open_file(path) as inp:
+        return [line.rstrip('\n') for line in inp]
+
+
+# Returns a matrix of statistics of hypotheses given with sentence ids
+def compute_stats(scorer, sent_ids, hyps, filter_name='none'):
+    return np.array([scorer.stats(sid, apply_filter(filter_name, hyp))
+                     for sid, hyp in zip(sent_ids, hyps)], dtype=np.float64)
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+# Batch k-best MIRA (Cherry and Foster, 2012) following kbmira from Moses. The
+# optimizer runs over in-memory arrays: a matrix of tuned feature values and a
+# matrix of metric sufficient statistics for all hypotheses, and a vector of
+# scores from features with fixed weights.
+
+import sys
+
+import numpy as np
+
+BLEU_ORDER = 4
+
+
+class NBestData(object):
+
+    def __init__(self, features, stats, offsets, fixed=None):
+        self.features = np.asarray(features, dtype=np.float64)
+        self.stats = np.asarray(stats, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        if fixed is None:
+            fixed = np.zeros(len(self.features))
+        self.fixed = np.asarray(fixed, dtype=np.float64)
+        self.sent_idx = np.repeat(np.arange(len(self.offsets) - 1),
+                                  np.diff(self.offsets))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def sentence(self, k):
+        start, end = self.offsets[k], self.offsets[k + 1]
+        return self.features[start:end], self.stats[start:end], \
+            self.fixed[start:end]
+
+    def model_best(self, weights):
+        # Indices of hypotheses with the highest model score for each
+        # sentence, the first one in case of ties
+        scores = self.features.dot(weights) + self.fixed
+        order = np.lexsort((-scores, self.sent_idx))
+        first = np.r_[True, self.sent_idx[order][1:]
+                      != self.sent_idx[order][:-1]]
+        return order[first]
+
+
+class Metric(object):
+
+    def __init__(self, sctype, scconfig=''):
+        self.sctype = sctype
+        self.config = dict(opt.split(':', 1)
+                           for opt in scconfig.split(',') if ':' in opt)
+        if sctype not in ('BLEU', 'M2SCORER', 'TER'):
+            raise ValueError(
+                'Metric {} is not supported by the in-process optimizer'
+                .format(sctype))
+
+    def init_background(self, size):
+        if self.sctype == 'BLEU':
+            # Pseudo-counts as in kbmira
+            bg = []
+            for n in range(BLEU_ORDER):
+                bg.extend([BLEU_ORDER - n, BLEU_ORDER - n])
+            bg.append(BLEU_ORDER)
+            return np.array(bg, dtype=np.float64)
+        return np.ones(size)
+
+    # Corpus-level score of the summed statistics
+    def score(self, stats):
+        stats = np.asarray(stats, dtype=np.float64)
+        return float(self._scores(stats[np.newaxis, :])[0])
+
+    # Sentence-level scores of hypotheses with statistics of the background
+    # corpus added
+    def background_scores(self, stats, bg):
+        scores = self._scores(stats + bg)
+        if self.sctype == 'BLEU':
+            # Scaled by the reference length as in Chiang et al. (2008)
+            scores *= (stats + bg)[:, 2 * BLEU_ORDER]
+        return scores
+
+    def _scores(self, stats):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if self.sctype == 'BLEU':
+                return bleu(stats)
+            elif self.sctype == 'M2SCORER':
+                return fscore(stats, float(self.config.get('beta', 0.5)))
+            return ter(stats)
+
+
+def bleu(stats):
+    order = BLEU_ORDER
+    logbleu = (np.log(stats[:, 0:2 * order:2])
+               - np.log(stats[:, 1:2 * order:2])).sum(axis=1) / order
+    brevity = 1.0 - stats[:, 2 * order] / stats[:, 1]
+    logbleu += np.minimum(brevity, 0.0)
+    return np.nan_to_num(np.exp(logbleu))
+
+
+def fscore(stats, beta):
+    correct, proposed, gold = stats[:, 0], stats[:, 1], stats[:, 2]
+    prec = np.where(proposed != 0, correct / proposed, 1.0)
+    recall = np.where(gold != 0, correct / gold, 1.0)
+    denom = beta * beta * prec + recall
+    return np.where(denom != 0,
+                    (1.0 + beta * beta) * prec * recall / denom, 0.0)
+
+
+def ter(stats):
+    edits, length = stats[:, 0], stats[:, 1]
+    return np.where(length != 0, 1.0 - edits / length, 1.0)
+
+
+def kbmira(data, metric, init_weights, iterations=60, c=0.01, decay=0.999,
+           seed=0, model_bg=False, log=sys.stderr):
+    weights = np.array(init_weights, dtype=np.float64)
+    totals = np.zeros_like(weights)
+    n_ticks = 0
+    bg = metric.init_background(data.stats.shape[1])
+    rand = np.random.RandomState(seed)
+
+    best_score = -np.inf
+    best_weights = weights.copy()
+    for it in range(iterations):
+        n_updates = 0
+        total_loss = 0.0
+        for k in rand.permutation(len(data)):
+            feats, stats, fixed = data.sentence(k)
+            if not len(feats):
+                continue
+            model = feats.dot(weights) + fixed
+            gains = metric.background_scores(stats, bg)
+            # The first hypothesis is chosen in case of ties
+            hope = int(np.argmax(model + gains))
+            fear = int(np.argmax(model - gains))
+            if hope != fear and gains[hope] > gains[fear]:
+                diff = feats[hope] - feats[fear]
+                loss = gains[hope] - gains[fear] - (model[hope] - model[fear])
+                norm = diff.dot(diff)
+                if loss > 0 and norm > 0:
+                    weights += min(c, loss / norm) * diff
+                    total_loss += loss
+                    n_updates += 1
+            totals += weights
+            n_ticks += 1
+            # Update background statistics
+            bg *= decay
+            if model_bg:
+                bg += stats[int(np.argmax(model))]
+            else:
+                bg += stats[hope]
+
+        avg_weights = totals / max(n_ticks, 1)
+        best = data.model_best(avg_weights)
+        score = metric.score(data.stats[best].sum(axis=0))
+        if log:
+            log.write('Iteration {}: {}/{} updates, avg loss = {:.6f}, '
+                      '{} = {:.6f}\n'.format(it + 1, n_updates, len(data),
+                                             total_loss / max(len(data), 1),
+                                             metric.sctype, score))
+        if score > best_score:
+            best_score = score
+            best_weights = avg_weights
+    return best_weights, best_score
+
+
+# Reads features.dat and scores.dat files created by the Moses extractor.
+# Dense features are mapped to columns of the tuned features using names, and
+# all other features are summed with fixed weights from sparse.SparseWeights,
+# looked up at once for all hypotheses.
+def read_extractor_data(feat_file, score_file, columns, fixed_weights=None):
+    col_index = {name: i for i, name in enumerate(columns)}
+    features = []
+    fixed_names = []
+    fixed_values = []
+    fixed_rows = []
+    offsets = [0]
+    with open(feat_file) as inp:
+        for header in inp:
+            if not header.startswith('FEATURES_TXT_BEGIN'):
+                continue
+            header = header.split()
+            n_hyps = int(header[2])
+            names = header[4:]
+            for _ in range(n_hyps):
+                toks = next(inp).split()
+                row = [0.0] * len(columns)
+                for name, val in zip(names, toks):
+                    if name in col_index:
+                        row[col_index[name]] = float(val)
+                    elif fixed_weights is not None:
+                        fixed_names.append(name.rsplit('_', 1)[0])
+                        fixed_values.append(float(val))
+                        fixed_rows.append(len(features))
+                if fixed_weights is not None:
+                    for tok in toks[len(names):]:
+                        name, val = tok.rsplit('=', 1)
+                        fixed_names.append(name)
+                        fixed_values.append(float(val))
+                        fixed_rows.append(len(features))
+                features.append(row)
+            offsets.append(len(features))
+
+    stats = []
+    with open(score_file) as inp:
+        for header in inp:
+            if not header.startswith('SCORES_TXT_BEGIN'):
+                continue
+            n_hyps = int(header.split()[2])
+            for _ in range(n_hyps):
+                stats.append([float(v) for v in next(inp).split()])
+
+    if len(stats) != len(features):
+        raise Exception('Numbers of hypotheses in {} and {} do not match'
+                        .format(feat_file, score_file))
+    fixed = None
+    if fixed_weights is not None:
+        fixed = fixed_weights.dot(fixed_names, fixed_values, fixed_rows,
+                                  len(features))
+    return NBestData(np.array(features).reshape(len(features), len(columns)),
+                     stats, offsets, fixed)
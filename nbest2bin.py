@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import argparse
+
+import compressed
+import nbestbin
+
+
+def main():
+    args = parse_user_args()
+
+    writer = nbestbin.NBestWriter(args.output, dtype=args.dtype)
+    for line in args.input:
+        writer.add_line(line)
+    writer.close()
+
+
+def parse_user_args():
+    parser = argparse.ArgumentParser(
+        description='Converts a text n-best list into the binary format')
+    parser.add_argument('-i', '--input', metavar='FILE', nargs='?',
+                        type=compressed.FileType('r'), default=sys.stdin,
+                        help='input n-best list, default: STDIN')
+    parser.add_argument('-o', '--output', metavar='FILE', nargs='?',
+                        type=argparse.FileType('wb'),
+                        default=getattr(sys.stdout, 'buffer', sys.stdout),
+                        help='output binary n-best list, default: STDOUT')
+    parser.add_argument('-d', '--dtype', default='float64',
+                        choices=['float32', 'float64'],
+                        help='type of feature values, default: %(default)s')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+
+# Binary columnar n-best list format.
+#
+# The file starts with a magic string, the length of a JSON header and the
+# header itself, followed by arrays aligned to 64 bytes:
+#
+#   sent_ids      int64[n_sents]          sentence ids
+#   offsets       int64[n_sents + 1]      index of the first hypothesis of
+#                                         each sentence
+#   features      dtype[n_hyps, n_cols]   dense feature values
+#   scores        float64[n_hyps]         decoder scores
+#   text          uint8[...]              UTF-8 encoded hypotheses
+#   text_offsets  int64[n_hyps + 1]
+#   extra         uint8[...]              fields after the score, if any
+#   extra_offsets int64[n_hyps + 1]
+#
+# The header stores the feature schema, i.e. a list of feature names with
+# numbers of their values, which defines the columns of the feature matrix.
+# All arrays are opened with numpy.memmap, so reading a file does not load it
+# into memory. All hypotheses must have the same dense features.
+
+import os
+import json
+import struct
+import tempfile
+
+import numpy as np
+
+MAGIC = b'YARNBEST'
+VERSION = 1
+ALIGNMENT = 64
+CHUNK_SIZE = 10000
+
+ARRAYS = ['sent_ids', 'offsets', 'features', 'scores',
+          'text', 'text_offsets', 'extra', 'extra_offsets']
+
+
+def is_binary(nbest):
+    if isinstance(nbest, str):
+        path = nbest
+    else:
+        path = getattr(nbest, 'name', None)
+        if not path or path.startswith('<'):
+            return False
+    # Binary n-best lists are memory-mapped, so pipes are never binary
+    if not os.path.isfile(path):
+        return False
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+def load(path):
+    return NBestBinary(path)
+
+
+def parse_features(field):
+    schema = []
+    values = []
+    for tok in field.split():
+        if tok.endswith('='):
+            schema.append([tok[:-1], 0])
+        else:
+            schema[-1][1] += 1
+            values.append(float(tok))
+    return [tuple(s) for s in schema], values
+
+
+def format_features(schema, values, dtype=np.float64):
+    toks = []
+    i = 0
+    for name, n in schema:
+        toks.append(name + '=')
+        for v in values[i:i + n]:
+            toks.append(format_value(v, dtype))
+        i += n
+    return ' '.join(toks)
+
+
+def format_value(value, dtype=np.float64):
+    if np.dtype(dtype) == np.float32:
+        return '{:.7g}'.format(value)
+    text = repr(float(value))
+    return text[:-2] if text.endswith('.0') else text
+
+
+def schema_columns(schema):
+    columns = []
+    for name, n in schema:
+        columns.extend([name] * n)
+    return columns
+
+
+class NBestBinary(object):
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic = f.read(len(MAGIC))
+            if magic != MAGIC:
+                raise Exception('Not a binary n-best list: {}'.format(path))
+            size, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(size).decode('utf-8'))
+        if header['version'] != VERSION:
+            raise Exception('Unsupported version of binary n-best list: {}'
+                            .format(header['version']))
+        self.header = header
+        self.dtype = np.dtype(str(header['dtype']))
+        self.schema = [(str(name), n) for name, n in header['schema']]
+        self.n_sents = header['n_sents']
+        self.n_hyps = header['n_hyps']
+        for name in ARRAYS:
+            offset, dtype, shape = header['arrays'][name]
+            if not all(shape):
+                array = np.zeros(shape, dtype=dtype)
+            else:
+                array = np.memmap(path, dtype=str(dtype), mode='r',
+                                  offset=offset, shape=tuple(shape))
+            setattr(self, name, array)
+
+    def columns(self):
+        return schema_columns(self.schema)
+
+    def column_slice(self, name):
+        start = 0
+        for feat, n in self.schema:
+            if feat == name:
+                return slice(start, start + n)
+            start += n
+        return None
+
+    def iterate_sentences(self):
+        for k in range(self.n_sents):
+            yield int(self.sent_ids[k]), \
+                int(self.offsets[k]), int(self.offsets[k + 1])
+
+    def hyp_text(self, i):
+        return _decode(self.text[self.text_offsets[i]:
+                                 self.text_offsets[i + 1]].tobytes())
+
+    # Returns numbers of spaces in hypotheses from begin to end
+    def hyp_spaces(self, begin, end):
+        offsets = self.text_offsets[begin:end + 1] - self.text_offsets[begin]
+        text = self.text[self.text_offsets[begin]:self.text_offsets[end]]
+        spaces = np.r_[0, np.cumsum(text == ord(' '))]
+        return np.diff(spaces[offsets])
+
+    def hyp_extra(self, i):
+        return _decode(self.extra[self.extra_offsets[i]:
+                                  self.extra_offsets[i + 1]].tobytes())
+
+    def hyp_line(self, sid, i, score=None):
+        if score is None:
+            score = format_value(self.scores[i])
+        fields = [str(sid),
+                  self.hyp_text(i),
+                  format_features(self.schema, self.features[i], self.dtype),
+                  score]
+        return ' ||| '.join(fields) + self.hyp_extra(i)
+
+
+class NBestWriter(object):
+
+    def __init__(self, output, schema=None, dtype=np.float64):
+        self.output = output
+        self.schema = schema
+        self.dtype = np.dtype(dtype)
+        self.n_hyps = 0
+        self.text_size = 0
+        self.extra_size = 0
+        self.sent_ids = []
+        self.offsets = []
+        self.tmp = {name: tempfile.TemporaryFile()
+                    for name in ['features', 'scores', 'text', 'text_offsets',
+                                 'extra', 'extra_offsets']}
+        self._reset_chunk()
+
+    def _reset_chunk(self):
+        self.chunk = {name: [] for name in self.tmp}
+
+    def add_line(self, line):
+        fields = line.rstrip('\n').split(' ||| ')
+        schema, values = parse_features(fields[2])
+        extra = ''.join(' ||| ' + f for f in fields[4:])
+        self.add(int(fields[0]), fields[1], schema, values, float(fields[3]),
+                 extra)
+
+    def add(self, sid, text, schema, values, score, extra=''):
+        if self.schema is None:
+            self.schema = schema
+        elif schema != self.schema:
+            raise Exception(
+                'Features of hypothesis {} do not match the schema {}, '
+                'sparse features are not supported in binary n-best lists'
+                .format(self.n_hyps, self.schema))
+        if not self.sent_ids or self.sent_ids[-1] != sid:
+            self.sent_ids.append(sid)
+            self.offsets.append(self.n_hyps)
+        text = _encode(text)
+        extra = _encode(extra)
+        self.chunk['features'].append(values)
+        self.chunk['scores'].append(score)
+        self.chunk['text'].append(text)
+        self.chunk['text_offsets'].append(self.text_size)
+        self.chunk['extra'].append(extra)
+        self.chunk['extra_offsets'].append(self.extra_size)
+        self.text_size += len(text)
+        self.extra_size += len(extra)
+        self.n_hyps += 1
+        if len(self.chunk['scores']) >= CHUNK_SIZE:
+            self._flush()
+
+    def _flush(self):
+        n_cols = len(schema_columns(self.schema or []))
+        chunk = self.chunk
+        np.array(chunk['features'], dtype=self.dtype) \
+            .reshape(-1, n_cols).tofile(self.tmp['features'])
+        np.array(chunk['scores'], dtype=np.float64) \
+            .tofile(self.tmp['scores'])
+        np.array(chunk['text_offsets'], dtype=np.int64) \
+            .tofile(self.tmp['text_offsets'])
+        np.array(chunk['extra_offsets'], dtype=np.int64) \
+            .tofile(self.tmp['extra_offsets'])
+        self.tmp['text'].write(b''.join(chunk['text']))
+        self.tmp['extra'].write(b''.join(chunk['extra']))
+        self._reset_chunk()
+
+    def close(self):
+        self._flush()
+        schema = self.schema or []
+        n_cols = len(schema_columns(schema))
+        n_sents = len(self.sent_ids)
+        np.array([self.text_size], dtype=np.int64) \
+            .tofile(self.tmp['text_offsets'])
+        np.array([self.extra_size], dtype=np.int64) \
+            .tofile(self.tmp['extra_offsets'])
+
+        arrays = [
+            ('sent_ids', np.int64, [n_sents]),
+            ('offsets', np.int64, [n_sents + 1]),
+            ('features', self.dtype, [self.n_hyps, n_cols]),
+            ('scores', np.float64, [self.n_hyps]),
+            ('text', np.uint8, [self.text_size]),
+            ('text_offsets', np.int64, [self.n_hyps + 1]),
+            ('extra', np.uint8, [self.extra_size]),
+            ('extra_offsets', np.int64, [self.n_hyps + 1]),
+        ]
+        header = {
+            'version': VERSION,
+            'dtype': self.dtype.name,
+            'n_sents': n_sents,
+            'n_hyps': self.n_hyps,
+            'schema': [list(s) for s in schema],
+            'arrays': {},
+        }
+        # The size of the header depends on offsets of arrays, so offsets are
+        # computed for a header padded to the alignment
+        header_size = 0
+        while True:
+            offset = _align(len(MAGIC) + 8 + header_size)
+            for name, dtype, shape in arrays:
+                header['arrays'][name] = [offset, np.dtype(dtype).name, shape]
+                size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+                offset = _align(offset + size)
+            data = json.dumps(header, sort_keys=True).encode('utf-8')
+            if len(data) <= header_size:
+                break
+            header_size = _align(len(data))
+        data += b' ' * (header_size - len(data))
+
+        out = self.output
+        out.write(MAGIC)
+        out.write(struct.pack('<Q', len(data)))
+        out.write(data)
+        position = len(MAGIC) + 8 + len(data)
+        for name, dtype, shape in arrays:
+            position = _pad(out, position, header['arrays'][name][0])
+            if name == 'sent_ids':
+                buf = np.array(self.sent_ids, dtype=np.int64).tobytes()
+            elif name == 'offsets':
+                buf = np.array(self.offsets + [self.n_hyps],
+                               dtype=np.int64).tobytes()
+            else:
+                position += _copy(self.tmp[name], out)
+                continue
+            out.write(buf)
+            position += len(buf)
+        _pad(out, position, _align(position))
+        for tmp in self.tmp.values():
+            tmp.close()
+
+
+def write_text(nbest, output):
+    for sid, start, end in nbest.iterate_sentences():
+        for i in range(start, end):
+            output.write(nbest.hyp_line(sid, i) + '\n')
+
+
+def _align(position):
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _pad(output, position, target):
+    output.write(b'\0' * (target - position))
+    return target
+
+
+def _copy(tmp, output, bufsize=1 << 20):
+    tmp.seek(0)
+    size = 0
+    while True:
+        buf = tmp.read(bufsize)
+        if not buf:
+            break
+        output.write(buf)
+        size += len(buf)
+    return size
+
+
+def _encode(text):
+    return text if isinstance(text, bytes) else text.encode('utf-8')
+
+
+def _decode(data):
+    return data if str is bytes else data.decode('utf-8')
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Rescoring server keeping feature weights in memory.
+#
+# Clients send blocks of n-best list lines terminated by an empty line. The
+# server responds with a line with the number of output lines followed by the
+# re-scored n-best list or top best candidates, which may be empty. If features
+# are added by the server, each block needs to start with source sentences for
+# the sentence ids in the block, given in lines prefixed with 'SRC ||| '.
+# Errors are returned in a single line prefixed with 'ERROR ||| '.
+#
+# The configuration file is reloaded when its modification time changes, so
+# it should be replaced atomically, e.g. with mv.
+
+import os
+import sys
+import signal
+import socket
+import argparse
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+import rescore
+from featurizer import FEATURES, DedupScorer, create_features, \
+    extend_line, has_line_aligned_features, iterate_nbest_sentences, \
+    iterate_sentence_groups, log_scores
+
+SOURCE_PREFIX = 'SRC ||| '
+ERROR_PREFIX = 'ERROR ||| '
+
+
+def main():
+    args = parse_user_args()
+
+    weights = WeightStore(args.config)
+    feats = create_features(args.features or [])
+    if has_line_aligned_features(feats):
+        sys.stderr.write('Error: file-based and co-process features are not '
+                         'supported\n')
+        sys.exit(1)
+
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = ThreadingUnixServer(args.socket, RescoreHandler)
+        address = args.socket
+    else:
+        server = ThreadingTCPServer((args.host, args.port), RescoreHandler)
+        address = '{}:{}'.format(*server.server_address)
+    server.weights = weights
+    server.feats = feats
+    server.args = args
+
+    # Clean up also when terminated
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    sys.stderr.write('Listening on {}\n'.format(address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+class WeightStore(object):
+
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.weights = None
+        self.get()
+
+    def get(self):
+        try:
+            mtime = os.stat(self.config).st_mtime
+        except OSError:
+            # E.g. while the file is being replaced
+            if self.weights is None:
+                raise
+            return self.weights
+        if mtime != self.mtime:
+            with self.lock:
+                if mtime != self.mtime:
+                    self.reload(mtime)
+        # Weights are never modified after loading, so the reference can be
+        # used without locking
+        return self.weights
+
+    def reload(self, mtime):
+        try:
+            with open(self.config) as config:
+                weights = rescore.read_feature_weights(config)
+        except (Exception, SystemExit) as e:
+            # Also malformed or half-written files, which are loaded again
+            # when modified
+            if self.weights is None:
+                raise
+            sys.stderr.write('Error: cannot reload weights from {}, '
+                             'keeping previous weights: {}\n'
+                             .format(self.config, e))
+        else:
+            sys.stderr.write('Loaded weights from {}\n'.format(self.config))
+            self.weights = weights
+        self.mtime = mtime
+
+
+class RescoreHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            block = read_block(self.rfile)
+            if block is None:
+                break
+            try:
+                output = self.process(block)
+                response = '{}\n'.format(len(output)) + ''.join(output)
+            except Exception as e:
+                response = ERROR_PREFIX + str(e).replace('\n', ' ') + '\n'
+            self.wfile.write(response)
+            self.wfile.flush()
+
+    def finish(self):
+        try:
+            socketserver.StreamRequestHandler.finish(self)
+        except socket.error:
+            # The client disconnected without reading the response
+            pass
+
+    def process(self, block):
+        server = self.server
+        sources = [line[len(SOURCE_PREFIX):] for line in block
+                   if line.startswith(SOURCE_PREFIX)]
+        nbest = [line for line in block if not line.startswith(SOURCE_PREFIX)]
+        if server.feats:
+            nbest = add_features(nbest, sources, server.feats,
+                                 server.args.log)
+
+        output = Output()
+        args = argparse.Namespace(top_best=server.args.top_best,
+                                  normalize=server.args.normalize,
+                                  k=server.args.k,
+                                  batch=server.args.batch,
+                                  output=output)
+        weights = server.weights.get()
+        if args.batch or weights.sparse is not None:
+            rescore.rescore_batches(nbest, weights, args)
+        else:
+            rescore.rescore_text(nbest, weights, args)
+        return output
+
+
+# Features are run for all hypotheses of each source sentence at once, as in
+# add-features.py, with a scorer of each request, as requests are handled in
+# parallel threads
+def add_features(nbest, sources, feats, log=False):
+    scorer = DedupScorer(feats)
+    lines = iterate_nbest_sentences(nbest, iter(sources))
+    output = []
+    for src, group in iterate_sentence_groups(lines):
+        all_scores = scorer.run_batch([trg for trg, _ in group], src)
+        for (_, line), scores in zip(group, all_scores):
+            if log:
+                scores = log_scores(scores, feats)
+            output.append(extend_line(line, scores))
+    return output
+
+
+class Output(list):
+
+    def write(self, text):
+        self.append(text)
+
+
+def read_block(rfile):
+    lines = []
+    for line in iter(rfile.readline, ''):
+        if not line.strip():
+            return lines
+        lines.append(line.rstrip('\n'))
+    return lines or None
+
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn,
+                          socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn,
+                         socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def parse_user_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', metavar='FILE', required=True,
+                        help='rescore.ini, reloaded on changes')
+    parser.add_argument('-u', '--socket', metavar='PATH',
+                        help='listen on a Unix socket')
+    parser.add_argument('--host', default='localhost',
+                        help='host name, default: %(default)s')
+    parser.add_argument('-p', '--port', metavar='N', default=8990, type=int,
+                        help='TCP port if no Unix socket is given, '
+                        'default: %(default)s')
+    parser.add_argument('-f', '--features', nargs='+', metavar='FEATURE',
+                        choices=FEATURES.keys(),
+                        help='features to be added before rescoring')
+    parser.add_argument('--log', action='store_true',
+                        help='log feature values as in add-features.py')
+    parser.add_argument('-n', '--normalize', metavar='FLOAT', type=float,
+                        help='parameter for length normalization')
+    parser.add_argument('-t', '--top-best', action='store_true',
+                        help='return top best candidates')
+    parser.add_argument('-k', '--k', metavar='N', type=int,
+                        help='return only N best candidates of each sentence')
+    parser.add_argument('-b', '--batch', metavar='N', type=int,
+                        help='rescore N sentences at once using vectorized '
+                        'operations')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
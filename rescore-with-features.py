@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Adds features to an n-best list and rescores it in a single pass instead of
+# running add-features.py and rescore.py. Feature values are scored in memory
+# without writing them to the n-best list, so they are not rounded as in the
+# output of run(), e.g. to 4 decimals, and scores may differ slightly from
+# rescore.py on an n-best list with added features, as may the order of
+# candidates with almost equal scores. Features with zero or no weights in
+# rescore.ini are not computed at all.
+
+import sys
+import argparse
+
+import compressed
+import rescore
+import topk
+from featurizer import CHUNK_SIZE, FEATURES, DedupScorer, create_features, \
+    iterate_prepared_sentences, iterate_sentence_groups, log_scores, log_value
+
+
+def main():
+    args = parse_user_args()
+
+    weights = rescore.read_feature_weights(args.config)
+    feats = [FeatureScorer(f, weights, args.log)
+             for f in create_features(args.features)]
+    feats = [f for f in feats if f.is_weighted()]
+
+    scorer = DedupScorer(feats)
+    k = 1 if args.top_best else args.k or sys.maxsize
+    lines = iterate_prepared_sentences(args.input, args.source, feats,
+                                       args.work_dir, args.chunk_size)
+    for src, group in iterate_sentence_groups(lines):
+        top = topk.TopK(k)
+        all_scores = scorer.run_batch([trg for trg, _ in group], src)
+        for (_, line), scores in zip(group, all_scores):
+            fields = [f.strip() for f in line.split('|||')]
+            score = rescore.rescore_fields(fields, weights, args.normalize,
+                                           sum(scores))
+            top.push(score, fields)
+        rescore.write_candidates(top.items(), args)
+
+
+class FeatureScorer(object):
+    # Feature wrapper returning the weighted sum of feature values
+
+    def __init__(self, feat, weights, log=False):
+        self.feat = feat
+        self.log = log
+        self.weights = None
+        if feat.labels is not None:
+            self.weights = [weights.get(label + '=', [0.0])[0]
+                            for label in feat.labels]
+            # The same as the --log option of add-features.py
+            self.logged = [log and label not in feat.log_labels
+                           for label in feat.labels]
+        else:
+            # Names of values are known only from the output of run()
+            self.all_weights = weights
+
+    def is_weighted(self):
+        return self.weights is None or any(self.weights)
+
+    def run(self, trg, src):
+        if self.weights is None:
+            return self.run_text(trg, src)
+        return self.weighted_sum(self.feat.values(trg, src))
+
+    def run_batch(self, trgs, src):
+        if self.weights is None:
+            return [self.run_text(trg, src) for trg in trgs]
+        return [self.weighted_sum(values)
+                for values in self.feat.values_batch(trgs, src)]
+
+    def weighted_sum(self, values):
+        score = 0.0
+        for w, logged, label, val in zip(self.weights, self.logged,
+                                         self.feat.labels, values):
+            if w:
+                score += w * (log_value(val, label) if logged else val)
+        return score
+
+    def run_text(self, trg, src):
+        output = self.feat.run(trg, src)
+        if self.log:
+            feats = log_scores([output], [self.feat])
+        else:
+            feats = output.split()
+        return rescore.feature_scorer(self.all_weights)(feats,
+                                                        self.all_weights)
+
+    def __getattr__(self, name):
+        return getattr(self.feat, name)
+
+
+def parse_user_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--source', metavar='FILE', required=True,
+                        type=compressed.FileType('r'),
+                        help='source sentences')
+    parser.add_argument('-f', '--features', required=True, nargs='+',
+                        metavar='FEATURE', choices=FEATURES.keys(),
+                        help='features to be added to n-best list')
+    parser.add_argument('-c', '--config', metavar='FILE', required=True,
+                        type=argparse.FileType('r'),
+                        help='rescore.ini')
+    parser.add_argument('-i', '--input', metavar='FILE', nargs='?',
+                        type=compressed.FileType('r'), default=sys.stdin,
+                        help='input n-best list, default: STDIN')
+    parser.add_argument('-o', '--output', metavar='FILE', nargs='?',
+                        type=compressed.FileType('w'), default=sys.stdout,
+                        help='output re-scored n-best list, default: STDOUT')
+    parser.add_argument('-w', '--work-dir', metavar='DIR', default='featdir',
+                        help='working directory, default: %(default)s')
+    parser.add_argument('--chunk-size', metavar='N', default=CHUNK_SIZE,
+                        type=int,
+                        help='number of lines for which file-based and '
+                        'co-process features are prepared at once, '
+                        'default: %(default)s')
+    parser.add_argument('--log', action='store_true',
+                        help='log feature values as in add-features.py')
+    parser.add_argument('-n', '--normalize', metavar='FLOAT', type=float,
+                        help='parameter for length normalization')
+    parser.add_argument('-t', '--top-best', action='store_true',
+                        help='print top best candidate')
+    parser.add_argument('-k', '--k', metavar='N', type=int,
+                        help='print only N best re-scored candidates of each '
+                        'sentence')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
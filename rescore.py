@@ -1,11 +1,23 @@
 #!/usr/bin/env python
 
+import os
 import sys
+import time
 import argparse
+from operator import itemgetter
+
+import numpy as np
+
+import compressed
+import nbestbin
+import runstats
+import sparse
+import topk
 
 TEXT_FIELD = 1
 FEATURE_FIELD = 2
 SCORE_FIELD = 3
+BATCH_SIZE = 1000
 
 
 def main():
@@ -14,35 +26,404 @@ def main():
     # Read feature names and weights
     weights = read_feature_weights(args.config)
 
+    stats = None
+    if args.stats:
+        stats = runstats.Stats(args.stats, args.stats_interval)
+        args.output = runstats.CountingFile(
+            args.output, stats, 'bytes_written')
+
+    if nbestbin.is_binary(args.input):
+        rescore_binary(nbestbin.load(args.input.name), weights, args, stats)
+        return
+
+    if stats:
+        args.input = runstats.CountingFile(
+            args.input, stats, 'bytes_read', 'candidates')
+
+    # Sparse weights are looked up in batches
+    if args.batch or weights.sparse is not None:
+        rescore_batches(args.input, weights, args, stats)
+        return
+
+    rescore_text(args.input, weights, args, stats)
+
+
+def rescore_text(nbest, weights, args, stats=None):
+    k = 1 if args.top_best else args.k
+    if k:
+        rescore_top(nbest, weights, args, k, stats)
+        return
+
     # Iterate n-best list
-    for sid, lines in iterate_nbest(args.input):
-        scored_lines = []
-        # Iterate candidates
-        for i, line in enumerate(lines):
+    for sid, lines in iterate_nbest(nbest):
+        if not lines:
+            continue
+        if stats:
+            stats.count('sentences')
+        with runstats.timer(stats, 'rescore'):
+            scored_lines = rescore_lines(lines, weights, args)
+
+        # Print re-scored candidates
+        with runstats.timer(stats, 'output'):
+            for _, line in scored_lines:
+                args.output.write(line + '\n')
+
+
+def rescore_lines(lines, weights, args):
+    scored_lines = []
+    score_features = feature_scorer(weights)
+    # Iterate candidates
+    for i, line in enumerate(lines):
+        fields = [f.strip() for f in line.split('|||')]
+        score = score_features(fields[FEATURE_FIELD].split(), weights)
+        if args.normalize:
+            length = len(fields[TEXT_FIELD].split(' ')) + 1
+            score = score / float(length) ** args.normalize
+        # Keep candidates with new scores
+        fields[SCORE_FIELD] = str(score)
+        scored_lines.append((score, ' ||| '.join(fields)))
+
+    # Sort candidates according to new scores
+    scored_lines.sort(key=lambda p: -p[0])
+    return scored_lines
+
+
+def rescore_top(nbest, weights, args, k, stats=None):
+    # Candidates are scored while reading and only the k best candidates of
+    # each sentence are kept in a bounded heap, or only the best one. Whole
+    # sentences are timed, and only with statistics
+    score_features = feature_scorer(weights)
+    normalize = args.normalize
+    timer = stats.timer('rescore') if stats else None
+    for sid, lines in iterate_nbest(nbest):
+        if not lines:
+            continue
+        if timer:
+            stats.count('sentences')
+            start = time.time()
+        top = topk.TopK(k) if k > 1 else None
+        best = None
+        best_score = None
+        for line in lines:
             fields = [f.strip() for f in line.split('|||')]
-            feats = fields[FEATURE_FIELD].split()
-            # Rescore
-            score = rescore_features(feats, weights)
-            if args.normalize:
+            score = score_features(fields[FEATURE_FIELD].split(), weights)
+            if normalize:
                 length = len(fields[TEXT_FIELD].split(' ')) + 1
-                score = score / float(length) ** args.normalize
-            # Keep candidates with new scores
+                score = score / float(length) ** normalize
+            if top is not None:
+                top.push(score, fields)
+            elif best is None or score > best_score:
+                # Earlier candidates win ties
+                best = fields
+                best_score = score
+        if timer:
+            timer.record(time.time() - start)
+        write_candidates(top.items() if top is not None
+                         else [(best_score, best)], args, stats)
+
+
+def write_candidates(scored_fields, args, stats=None):
+    with runstats.timer(stats, 'output'):
+        for score, fields in scored_fields:
             if args.top_best:
-                new_line = fields[TEXT_FIELD]
+                args.output.write(fields[TEXT_FIELD] + '\n')
             else:
                 fields[SCORE_FIELD] = str(score)
-                new_line = ' ||| '.join(fields)
-            scored_lines.append((score, new_line))
+                args.output.write(' ||| '.join(fields) + '\n')
 
-        # Sort candidates according to new scores
-        scored_lines.sort(key=lambda p: -p[0])
 
-        # Print re-scored candidates
-        if args.top_best:
-            args.output.write(scored_lines[0][1] + '\n')
+# Scores candidate fields, optionally adding a score of features computed
+# elsewhere before length normalization
+def rescore_fields(fields, weights, normalize=None, extra=0.0):
+    score = feature_scorer(weights)(fields[FEATURE_FIELD].split(), weights)
+    if extra:
+        score += extra
+    if normalize:
+        length = len(fields[TEXT_FIELD].split(' ')) + 1
+        score = score / float(length) ** normalize
+    return score
+
+
+def rescore_binary(nbest, weights, args, stats=None):
+    weight_vec = binary_weight_vector(nbest, weights)
+
+    if stats:
+        stats.count('bytes_read', os.path.getsize(nbest.path))
+
+    batch_size = args.batch or BATCH_SIZE
+    sents = list(nbest.iterate_sentences())
+    for b in range(0, len(sents), batch_size):
+        batch = sents[b:b + batch_size]
+        begin = batch[0][1]
+        end = batch[-1][2]
+        with runstats.timer(stats, 'score'):
+            scores = nbest.features[begin:end].dot(weight_vec)
+            sent_idx = np.repeat(np.arange(len(batch)),
+                                 [e - s for _, s, e in batch])
+            if args.normalize:
+                # The same as normalize_scores() without decoding texts
+                lengths = nbest.hyp_spaces(begin, end) + 2.0
+                scores = scores / lengths ** args.normalize
+            selected = select_candidates(scores, sent_idx,
+                                         1 if args.top_best else args.k)
+        with runstats.timer(stats, 'output'):
+            for i, score in selected:
+                if args.top_best:
+                    args.output.write(nbest.hyp_text(begin + i) + '\n')
+                else:
+                    sid = batch[sent_idx[i]][0]
+                    args.output.write(
+                        nbest.hyp_line(sid, begin + i, str(score)) + '\n')
+        if stats:
+            stats.count('sentences', len(batch))
+            stats.count('candidates', end - begin)
+
+
+# Feature values are scored with a weight vector matching columns of the
+# feature matrix
+def binary_weight_vector(nbest, weights):
+    weight_vec = np.zeros(len(nbest.columns()))
+    start = 0
+    for name, n in nbest.schema:
+        key = name + '='
+        for j, w in enumerate(weights.get(key, [])[:n]):
+            weight_vec[start + j] = w
+        start += n
+    return weight_vec
+
+
+def rescore_batches(nbest, weights, args, stats=None):
+    # Lines are split into fields once, and feature fields of a batch are
+    # parsed at once if they have the same layout. Fields other than features
+    # are stripped only for output
+    scorer = BatchScorer(weights)
+    for fields, sent_idx in iterate_batches(nbest, args.batch or BATCH_SIZE):
+        with runstats.timer(stats, 'score'):
+            scores = scorer.score_texts([f[FEATURE_FIELD] for f in fields])
+            if args.normalize:
+                scores = normalize_scores(
+                    scores, [f[TEXT_FIELD].strip() for f in fields],
+                    args.normalize)
+            selected = select_candidates(np.asarray(scores),
+                                         np.array(sent_idx),
+                                         1 if args.top_best else args.k)
+        with runstats.timer(stats, 'output'):
+            for i, score in selected:
+                if args.top_best:
+                    args.output.write(fields[i][TEXT_FIELD].strip() + '\n')
+                else:
+                    line_fields = [f.strip() for f in fields[i]]
+                    line_fields[SCORE_FIELD] = str(score)
+                    args.output.write(' ||| '.join(line_fields) + '\n')
+        if stats:
+            stats.count('sentences', sent_idx[-1] + 1)
+
+
+# Yields lines of size sentences at a time split into fields, with sentence
+# indices of lines within the batch
+def iterate_batches(nbest, size):
+    batch = []
+    sent_idx = []
+    n = -1
+    prev_sid = None
+    for line in nbest:
+        fields = line.split('|||')
+        if fields[0] != prev_sid:
+            prev_sid = fields[0]
+            n += 1
+            if n == size:
+                yield batch, sent_idx
+                batch = []
+                sent_idx = []
+                n = 0
+        batch.append(fields)
+        sent_idx.append(n)
+    if batch:
+        yield batch, sent_idx
+
+
+def normalize_scores(scores, texts, normalize):
+    # The same as len(text.split(' ')) + 1
+    lengths = np.array([text.count(' ') + 2 for text in texts],
+                       dtype=np.float64)
+    return scores / lengths ** normalize
+
+
+def select_candidates(scores, sent_idx, k=None):
+    # Candidates of each sentence sorted by descending scores, the original
+    # order is kept for equal scores, optionally only the k best ones
+    order = np.lexsort((-scores, sent_idx))
+    if k:
+        sorted_idx = sent_idx[order]
+        first = np.flatnonzero(np.r_[True, sorted_idx[1:] != sorted_idx[:-1]])
+        if k == 1:
+            order = order[first]
         else:
-            for _, line in scored_lines:
-                args.output.write(line + '\n')
+            # Rank of each candidate within its sentence
+            starts = np.repeat(first, np.diff(np.r_[first, len(order)]))
+            order = order[np.arange(len(order)) - starts < k]
+    return zip(order.tolist(), scores[order].tolist())
+
+
+class BatchScorer(object):
+    # Scores feature fields with dense weight vectors compiled for each layout
+    # of feature names, so that values of weighted features are collected with
+    # a single item getter and scored with a matrix-vector product. Features
+    # without dense weights are scored with sparse weights, if any, for all
+    # feature fields at once. Unsplit feature fields of the same layout are
+    # split and parsed at once for all of them.
+
+    MAX_LAYOUTS = 1000
+
+    def __init__(self, weights):
+        self.weights = weights
+        self.sparse = getattr(weights, 'sparse', None)
+        self.layouts = {}
+        self.last = None
+
+    # Scores feature fields given as strings
+    def score_texts(self, texts):
+        if self.sparse is None and texts:
+            scores = self.score_same_layout(texts)
+            if scores is not None:
+                return scores
+        return self.score([text.split() for text in texts])
+
+    # Returns scores of feature fields if all of them have the layout of the
+    # first one, otherwise None
+    def score_same_layout(self, texts):
+        # Fields are split at once with separators in between, which are at
+        # the same positions if all fields have the same number of items
+        n = len(texts)
+        items = ' | '.join(texts).split()
+        step = (len(items) + 1) // n
+        size = step - 1
+        if len(items) != n * step - 1 or items.count('|') != n - 1 or \
+                items[size::step].count('|') != n - 1:
+            return None
+        layout = self.find_layout(items[:size])
+        for pos, name in zip(layout.name_pos, layout.names):
+            if items[pos::step].count(name) != n:
+                return None
+        if not len(layout.weights):
+            return np.zeros(n)
+        values = ' '.join(' '.join(items[pos::step])
+                          for pos in layout.value_pos)
+        matrix = np.fromstring(values, sep=' ') \
+            .reshape(len(layout.weights), n).T.copy()
+        return matrix.dot(layout.weights)
+
+    def score(self, feats_list):
+        sparse_scores = None
+        if self.sparse is not None:
+            feats_list, sparse_scores = self.score_sparse(feats_list)
+
+        groups = {}
+        for n, feats in enumerate(feats_list):
+            layout = self.last
+            if layout is None or not layout.matches(feats):
+                layout = self.find_layout(feats)
+            if layout not in groups:
+                groups[layout] = ([], [])
+            indices, values = groups[layout]
+            indices.append(n)
+            values.extend(layout.get_values(feats))
+
+        scores = np.zeros(len(feats_list))
+        for layout, (indices, values) in groups.items():
+            matrix = np.fromstring(' '.join(values), sep=' ') \
+                .reshape(len(indices), len(layout.weights))
+            scores[indices] = matrix.dot(layout.weights)
+        if sparse_scores is not None:
+            scores += sparse_scores
+        return scores
+
+    # Returns feature fields reduced to features with dense weights, so that
+    # their layouts do not depend on sparse features, and scores of the other
+    # features
+    def score_sparse(self, feats_list):
+        dense_list = []
+        names = []
+        values = []
+        rows = []
+        for n, feats in enumerate(feats_list):
+            dense = []
+            key = ''
+            i = 0
+            for f in feats:
+                if f.endswith('='):
+                    key = f
+                    i = 0
+                    if key in self.weights:
+                        dense.append(f)
+                    continue
+                if key in self.weights:
+                    dense.append(f)
+                elif i == 0:
+                    names.append(key[:-1])
+                    values.append(float(f))
+                    rows.append(n)
+                i += 1
+            dense_list.append(dense)
+        return dense_list, self.sparse.dot(names, values, rows,
+                                           len(feats_list))
+
+    def find_layout(self, feats):
+        names = tuple(f for f in feats if f.endswith('='))
+        layout = self.layouts.get(names)
+        if layout is None or not layout.matches(feats):
+            if len(self.layouts) >= self.MAX_LAYOUTS:
+                self.layouts = {}
+            layout = FeatureLayout(feats, self.weights)
+            self.layouts[names] = layout
+        self.last = layout
+        return layout
+
+
+class FeatureLayout(object):
+
+    def __init__(self, feats, weights):
+        self.size = len(feats)
+        name_pos = []
+        value_pos = []
+        weight_vec = []
+        key = ''
+        i = 0
+        for pos, f in enumerate(feats):
+            if f.endswith('='):
+                name_pos.append(pos)
+                key = f
+                i = 0
+                continue
+            if key in weights and i < len(weights[key]):
+                value_pos.append(pos)
+                weight_vec.append(weights[key][i])
+            i += 1
+        self.name_pos = name_pos
+        self.value_pos = value_pos
+        self.get_names = make_getter(name_pos)
+        self.get_values = make_getter(value_pos)
+        self.names = self.get_names(feats)
+        self.weights = np.array(weight_vec, dtype=np.float64)
+
+    def matches(self, feats):
+        return len(feats) == self.size and self.get_names(feats) == self.names
+
+
+def make_getter(positions):
+    if len(positions) > 1:
+        return itemgetter(*positions)
+    if positions:
+        pos = positions[0]
+        return lambda items: (items[pos],)
+    return lambda items: ()
+
+
+# Returns the function scoring feature fields with the weights
+def feature_scorer(weights):
+    if getattr(weights, 'sparse', None) is None:
+        return rescore_features
+    return rescore_sparse_features
 
 
 def rescore_features(feats, weights):
@@ -61,6 +442,30 @@ def rescore_features(feats, weights):
         i += 1
     return score
 
+
+# The same as rescore_features(), but the first values of features without
+# dense weights are scored with sparse weights
+def rescore_sparse_features(feats, weights):
+    score = 0
+    i = 0
+    key = ''
+    names = []
+    values = []
+    for f in feats:
+        if f.endswith('='):
+            key = f
+            i = 0
+            continue
+        if key in weights:
+            score += (float(f) * weights[key][i])
+        elif i == 0:
+            names.append(key[:-1])
+            values.append(float(f))
+        i += 1
+    if names:
+        score += weights.sparse.dot(names, values, [0] * len(names), 1)[0]
+    return score
+
 def iterate_nbest(nbest):
     sid = 0
     prev_sid = 0
@@ -77,23 +482,49 @@ def iterate_nbest(nbest):
     yield sid, lines
 
 
+class FeatureWeights(dict):
+    # Dense weights by feature names ending with '=', and sparse weights of
+    # other features if rescore.ini refers to a file with them
+    sparse = None
+
+
+# Reads the [weight] section of rescore.ini and optionally the [sparse] section
+# with a path to sparse weights created by train.py, relative to rescore.ini
 def read_feature_weights(config):
-    weights = {}
-    while True:
-        line = config.readline()
-        if not line:
-            sys.stderr.write('Error: no [weight] section\n')
-            sys.exit(1)
-        if '[weight]' in line:
-            break
-    while True:
-        line = config.readline()
-        if not line or line.strip().startswith('['):
-            break
+    weights = FeatureWeights()
+    section = ''
+    found = False
+    sparse_file = None
+    for line in iter(config.readline, ''):
+        if line.strip().startswith('['):
+            section = line.strip()
+            found = found or '[weight]' in section
+            continue
         if not line.strip():
             continue
-        fields = line.split()
-        weights[fields[0]] = [float(f) for f in fields[1:]]
+        if '[weight]' in section:
+            fields = line.split()
+            weights[fields[0]] = [float(f) for f in fields[1:]]
+        elif '[sparse]' in section:
+            sparse_file = line.strip()
+    if not found:
+        sys.stderr.write('Error: no [weight] section\n')
+        sys.exit(1)
+
+    if sparse_file:
+        base_dir = os.path.dirname(getattr(config, 'name', ''))
+        if base_dir.startswith('<'):
+            base_dir = ''
+        sparse_file = os.path.join(base_dir, sparse_file)
+        if not sparse.is_binary(sparse_file):
+            sys.stderr.write('Error: no sparse weights in "{}"\n'
+                             .format(sparse_file))
+            sys.exit(1)
+        try:
+            weights.sparse = sparse.load(sparse_file)
+        except Exception as e:
+            sys.stderr.write('Error: {}\n'.format(e))
+            sys.exit(1)
     return weights
 
 
@@ -103,15 +534,29 @@ def parse_user_args():
                         type=argparse.FileType('r'),
                         help='rescore.ini')
     parser.add_argument('-i', '--input', metavar='FILE', nargs='?',
-                        type=argparse.FileType('r'), default=sys.stdin,
+                        type=compressed.FileType('r'), default=sys.stdin,
                         help='input n-best list, default: STDIN')
     parser.add_argument('-o', '--output', metavar='FILE', nargs='?',
-                        type=argparse.FileType('w'), default=sys.stdout,
+                        type=compressed.FileType('w'), default=sys.stdout,
                         help='output re-scored n-best list, default: STDOUT')
     parser.add_argument('-n', '--normalize', metavar='FLOAT', type=float,
                         help='parameter for length normalization')
     parser.add_argument('-t', '--top-best', action='store_true',
                         help='print top best candidate')
+    parser.add_argument('-k', '--k', metavar='N', type=int,
+                        help='print only N best re-scored candidates of each '
+                        'sentence')
+    parser.add_argument('-b', '--batch', metavar='N', type=int,
+                        help='rescore N sentences at once using vectorized '
+                        'operations, much faster on binary n-best lists '
+                        'than on text')
+    parser.add_argument('--stats', metavar='FILE',
+                        help='save timing, throughput and memory statistics '
+                        'as JSON')
+    parser.add_argument('--stats-interval', metavar='SEC', default=60,
+                        type=float,
+                        help='update statistics every SEC seconds, '
+                        'default: %(default)s')
     return parser.parse_args()
 
 
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+# Run-time statistics collected with --stats: timers with latency histograms,
+# counters, throughput and peak memory usage. Statistics are saved as JSON at
+# exit and periodically from a background thread during long runs.
+
+import os
+import json
+import time
+import atexit
+import resource
+import threading
+
+# Upper bounds of latency histogram buckets in seconds
+BUCKETS = [1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, 10.0, float('inf')]
+BUCKET_NAMES = ['<=1us', '<=10us', '<=100us', '<=1ms', '<=10ms', '<=100ms',
+                '<=1s', '<=10s', '>10s']
+
+
+class Timer(object):
+
+    def __init__(self):
+        self.total = 0.0
+        self.calls = 0
+        self.histogram = [0] * len(BUCKETS)
+
+    # Records calls taking seconds in total, each taking the same time
+    def record(self, seconds, calls=1):
+        if not calls:
+            return
+        self.total += seconds
+        self.calls += calls
+        latency = seconds / calls
+        for i, bound in enumerate(BUCKETS):
+            if latency <= bound:
+                self.histogram[i] += calls
+                break
+
+    def merge(self, other):
+        self.total += other.total
+        self.calls += other.calls
+        for i, count in enumerate(other.histogram):
+            self.histogram[i] += count
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.record(time.time() - self.start)
+
+    def report(self):
+        return {
+            'total_sec': self.total,
+            'calls': self.calls,
+            'avg_sec': self.total / self.calls if self.calls else None,
+            'histogram': [[name, count] for name, count
+                          in zip(BUCKET_NAMES, self.histogram)],
+        }
+
+
+class NullTimer(object):
+
+    def record(self, seconds, calls=1):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+# Returns the named timer or a timer doing nothing if statistics are disabled
+def timer(stats, name):
+    return stats.timer(name) if stats else NULL_TIMER
+
+
+class TimerSet(object):
+    # Timers without the rest of statistics, e.g. collected in a worker
+    # process and merged with Stats.merge_timers() by the main process
+
+    def __init__(self):
+        self.timers = {}
+
+    def timer(self, name):
+        if name not in self.timers:
+            self.timers[name] = Timer()
+        return self.timers[name]
+
+
+class Stats(object):
+
+    def __init__(self, path, interval=60):
+        self.path = path
+        self.start = time.time()
+        self.timers = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if interval:
+            self._thread = threading.Thread(target=self._dump_periodically,
+                                            args=(interval,))
+            self._thread.daemon = True
+            self._thread.start()
+        atexit.register(self.close)
+
+    def timer(self, name):
+        timer = self.timers.get(name)
+        if timer is None:
+            with self.lock:
+                timer = self.timers.setdefault(name, Timer())
+        return timer
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge_timers(self, timers):
+        for name, timer in timers.items():
+            self.timer(name).merge(timer)
+
+    def report(self):
+        elapsed = time.time() - self.start
+        with self.lock:
+            timers = list(self.timers.items())
+        report = {
+            'elapsed_sec': elapsed,
+            'counters': dict(self.counters),
+            'timers': {name: t.report() for name, t in timers},
+            'peak_rss_kb': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss,
+            'peak_rss_children_kb': resource.getrusage(
+                resource.RUSAGE_CHILDREN).ru_maxrss,
+        }
+        for name in ('candidates', 'sentences'):
+            if name in self.counters and elapsed:
+                report[name + '_per_sec'] = self.counters[name] / elapsed
+        counters = self.counters
+        if counters.get('candidates') and 'duplicates' in counters:
+            report['dedup_ratio'] = \
+                float(counters['duplicates']) / counters['candidates']
+        return report
+
+    def dump(self):
+        report = self.report()
+        # Write atomically, so that the file can be read during the run
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as out:
+            json.dump(report, out, indent=2, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+    def close(self):
+        # Stop the background thread before the interpreter shuts down
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.dump()
+
+    def _dump_periodically(self, interval):
+        while not self._stop.wait(interval):
+            self.dump()
+
+
+class TimedFeature(object):
+    # Feature wrapper measuring time of each candidate given to run() and
+    # run_batch()
+
+    def __init__(self, feat, timer):
+        self.feat = feat
+        self.timer = timer
+
+    def run(self, trg, src):
+        start = time.time()
+        result = self.feat.run(trg, src)
+        self.timer.record(time.time() - start)
+        return result
+
+    # Time of a batch is divided equally among its candidates
+    def run_batch(self, trgs, src):
+        start = time.time()
+        result = self.feat.run_batch(trgs, src)
+        self.timer.record(time.time() - start, len(trgs))
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.feat, name)
+
+
+class CountingFile(object):
+    # File wrapper counting bytes read or written, and optionally lines
+
+    def __init__(self, stream, stats, counter, line_counter=None):
+        self.stream = stream
+        self.stats = stats
+        self.counter = counter
+        self.line_counter = line_counter
+
+    def _count(self, line):
+        self.stats.count(self.counter, len(line))
+        if self.line_counter and line:
+            self.stats.count(self.line_counter)
+
+    def __iter__(self):
+        for line in self.stream:
+            self._count(line)
+            yield line
+
+    def next(self):
+        line = next(self.stream)
+        self._count(line)
+        return line
+
+    __next__ = next
+
+    def readline(self, *args):
+        line = self.stream.readline(*args)
+        self._count(line)
+        return line
+
+    def write(self, data):
+        self.stats.count(self.counter, len(data))
+        self.stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+# Store of sparse feature weights, e.g. of hundreds of thousands of edit
+# pattern features, kept out of rescore.ini in a binary sidecar file.
+#
+# The file starts with a magic string, the version and the number of weights,
+# followed by arrays aligned to 64 bytes:
+#
+#   keys     uint64[count]    sorted 64-bit MD5 prefixes of feature names
+#   weights  float64[count]   weights in the order of keys
+#
+# Arrays are opened with numpy.memmap, so loading does not depend on the
+# number of weights. Names are looked up in batches by binary search over the
+# keys, and weighted values of many hypotheses are summed at once. Different
+# weighted names with the same key are rejected when the file is created.
+
+import os
+import struct
+import hashlib
+
+import numpy as np
+
+MAGIC = b'YARSPARS'
+# Version 1 used CRC32 and Adler-32 checksums as keys
+VERSION = 2
+ALIGNMENT = 64
+HEADER = struct.Struct('<QQ')
+KEY = struct.Struct('<Q')
+MAX_HASH_CACHE = 1000000
+
+
+def is_binary(path):
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        if magic != MAGIC:
+            raise Exception('Not a binary sparse weight file: {}'
+                            .format(path))
+        version, count = HEADER.unpack(f.read(HEADER.size))
+    if version != VERSION:
+        raise Exception('Unsupported version {} of sparse weight file {}, '
+                        'run train.py --sparse again'.format(version, path))
+    if not count:
+        return SparseWeights(np.zeros(0, np.uint64), np.zeros(0))
+    offset = _align(len(MAGIC) + HEADER.size)
+    keys = np.memmap(path, dtype=np.uint64, mode='r', offset=offset,
+                     shape=(count,))
+    offset = _align(offset + keys.nbytes)
+    weights = np.memmap(path, dtype=np.float64, mode='r', offset=offset,
+                        shape=(count,))
+    return SparseWeights(keys, weights)
+
+
+# Reads weights from lines with a feature name, optionally followed by '=', and
+# its weight, or from a binary file
+def read(path):
+    if is_binary(path):
+        return load(path)
+    weights = {}
+    with open(path) as inp:
+        for line in inp:
+            if not line.strip():
+                continue
+            name, weight = line.split()
+            weights[strip_name(name)] = float(weight)
+    return from_dict(weights)
+
+
+def from_dict(weights):
+    names = list(weights)
+    keys = np.array([name_hash(name) for name in names], dtype=np.uint64)
+    values = np.array([weights[name] for name in names], dtype=np.float64)
+    order = np.argsort(keys, kind='mergesort')
+    keys = keys[order]
+    same = np.flatnonzero(keys[1:] == keys[:-1])
+    if len(same):
+        i = same[0]
+        raise Exception("Sparse features '{}' and '{}' have the same key"
+                        .format(names[order[i]], names[order[i + 1]]))
+    return SparseWeights(keys, values[order])
+
+
+def save(sparse, path):
+    with open(path, 'wb') as out:
+        out.write(MAGIC)
+        out.write(HEADER.pack(VERSION, len(sparse)))
+        position = len(MAGIC) + HEADER.size
+        for array in (sparse.keys, sparse.weights):
+            position = _pad(out, position, _align(position))
+            buf = np.ascontiguousarray(array).tobytes()
+            out.write(buf)
+            position += len(buf)
+        _pad(out, position, _align(position))
+
+
+class SparseWeights(object):
+
+    def __init__(self, keys, weights):
+        self.keys = keys
+        self.weights = weights
+        self.hash_cache = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, name):
+        return bool(self.find([name])[0][0])
+
+    def get(self, name, default=None):
+        found, idx = self.find([name])
+        return float(self.weights[idx[0]]) if found[0] else default
+
+    def hashes(self, names):
+        cache = self.hash_cache
+        if len(cache) > MAX_HASH_CACHE:
+            cache.clear()
+        hashes = []
+        for name in names:
+            h = cache.get(name)
+            if h is None:
+                h = cache[name] = name_hash(name)
+            hashes.append(h)
+        return np.array(hashes, dtype=np.uint64)
+
+    # Returns a mask of names with weights and their indices
+    def find(self, names):
+        keys = self.hashes(names)
+        if not len(self.keys):
+            return np.zeros(len(keys), dtype=bool), np.zeros(len(keys), int)
+        idx = np.searchsorted(self.keys, keys)
+        idx[idx == len(self.keys)] = 0
+        return self.keys[idx] == keys, idx
+
+    # Returns weights of names, zero for names without weights
+    def lookup(self, names):
+        found, idx = self.find(names)
+        return np.where(found, self.weights[idx], 0.0)
+
+    # Returns sums of weighted values for each of n rows, where names and
+    # values of sparse features are given with their rows
+    def dot(self, names, values, rows, n):
+        if not names:
+            return np.zeros(n)
+        weighted = self.lookup(names) * np.asarray(values, dtype=np.float64)
+        return np.bincount(rows, weights=weighted, minlength=n)
+
+
+# Names are stored without the trailing '=' of n-best lists
+def strip_name(name):
+    return name[:-1] if name.endswith('=') else name
+
+
+def name_hash(name):
+    return KEY.unpack(hashlib.md5(_encode(name)).digest()[:KEY.size])[0]
+
+
+def _align(position):
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _pad(output, position, target):
+    output.write(b'\0' * (target - position))
+    return target
+
+
+def _encode(text):
+    return text if isinstance(text, bytes) else text.encode('utf-8')
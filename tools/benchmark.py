@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Benchmarks features, n-best list processing and scripts on a synthetic
+# n-best list. Results are saved as JSON and can be compared with results of
+# a previous run to find regressions.
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from array import array
+from difflib import SequenceMatcher
+
+import numpy as np
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, ROOT_DIR)
+
+import rescore
+import featurizer
+
+
+def main():
+    args = parse_user_args()
+
+    work_dir = tempfile.mkdtemp(prefix='benchmark.')
+    try:
+        source = os.path.join(work_dir, 'source.txt')
+        nbest = os.path.join(work_dir, 'nbest.txt')
+        config = os.path.join(work_dir, 'rescore.ini')
+        run_script('tools/gen-nbest.py', '-s', source, '-o', nbest,
+                   '--sentences', str(args.sentences), '-n', str(args.n),
+                   '-l', str(args.length), '-f', str(args.features),
+                   '--seed', str(args.seed))
+        write_config(config, args.features)
+
+        benchmarks = [
+            ('iterate_nbest', bench_iterate_nbest, (nbest,)),
+            ('rescore_features', bench_rescore_features, (nbest, config)),
+            ('rescore.py', bench_script,
+             ('rescore.py', '-c', config, '-i', nbest)),
+            ('rescore.py --top-best', bench_script,
+             ('rescore.py', '-c', config, '-i', nbest, '-t')),
+            ('merge-features.py', bench_script,
+             ('merge-features.py', '-f', 'F0', 'F1', '-i', nbest)),
+            ('topbest.py', bench_script, ('topbest.py', '-i', nbest)),
+        ]
+        # Features needing external resources, e.g. the language model, are
+        # benchmarked by default only if they are configured
+        feats = args.feature_list or [name for name in featurizer.FEATURES
+                                      if is_available(name)]
+        for name in feats:
+            benchmarks.append(('feature ' + name, bench_feature,
+                               (name, nbest, source)))
+            benchmarks.append(('feature batch ' + name, bench_feature_batch,
+                               (name, nbest, source)))
+
+        # Features on string tokens compared with interned token ids
+        for name, tokens in sorted(INTERN_BENCHMARKS):
+            benchmarks.append(('intern {} {}'.format(name, tokens),
+                               bench_intern, (name, tokens, nbest, source)))
+
+        results = {}
+        n_hyps = args.sentences * args.n
+        for name, func, func_args in benchmarks:
+            if args.only and not any(o in name for o in args.only):
+                continue
+            seconds = min(func(*func_args) for _ in range(args.repeat))
+            results[name] = {
+                'seconds': seconds,
+                'candidates_per_sec': n_hyps / seconds if seconds else None,
+            }
+            sys.stderr.write('{:<30} {:>10.4f} s {:>12.1f} cand/s\n'
+                             .format(name, seconds,
+                                     results[name]['candidates_per_sec']))
+    finally:
+        shutil.rmtree(work_dir)
+
+    report = {
+        'config': {
+            'sentences': args.sentences,
+            'n': args.n,
+            'length': args.length,
+            'features': args.features,
+            'seed': args.seed,
+            'repeat': args.repeat,
+        },
+        'python': platform.python_version(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(report, out, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as inp:
+            previous = json.load(inp)
+        if previous.get('config') != report['config']:
+            sys.stderr.write('Warning: benchmark configurations differ\n')
+        if compare(previous['results'], results, args.threshold):
+            sys.exit(1)
+
+
+def compare(old, new, threshold):
+    regressions = 0
+    for name in sorted(new):
+        if name not in old:
+            continue
+        ratio = new[name]['seconds'] / max(old[name]['seconds'], 1e-9)
+        status = ''
+        if ratio > 1.0 + threshold:
+            status = 'REGRESSION'
+            regressions += 1
+        elif ratio < 1.0 - threshold:
+            status = 'improvement'
+        sys.stderr.write('{:<30} {:>10.4f} -> {:>10.4f} s {:>7.2f}x {}\n'
+                         .format(name, old[name]['seconds'],
+                                 new[name]['seconds'], ratio, status))
+    return regressions
+
+
+def is_available(name):
+    try:
+        featurizer.get_feature_class(name)()
+    except Exception as e:
+        sys.stderr.write('Warning: skipping feature {}: {}\n'.format(name, e))
+        return False
+    return True
+
+
+def bench_iterate_nbest(nbest):
+    with open(nbest) as inp:
+        start = time.time()
+        for _ in rescore.iterate_nbest(inp):
+            pass
+        return time.time() - start
+
+
+def bench_rescore_features(nbest, config):
+    with open(config) as inp:
+        weights = rescore.read_feature_weights(inp)
+    with open(nbest) as inp:
+        feats = [line.split(' ||| ')[2].split() for line in inp]
+    start = time.time()
+    for f in feats:
+        rescore.rescore_features(f, weights)
+    return time.time() - start
+
+
+def bench_feature(name, nbest, source):
+    feat = featurizer.get_feature_class(name)()
+    with open(nbest) as nbest_io, open(source) as source_io:
+        pairs = [(trg, src) for trg, src, _ in
+                 featurizer.iterate_nbest_sentences(nbest_io, source_io)]
+    start = time.time()
+    for trg, src in pairs:
+        feat.run(trg, src)
+    return time.time() - start
+
+
+def bench_feature_batch(name, nbest, source):
+    feat = featurizer.get_feature_class(name)()
+    with open(nbest) as nbest_io, open(source) as source_io:
+        groups = [(src, [trg for trg, _ in group]) for src, group in
+                  featurizer.iterate_sentence_groups(
+                      featurizer.iterate_nbest_sentences(nbest_io,
+                                                         source_io))]
+    start = time.time()
+    for src, trgs in groups:
+        feat.run_batch(trgs, src)
+    return time.time() - start
+
+
+class Vocabulary(object):
+    # Interns tokens to integer ids, as a token id layer shared by features
+    # would
+
+    def __init__(self):
+        self.ids = {}
+
+    def encode(self, text):
+        ids = self.ids
+        return array('i', [ids.setdefault(tok, len(ids))
+                           for tok in text.split()])
+
+
+def wprec_ids(trgs, src, vocab):
+    src_ids = vocab.encode(src)
+    src_set = set(src_ids)
+    values = []
+    for trg in trgs:
+        trg_ids = vocab.encode(trg)
+        prec = len([t for t in trg_ids if t in src_set]) / \
+            float(len(trg_ids) + 1)
+        trg_set = set(trg_ids)
+        recl = len([t for t in src_ids if t in trg_set]) / \
+            float(len(src_ids) + 1)
+        values.append([prec, recl])
+    return values
+
+
+def wprec_numpy(trgs, src, vocab):
+    # Hypotheses of a sentence are encoded into a single vector
+    src_ids = np.array(vocab.encode(src), dtype=np.int32)
+    encoded = [vocab.encode(trg) for trg in trgs]
+    lengths = np.array([len(ids) for ids in encoded])
+    rows = np.repeat(np.arange(len(trgs)), lengths)
+    trg_ids = np.array([t for ids in encoded for t in ids], dtype=np.int32)
+    matched = np.bincount(rows, weights=np.in1d(trg_ids, src_ids),
+                          minlength=len(trgs))
+    precs = matched / (lengths + 1.0)
+    recls = [np.in1d(src_ids, trg_ids[rows == n]).sum()
+             / float(len(src_ids) + 1) for n in range(len(trgs))]
+    return [list(values) for values in zip(precs, recls)]
+
+
+def edits_ids(trgs, src, vocab):
+    src_ids = vocab.encode(src)
+    values = []
+    for trg in trgs:
+        ops = [tag for tag, _, _, _, _ in
+               SequenceMatcher(None, src_ids, vocab.encode(trg))
+               .get_opcodes()]
+        values.append([ops.count('insert'), ops.count('delete'),
+                       ops.count('replace')])
+    return values
+
+
+def ratio_ids(trgs, src, vocab):
+    src_size = len(vocab.encode(src)) + 1
+    return [[(len(vocab.encode(trg)) + 1) / float(src_size)]
+            for trg in trgs]
+
+
+def encode_strings(trgs, src, vocab):
+    src.split()
+    return [trg.split() for trg in trgs]
+
+
+def encode_ids(trgs, src, vocab):
+    vocab.encode(src)
+    return [vocab.encode(trg) for trg in trgs]
+
+
+# Functions computing values of features on hypotheses of a sentence, None for
+# features themselves working on strings
+INTERN_BENCHMARKS = {
+    ('encode', 'strings'): encode_strings,
+    ('encode', 'ids'): encode_ids,
+    ('wprec', 'strings'): None,
+    ('wprec', 'ids'): wprec_ids,
+    ('wprec', 'numpy'): wprec_numpy,
+    ('edits', 'strings'): None,
+    ('edits', 'ids'): edits_ids,
+    ('ratio', 'strings'): None,
+    ('ratio', 'ids'): ratio_ids,
+}
+
+
+def bench_intern(name, tokens, nbest, source):
+    # Values of features on strings are computed by the features themselves,
+    # and on token ids by equivalent functions including encoding of tokens
+    with open(nbest) as nbest_io, open(source) as source_io:
+        groups = [(src, [trg for trg, _ in group]) for src, group in
+                  featurizer.iterate_sentence_groups(
+                      featurizer.iterate_nbest_sentences(nbest_io,
+                                                         source_io))]
+    func = INTERN_BENCHMARKS[name, tokens]
+    vocab = Vocabulary()
+    if func is None:
+        feat = featurizer.get_feature_class(name)()
+        start = time.time()
+        for src, trgs in groups:
+            feat.values_batch(trgs, src)
+    else:
+        start = time.time()
+        for src, trgs in groups:
+            func(trgs, src, vocab)
+    return time.time() - start
+
+
+def bench_script(script, *args):
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        run_script(script, *args, stdout=devnull)
+        return time.time() - start
+
+
+def run_script(script, *args, **kwargs):
+    cmd = [sys.executable, os.path.join(ROOT_DIR, script)] + list(args)
+    subprocess.check_call(cmd, **kwargs)
+
+
+def write_config(config, n_features):
+    with open(config, 'w') as out:
+        out.write('[weight]\n')
+        for i in range(n_features):
+            out.write('F{}= {}\n'.format(i, 1.0 / (i + 1)))
+
+
+def parse_user_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='output JSON file with results')
+    parser.add_argument('-c', '--compare', metavar='FILE',
+                        help='compare with results from JSON file and exit '
+                        'with status 1 if there are regressions')
+    parser.add_argument('--threshold', metavar='FLOAT', default=0.1,
+                        type=float,
+                        help='relative slowdown reported as a regression, '
+                        'default: %(default)s')
+    parser.add_argument('-r', '--repeat', metavar='N', default=3, type=int,
+                        help='number of repetitions, the fastest is '
+                        'reported, default: %(default)s')
+    parser.add_argument('--only', metavar='STR', nargs='+',
+                        help='run only benchmarks containing any of strings')
+    parser.add_argument('--feature-list', metavar='FEATURE', nargs='+',
+                        help='benchmarked features, default: all')
+    parser.add_argument('--sentences', metavar='N', default=1000, type=int,
+                        help='number of sentences, default: %(default)s')
+    parser.add_argument('-n', metavar='N', default=10, type=int,
+                        help='candidates per sentence, default: %(default)s')
+    parser.add_argument('-l', '--length', metavar='N', default=20, type=int,
+                        help='average sentence length, default: %(default)s')
+    parser.add_argument('-f', '--features', metavar='N', default=4, type=int,
+                        help='number of dense features, default: %(default)s')
+    parser.add_argument('--seed', metavar='N', default=1, type=int,
+                        help='random seed, default: %(default)s')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Checks that values of the fast edit features are the same as of the difflib
+# features on random sentences, including repetitive and long ones for which
+# difflib ignores frequent items. Exits with status 1 if they differ.
+
+import os
+import sys
+import argparse
+import random
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, ROOT_DIR)
+
+import featurizer
+
+# Pairs of the reference and checked features
+FEATURES = [('edits', 'fastedits'), ('charedits', 'fastcharedits')]
+
+
+def main():
+    args = parse_user_args()
+    rand = random.Random(args.seed)
+    pairs = [(featurizer.get_feature_class(ref)(),
+              featurizer.get_feature_class(feat)()) for ref, feat in FEATURES]
+
+    errors = 0
+    for _ in range(args.sentences):
+        words = ['w{}'.format(i) for i in range(rand.choice(args.vocab))]
+        size = rand.randint(0, args.length)
+        src = ' '.join(rand.choice(words) for _ in range(size))
+        trgs = [' '.join(perturb(src.split(), words, rand))
+                for _ in range(args.n)]
+        for ref, feat in pairs:
+            for trg, expected, values in zip(trgs,
+                                             ref.values_batch(trgs, src),
+                                             feat.values_batch(trgs, src)):
+                if values != expected:
+                    errors += 1
+                    sys.stderr.write('Error: {} differs from {}:\n{}\n{}\n'
+                                     .format(feat.name, ref.name, src, trg))
+    print('{} sentences, {} differences'.format(args.sentences, errors))
+    if errors:
+        sys.exit(1)
+
+
+def perturb(toks, words, rand):
+    toks = list(toks)
+    for _ in range(rand.randint(0, max(1, len(toks) // 3))):
+        op = rand.randint(0, 3)
+        pos = rand.randint(0, len(toks))
+        if op == 0 or not toks:
+            toks.insert(pos, rand.choice(words))
+        elif pos == len(toks):
+            continue
+        elif op == 1:
+            del toks[pos]
+        elif op == 2:
+            toks[pos] = rand.choice(words)
+        else:
+            # Repeated phrases make ties between matching blocks frequent
+            toks[pos:pos] = toks[pos:pos + rand.randint(1, 4)]
+    return toks
+
+
+def parse_user_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sentences', metavar='N', default=1000, type=int,
+                        help='number of sentences, default: %(default)s')
+    parser.add_argument('-n', metavar='N', default=10, type=int,
+                        help='candidates per sentence, default: %(default)s')
+    parser.add_argument('-l', '--length', metavar='N', default=250, type=int,
+                        help='maximum sentence length, default: %(default)s')
+    parser.add_argument('--vocab', metavar='N', default=[3, 20, 1000],
+                        type=int, nargs='+',
+                        help='vocabulary sizes chosen randomly for each '
+                        'sentence, default: %(default)s')
+    parser.add_argument('--seed', metavar='N', default=1, type=int,
+                        help='random seed, default: %(default)s')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
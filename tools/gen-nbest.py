@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Generates a synthetic n-best list with dense features and matching source
+# sentences, e.g. for benchmarking.
+
+import sys
+import argparse
+import random
+
+
+def main():
+    args = parse_user_args()
+    generate(args.source, args.nbest, args.sentences, args.n, args.length,
+             args.features, args.vocab, args.seed)
+
+
+def generate(source, nbest, sentences=1000, n=10, length=20, features=4,
+             vocab=5000, seed=1):
+    rand = random.Random(seed)
+    words = ['w{}'.format(i) for i in range(vocab)]
+    for sid in range(sentences):
+        size = max(1, int(rand.gauss(length, length / 3.0)))
+        src = [rand.choice(words) for _ in range(size)]
+        source.write(' '.join(src) + '\n')
+        for _ in range(n):
+            trg = perturb(src, words, rand)
+            feats = ' '.join('F{}= {:.4f}'.format(i, rand.uniform(-10, 0))
+                             for i in range(features))
+            nbest.write('{} ||| {} ||| {} ||| {:.4f}\n'
+                        .format(sid, ' '.join(trg), feats,
+                                rand.uniform(-20, 0)))
+
+
+def perturb(toks, words, rand):
+    toks = list(toks)
+    for _ in range(rand.randint(0, max(1, len(toks) // 5))):
+        op = rand.randint(0, 2)
+        pos = rand.randint(0, len(toks))
+        if op == 0 or not toks:
+            toks.insert(pos, rand.choice(words))
+        elif op == 1:
+            del toks[min(pos, len(toks) - 1)]
+        else:
+            toks[min(pos, len(toks) - 1)] = rand.choice(words)
+    return toks
+
+
+def parse_user_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--source', metavar='FILE', required=True,
+                        type=argparse.FileType('w'),
+                        help='output source sentences')
+    parser.add_argument('-o', '--nbest', metavar='FILE', nargs='?',
+                        type=argparse.FileType('w'), default=sys.stdout,
+                        help='output n-best list, default: STDOUT')
+    parser.add_argument('--sentences', metavar='N', default=1000, type=int,
+                        help='number of sentences, default: %(default)s')
+    parser.add_argument('-n', metavar='N', default=10, type=int,
+                        help='candidates per sentence, default: %(default)s')
+    parser.add_argument('-l', '--length', metavar='N', default=20, type=int,
+                        help='average sentence length, default: %(default)s')
+    parser.add_argument('-f', '--features', metavar='N', default=4, type=int,
+                        help='number of dense features, default: %(default)s')
+    parser.add_argument('--vocab', metavar='N', default=5000, type=int,
+                        help='vocabulary size, default: %(default)s')
+    parser.add_argument('--seed', metavar='N', default=1, type=int,
+                        help='random seed, default: %(default)s')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
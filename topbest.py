@@ -2,27 +2,73 @@
 # -*- coding: utf-8 -*-
 
 import sys
+import argparse
+
+import numpy as np
+
+import compressed
+import nbestbin
+import topk
 
 SCORE_FIELD = 3
 
 
 def main():
-    i = None
-    text = None
-    best = 0
+    args = parse_user_args()
+    k = args.k or 1
+
+    if nbestbin.is_binary(args.input):
+        nbest = nbestbin.load(args.input.name)
+        for sid, start, end in nbest.iterate_sentences():
+            # Stable sort keeps the first of equal scores
+            order = np.argsort(-nbest.scores[start:end], kind='mergesort')
+            for i in order[:k]:
+                write_candidate(nbest, sid, start + int(i), args)
+        return
 
-    for line in sys.stdin:
+    # Only the k best candidates of each sentence are kept while reading
+    top = None
+    prev_sid = None
+    for line in args.input:
         fields = [f.strip() for f in line.split('|||')]
-        sid = fields[0]
-        if i != sid:
-            if i:
-                sys.stdout.write(text + '\n')
-        score = float(fields[SCORE_FIELD])
-        if score > best or i != sid:
-            i = sid
-            text = fields[1]
-            best = score
-    sys.stdout.write(text + '\n')
+        if fields[0] != prev_sid:
+            if top:
+                write_top(top, args)
+            top = topk.TopK(k)
+            prev_sid = fields[0]
+        top.push(float(fields[SCORE_FIELD]), fields)
+    if top:
+        write_top(top, args)
+
+
+def write_top(top, args):
+    for _, fields in top.items():
+        if args.k:
+            args.output.write(' ||| '.join(fields) + '\n')
+        else:
+            args.output.write(fields[1] + '\n')
+
+
+def write_candidate(nbest, sid, i, args):
+    if args.k:
+        args.output.write(nbest.hyp_line(sid, i) + '\n')
+    else:
+        args.output.write(nbest.hyp_text(i) + '\n')
+
+
+def parse_user_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', metavar='FILE', nargs='?',
+                        type=compressed.FileType('r'), default=sys.stdin,
+                        help='input n-best list, default: STDIN')
+    parser.add_argument('-o', '--output', metavar='FILE', nargs='?',
+                        type=compressed.FileType('w'), default=sys.stdout,
+                        help='output top best candidates, default: STDOUT')
+    parser.add_argument('-k', '--k', metavar='N', type=int,
+                        help='output the n-best list pruned to N best '
+                        'candidates of each sentence instead of texts of '
+                        'top best candidates')
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
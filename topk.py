@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+# Streaming selection of the k best items with a bounded min-heap, shared by
+# rescore.py and topbest.py. Ties are resolved in favour of earlier items, so
+# the result is the same as the first k items of a stable descending sort.
+
+import heapq
+
+
+class TopK(object):
+
+    def __init__(self, k):
+        self.k = k
+        self.heap = []
+        self.count = 0
+
+    def push(self, score, item):
+        # Earlier items have larger second keys and win ties
+        entry = (score, -self.count, item)
+        self.count += 1
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, entry)
+        elif entry[:2] > self.heap[0][:2]:
+            heapq.heapreplace(self.heap, entry)
+
+    def __len__(self):
+        return len(self.heap)
+
+    # Returns pairs of scores and items sorted from the best
+    def items(self):
+        entries = sorted(self.heap, key=lambda e: e[:2], reverse=True)
+        return [(score, item) for score, _, item in entries]
@@ -2,17 +2,24 @@
 
 import os
 import sys
+import shutil
+import hashlib
 import subprocess
 import argparse
+import itertools
+import multiprocessing
 
-FEATURE_FIELD = 2
+import numpy as np
 
-FILTERS = {
-    'none': "",
-    'default': r"sed -ur -e 's/^( *)(.)/\1\u\2/' -e 's/@@ //g'",
-    'debpe': r"sed -ur -e 's/@@ //g'",
-    'ape': r"sed -ur -e 's/<step>//g' -e 's/^( *)(.)/\1\u\2/' -e 's/@@ //g' -e 's/  / /g'",
-}
+import compressed
+import metrics
+import mira
+import nbestbin
+import runstats
+import sparse
+
+FEATURE_FIELD = 2
+SPARSE_FILE = 'rescore.sparse'
 
 METRICS = {
     'bleu': {
@@ -37,48 +44,335 @@ METRICS = {
     },
 }
 
+# Metrics with statistics computed in-process, the same as of the Moses scorers
+IN_PROCESS_METRICS = ('BLEU', 'TER')
+
 
 def main():
     args = parse_user_args()
 
-    # Find executables
-    extractor_exe = find_executable(args.bin_dir, 'extractor')
-    kbmira_exe = find_executable(args.bin_dir, 'kbmira')
+    stats = None
+    if args.stats:
+        stats = runstats.Stats(args.stats, args.stats_interval)
+        stats.count('bytes_read', os.path.getsize(args.nbest))
+
+    # Metric statistics of BLEU and TER are computed in-process, the Moses
+    # extractor is needed only for other metrics
+    metric = METRICS[args.metric]
+    extractor_exe = None
+    if metric['sctype'] not in IN_PROCESS_METRICS:
+        extractor_exe = find_executable(args.bin_dir, 'extractor')
+    if args.optimizer == 'kbmira':
+        find_executable(args.bin_dir, 'kbmira')
 
     # Create working directory
     if not os.path.exists(args.work_dir):
         os.mkdir(args.work_dir)
 
-    # Read sparse features
-    sparse_feats = {}
+    # Read sparse features and store them next to rescore.ini
+    sparse_feats = None
     if args.sparse:
         sparse_feats = read_ini_features(args.sparse)
+        sparse_file = os.path.join(args.work_dir, SPARSE_FILE)
+        if not os.path.exists(sparse_file) or \
+                not os.path.samefile(args.sparse, sparse_file):
+            sparse.save(sparse_feats, sparse_file)
 
     # Get feature names and initial weights from N-best list
     init_weights = extract_features(
         args.nbest, skip_feats=sparse_feats, skip_prefix=args.sparse_prefix)
 
+    # The extractor reads only text n-best lists
+    nbest_file = args.nbest
+    if nbestbin.is_binary(args.nbest):
+        nbest_file = os.path.join(args.work_dir, 'nbest.txt')
+        with runstats.timer(stats, 'convert'), open(nbest_file, 'w') as out:
+            nbestbin.write_text(nbestbin.load(args.nbest), out)
+
     # Run extractor
-    metric = METRICS[args.metric]
+    with runstats.timer(stats, 'extractor'):
+        run_extractor(args, metric, extractor_exe, nbest_file, stats)
+
+    if args.restarts > 1:
+        opt_weights = run_restarts(args, metric, init_weights, sparse_feats,
+                                   stats)
+    elif args.optimizer == 'kbmira':
+        with runstats.timer(stats, 'optimizer'):
+            opt_weights = run_kbmira(args, metric, init_weights)
+    else:
+        opt_weights = run_mira(args, metric, init_weights, sparse_feats,
+                               stats)
+
+    # Generate rescore.ini
+    ini_file = os.path.join(args.work_dir, 'rescore.ini')
+    generate_ini(ini_file, opt_weights, sparse_feats is not None)
+
+
+def run_extractor(args, metric, extractor_exe, nbest_file, stats=None):
+    # The n-best list is split into shards of sentences processed in
+    # parallel. Metric statistics of each shard are cached with a key computed
+    # from hypotheses, references, the metric and the filter, so that if only
+    # features change, the extractor is not run again and feature data are
+    # written directly. Without the extractor, statistics are computed
+    # in-process and written in the same format.
+    global _shard_scorer
+    shard_dir = os.path.join(args.work_dir, 'shards')
+    cache_dir = args.cache_dir or os.path.join(args.work_dir, 'cache')
+    for path in (shard_dir, cache_dir):
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    config = [hash_files(args.reference.split(',')),
+              metric['sctype'], metric['scconfig'], args.filter]
+    if extractor_exe is None:
+        config.append('in-process')
+        # Worker processes get the scorer when forked
+        _shard_scorer = metrics.create_scorer(
+            metric['sctype'], mira.Metric(metric['sctype'],
+                                          metric['scconfig']).config,
+            args.reference.split(','))
+    reference = args.reference
+    if extractor_exe is not None:
+        reference = decompress_references(args.reference, args.work_dir)
+    tasks = []
+    for shard_file, key, dense in split_nbest(nbest_file, shard_dir,
+                                              args.shard_size, config,
+                                              args.filter):
+        cache_file = os.path.join(cache_dir, key + '.scores')
+        tasks.append((extractor_exe, metric, reference, shard_file,
+                      cache_file, dense))
+
+    # Failed shards are never cached
+    try:
+        if args.jobs > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(args.jobs)
+            try:
+                cached = pool.map(extract_shard, tasks)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            cached = [extract_shard(task) for task in tasks]
+    except Exception as e:
+        sys.stderr.write('Error: {}\n'.format(e))
+        sys.exit(1)
+    sys.stdout.write("Extracted {} shards, {} with cached scores\n"
+                     .format(len(tasks), sum(cached)))
+    if stats:
+        stats.count('shards', len(tasks))
+        stats.count('cached_shards', sum(cached))
+
+    for suffix, name in [('.scores', 'scores.dat'),
+                         ('.features', 'features.dat')]:
+        with open(os.path.join(args.work_dir, name), 'w') as out:
+            for task in tasks:
+                with open(task[3] + suffix) as inp:
+                    shutil.copyfileobj(inp, out)
+
+
+def split_nbest(nbest_file, shard_dir, size, config, filter_name='none'):
+    # Yields paths to shards, their cache keys, and whether all features are
+    # dense. Post-processing filters are applied to hypotheses here with
+    # metrics.FILTERS, also for the extractor, so that the filters are the
+    # same as of evaluate.py
+    shard = None
+    n_shards = 0
+    n_sents = 0
+    prev_sid = None
+    with compressed.open_file(nbest_file) as inp:
+        for line in inp:
+            fields = line.split(' ||| ')
+            if fields[0] != prev_sid:
+                if n_sents == size:
+                    shard.close()
+                    yield shard.name, key.hexdigest(), dense
+                    shard = None
+                if shard is None:
+                    path = os.path.join(shard_dir,
+                                        'nbest.{:05d}'.format(n_shards))
+                    shard = open(path, 'w')
+                    key = hashlib.sha1(encode('\0'.join(config)))
+                    dense = True
+                    n_shards += 1
+                    n_sents = 0
+                n_sents += 1
+                prev_sid = fields[0]
+                dense = dense and not any(
+                    is_sparse_feature(f) for f in
+                    fields[FEATURE_FIELD].split() if f.endswith('='))
+            if filter_name != 'none':
+                fields[1] = metrics.apply_filter(filter_name, fields[1])
+                line = ' ||| '.join(fields)
+            shard.write(line)
+            key.update(encode(fields[0] + ' ||| ' + fields[1] + '\n'))
+    if shard is not None:
+        shard.close()
+        yield shard.name, key.hexdigest(), dense
+
+
+def extract_shard(task):
+    extractor_exe, metric, reference, nbest_file, cache_file, dense = task
+    scores_file = nbest_file + '.scores'
+    features_file = nbest_file + '.features'
+    # Feature data are written here for dense features or without the
+    # extractor, otherwise the extractor is run to handle sparse features
+    if (dense or extractor_exe is None) and os.path.exists(cache_file):
+        shutil.copyfile(cache_file, scores_file)
+        write_feature_data(nbest_file, features_file)
+        return True
+
+    # Outputs of previous runs must not be mistaken for new ones
+    for path in (scores_file, features_file):
+        if os.path.exists(path):
+            os.remove(path)
+    if extractor_exe is None:
+        write_metric_stats(nbest_file, scores_file, metric['sctype'])
+        write_feature_data(nbest_file, features_file)
+    else:
+        run_extractor_exe(extractor_exe, metric, reference, nbest_file,
+                          scores_file, features_file)
+    for path in (scores_file, features_file):
+        if not os.path.exists(path) or not os.path.getsize(path):
+            raise Exception('No metric statistics or feature data for {}, '
+                            'missing or empty {}'.format(nbest_file, path))
+
+    # Replace atomically, other processes may use the same cache
+    tmp_file = '{}.{}'.format(cache_file, os.getpid())
+    try:
+        shutil.copyfile(scores_file, tmp_file)
+        os.rename(tmp_file, cache_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return False
+
+
+def run_extractor_exe(extractor_exe, metric, reference, nbest_file,
+                      scores_file, features_file):
     extractor_cmd = [
         extractor_exe,
         '--sctype',   metric['sctype'],
         '--scconfig', metric['scconfig'],
-        '--scfile',   os.path.join(args.work_dir, 'scores.dat'),
-        '--ffile',    os.path.join(args.work_dir, 'features.dat'),
-        '--filter',   FILTERS[args.filter],
-        '-r',         args.reference,
-        '-n',         args.nbest
+        '--scfile',   scores_file,
+        '--ffile',    features_file,
+        '-r',         reference,
+        '-n',         nbest_file
     ]
-
-    sys.stdout.write("RUNNING: " + ' '.join(extractor_cmd))
-    subprocess.call(extractor_cmd)
-
+    sys.stdout.write("RUNNING: " + ' '.join(extractor_cmd) + '\n')
+    code = subprocess.call(extractor_cmd)
+    if code:
+        raise Exception('Extractor failed on {} with exit code {}'
+                        .format(nbest_file, code))
+
+
+_shard_scorer = None
+
+
+# Writes scores.dat in the format of the extractor with statistics of the
+# in-process scorer
+def write_metric_stats(nbest_file, scores_file, sctype):
+    with open(nbest_file) as inp, open(scores_file, 'w') as out:
+        for sid, lines in itertools.groupby(
+                inp, key=lambda line: line.split(' ||| ', 1)[0]):
+            stats = [_shard_scorer.stats(int(sid),
+                                         line.split(' ||| ')[1].strip())
+                     for line in lines]
+            out.write('SCORES_TXT_BEGIN_0 {} {} {} {}\n'
+                      .format(sid, len(stats), len(stats[0]), sctype))
+            for values in stats:
+                out.write(' '.join(format_stat(v) for v in values) + '\n')
+            out.write('SCORES_TXT_END_0\n')
+
+
+def format_stat(value):
+    return str(int(value)) if value == int(value) else repr(float(value))
+
+
+# Writes features.dat in the format of the extractor, i.e. dense feature values
+# are named after features with indices of their values, and values of sparse
+# features are given with their names
+def write_feature_data(nbest_file, features_file):
+    with open(nbest_file) as inp, open(features_file, 'w') as out:
+        block = []
+        for line in inp:
+            fields = line.split(' ||| ')
+            if block and fields[0] != block[0][0]:
+                write_feature_block(block, out)
+                block = []
+            block.append(fields)
+        if block:
+            write_feature_block(block, out)
+
+
+def write_feature_block(block, out):
+    names = []
+    feat = ''
+    n = 0
+    for tok in block[0][FEATURE_FIELD].split():
+        if tok.endswith('='):
+            feat = tok[:-1]
+            n = 0
+        elif not is_sparse_feature(feat):
+            names.append('{}_{}'.format(feat, n))
+            n += 1
+    out.write('FEATURES_TXT_BEGIN_0 {} {} {} {}\n'
+              .format(block[0][0], len(block), len(names), ' '.join(names)))
+    for fields in block:
+        dense = []
+        sparse_values = []
+        feat = ''
+        for tok in fields[FEATURE_FIELD].split():
+            if tok.endswith('='):
+                feat = tok[:-1]
+            elif is_sparse_feature(feat):
+                sparse_values.append('{}={}'.format(feat, tok))
+            else:
+                dense.append(tok)
+        out.write(' '.join(dense + sparse_values) + '\n')
+    out.write('FEATURES_TXT_END_0\n')
+
+
+# The extractor treats features with underscores in names as sparse
+def is_sparse_feature(name):
+    return '_' in name
+
+
+def encode(text):
+    return text if isinstance(text, bytes) else text.encode('utf-8')
+
+
+# Returns comma-separated references, of which compressed ones are decompressed
+# to the working directory for the extractor
+def decompress_references(references, work_dir):
+    paths = []
+    for i, path in enumerate(references.split(',')):
+        if compressed.is_compressed(path):
+            plain_path = os.path.join(work_dir, 'reference.{}'.format(i))
+            with compressed.open_file(path, 'rb') as inp, \
+                    open(plain_path, 'wb') as out:
+                shutil.copyfileobj(inp, out)
+            path = plain_path
+        paths.append(path)
+    return ','.join(paths)
+
+
+def hash_files(paths):
+    digest = hashlib.sha1()
+    for path in paths:
+        with compressed.open_file(path, 'rb') as inp:
+            for buf in iter(lambda: inp.read(1 << 20), b''):
+                digest.update(buf)
+    return digest.hexdigest()
+
+
+def run_kbmira(args, metric, init_weights, suffix='', seed=None):
     # Write feature list
-    feat_file = os.path.join(args.work_dir, 'init.dense')
+    feat_file = os.path.join(args.work_dir, 'init.dense' + suffix)
     create_feature_list(feat_file, init_weights)
 
     # Run kbMIRA
+    kbmira_exe = find_executable(args.bin_dir, 'kbmira')
+    mert_file = os.path.join(args.work_dir, 'mert.out' + suffix)
     kbmira_cmd = [
         kbmira_exe,
         '--dense-init', feat_file,
@@ -86,23 +380,133 @@ def main():
         '--scfile',     os.path.join(args.work_dir, 'scores.dat'),
         '--sctype',     metric['sctype'],
         '--scconfig',   metric['scconfig'],
-        '-o',           os.path.join(args.work_dir, 'mert.out'),
+        '-o',           mert_file,
         '--iters',      str(args.iterations)
     ]
+    if seed is not None:
+        kbmira_cmd += ['--random-seed', str(seed)]
 
-    sys.stdout.write("RUNNING: " + ' '.join(kbmira_cmd))
+    sys.stdout.write("RUNNING: " + ' '.join(kbmira_cmd) + '\n')
     subprocess.call(kbmira_cmd)
 
     # Read optimized weights
-    mert_file = os.path.join(args.work_dir, 'mert.out')
-    opt_weights = read_weights(mert_file, init_weights)
+    return read_weights(mert_file, init_weights)
+
+
+def run_mira(args, metric, init_weights, sparse_feats, stats=None):
+    data = read_extractor_data(args, init_weights, sparse_feats, stats)
+    scorer = create_metric(metric)
+    with runstats.timer(stats, 'optimizer'):
+        return optimize_mira(data, scorer, init_weights, args.iterations,
+                             args.seed)
+
+
+def read_extractor_data(args, init_weights, sparse_feats, stats=None):
+    columns = ['{}_{}'.format(feat[:-1], i)
+               for feat, ws in init_weights for i in range(len(ws))]
+    with runstats.timer(stats, 'read_extractor_data'):
+        data = mira.read_extractor_data(
+            os.path.join(args.work_dir, 'features.dat'),
+            os.path.join(args.work_dir, 'scores.dat'),
+            columns, fixed_weights=sparse_feats)
+    if stats:
+        stats.count('sentences', len(data))
+        stats.count('candidates', len(data.features))
+    return data
+
+
+def create_metric(metric, advice='please use --optimizer kbmira'):
+    try:
+        return mira.Metric(metric['sctype'], metric['scconfig'])
+    except ValueError as e:
+        sys.stderr.write('Error: {}, {}\n'.format(e, advice))
+        sys.exit(1)
 
-    # Generate rescore.ini
-    ini_file = os.path.join(args.work_dir, 'rescore.ini')
-    generate_ini(ini_file, opt_weights, sparse=sparse_feats)
 
+def optimize_mira(data, scorer, init_weights, iterations, seed):
+    sys.stdout.write("RUNNING: in-process kbMIRA on {} sentences\n"
+                     .format(len(data)))
+    init = [w for _, ws in init_weights for w in ws]
+    weights, score = mira.kbmira(data, scorer, init, iterations=iterations,
+                                 seed=seed)
+    sys.stdout.write("Best {}: {}\n".format(scorer.sctype, score))
 
-def generate_ini(ini_file, opt_weights, sparse=None):
+    # Same structure as original weight list
+    opt_weights = []
+    i = 0
+    for (feat, ws) in init_weights:
+        opt_weights.append([feat, weights[i:i + len(ws)].tolist()])
+        i += len(ws)
+    return normalize_weights(opt_weights)
+
+
+def run_restarts(args, metric, init_weights, sparse_feats, stats=None):
+    # The first run starts from the initial weights, the others from randomly
+    # perturbed weights and with different seeds. Each resulting rescore.ini
+    # is evaluated on the dev set with the in-process metric.
+    global _restart_args
+    data = read_extractor_data(args, init_weights, sparse_feats, stats)
+    scorer = create_metric(metric, 'restarts need it to select the best run')
+    rand = np.random.RandomState(args.seed)
+    tasks = []
+    for i in range(args.restarts):
+        init = [[feat, list(ws)] for feat, ws in init_weights]
+        if i > 0:
+            for _, ws in init:
+                for j in range(len(ws)):
+                    ws[j] += rand.uniform(-args.perturb, args.perturb)
+        tasks.append((i, args.seed + i, init))
+
+    # Worker processes get the data when forked
+    _restart_args = (args, metric, data, scorer)
+    with runstats.timer(stats, 'optimizer'):
+        if args.jobs > 1:
+            pool = multiprocessing.Pool(min(args.jobs, args.restarts))
+            results = pool.map(run_restart, tasks)
+            pool.close()
+            pool.join()
+        else:
+            results = [run_restart(task) for task in tasks]
+    if stats:
+        stats.count('restarts', len(results))
+
+    summary = []
+    for (i, seed, _), opt_weights in zip(tasks, results):
+        weights = [w for _, ws in opt_weights for w in ws]
+        best = data.model_best(np.array(weights))
+        score = scorer.score(data.stats[best].sum(axis=0))
+        ini_file = os.path.join(args.work_dir, 'rescore.{}.ini'.format(i))
+        generate_ini(ini_file, opt_weights, sparse_feats is not None)
+        summary.append((score, i, seed, ini_file, opt_weights))
+
+    best_run = max(summary, key=lambda run: (run[0], -run[1]))
+    summary_file = os.path.join(args.work_dir, 'restarts.txt')
+    with open(summary_file, 'w') as out:
+        out.write('run\tseed\t{}\tini\n'.format(metric['sctype']))
+        for score, i, seed, ini_file, _ in summary:
+            mark = '\tbest' if i == best_run[1] else ''
+            out.write('{}\t{}\t{:.6f}\t{}{}\n'
+                      .format(i, seed, score, ini_file, mark))
+    sys.stdout.write("Best of {} runs: run {} with {} = {}, see {}\n"
+                     .format(len(summary), best_run[1], metric['sctype'],
+                             best_run[0], summary_file))
+    return best_run[4]
+
+
+_restart_args = None
+
+
+def run_restart(task):
+    i, seed, init_weights = task
+    args, metric, data, scorer = _restart_args
+    if args.optimizer == 'kbmira':
+        return run_kbmira(args, metric, init_weights, '.{}'.format(i), seed)
+    return optimize_mira(data, scorer, init_weights, args.iterations, seed)
+
+
+# Sparse weights are not written to rescore.ini, which refers to the binary
+# file with them in the same directory
+def generate_ini(ini_file, opt_weights, sparse=False):
     with open(ini_file, 'w') as out:
         out.write('# Rescored feature weights\n')
         out.write('\n')
@@ -111,13 +515,13 @@ def generate_ini(ini_file, opt_weights, sparse=None):
             weights = ' '.join(str(w) for w in ws)
             out.write('{} {}\n'.format(feat, weights))
         if sparse:
-            for f in sparse:
-                out.write('{}= {}\n'.format(f, sparse[f]))
+            out.write('\n')
+            out.write('[sparse]\n')
+            out.write('{}\n'.format(SPARSE_FILE))
 
 
 def read_weights(mert_file, init_weights):
     opt_weights = []
-    total = 0
     with open(mert_file) as inp:
         # Same structure as original weight list
         for (feat, weights) in init_weights:
@@ -125,9 +529,13 @@ def read_weights(mert_file, init_weights):
             for _ in weights:
                 w = float(inp.readline().split()[1])
                 opt_weights[-1][1].append(w)
-                # Sum for normalization
-                total += abs(w)
-    # Normalize weights
+    return normalize_weights(opt_weights)
+
+
+def normalize_weights(opt_weights):
+    total = sum(abs(w) for (_, weights) in opt_weights for w in weights)
+    if not total:
+        return opt_weights
     for (_, weights) in opt_weights:
         for i in range(len(weights)):
             weights[i] /= total
@@ -141,15 +549,15 @@ def create_feature_list(feat_file, weights):
                 out.write('{} {}\n'.format(feat, w))
 
 
+# Reads sparse weights from lines with feature names and weights, or from a
+# binary file created by a previous run
 def read_ini_features(ini_file):
-    feats = {}
-    with open(ini_file) as ini:
-        for line in ini:
-            f, w = line.strip().split(' ', 1)
-            if f.endswith('='):
-                f = f[:-1]
-            feats[f] = float(w)
-    if feats:
+    try:
+        feats = sparse.read(ini_file)
+    except Exception as e:
+        sys.stderr.write('Error: {}\n'.format(e))
+        sys.exit(1)
+    if len(feats):
         sys.stdout.write("Found {} sparse features\n".format(len(feats)))
     else:
         sys.stderr.write(
@@ -164,8 +572,14 @@ def extract_features(nbest_file,
                      skip_feats=None,
                      skip_prefix=None):
     init_weights = []
-    fields = [f.strip() for f in open(nbest_file).readline().split('|||')]
-    feats = fields[FEATURE_FIELD].split()
+    if nbestbin.is_binary(nbest_file):
+        feats = []
+        for name, n in nbestbin.load(nbest_file).schema:
+            feats.extend([name + '='] + ['0'] * n)
+    else:
+        with compressed.open_file(nbest_file) as inp:
+            fields = [f.strip() for f in inp.readline().split('|||')]
+        feats = fields[FEATURE_FIELD].split()
     for i in range(len(feats)):
         if feats[i].endswith('='):
             if skip_feats and feats[i][:-1] in skip_feats:
@@ -184,6 +598,10 @@ def extract_features(nbest_file,
 
 
 def find_executable(bindir, name):
+    if not bindir:
+        sys.stderr.write('Error: the {} executable is required, please '
+                         'specify --bin-dir\n'.format(name))
+        sys.exit(1)
     exe = os.path.join(bindir, name)
     if not os.path.exists(exe):
         sys.stderr.write(
@@ -202,8 +620,10 @@ def parse_user_args():
 
     parser.add_argument('-w', '--work-dir', metavar='DIR', default='workdir',
                         help='optimizer working directory, default: %(default)s')
-    parser.add_argument('-b', '--bin-dir', metavar='DIR', required=True,
-                        help='directory containing kbmira and evaluator executables')
+    parser.add_argument('-b', '--bin-dir', metavar='DIR',
+                        help='directory containing extractor and kbmira '
+                        'executables, needed for metrics other than BLEU and '
+                        'TER or for --optimizer kbmira')
     parser.add_argument('--script-dir', metavar='DIR',
                         help='directory containing Moses scripts')
 
@@ -213,12 +633,43 @@ def parse_user_args():
                         choices=METRICS.keys(),
                         help='tuning metric, default: %(default)s')
     parser.add_argument('-f', '--filter', default='default', metavar='FILTER',
-                        choices=FILTERS.keys(),
+                        choices=metrics.FILTERS.keys(),
                         help='postprocessing filter, default: %(default)s')
+    parser.add_argument('-o', '--optimizer', default='mira',
+                        choices=['mira', 'kbmira'],
+                        help='in-process kbMIRA or the kbmira executable, '
+                        'default: %(default)s')
+    parser.add_argument('-j', '--jobs', metavar='N', default=1, type=int,
+                        help='number of parallel extractor processes and '
+                        'optimizer runs, default: %(default)s')
+    parser.add_argument('--shard-size', metavar='N', default=500, type=int,
+                        help='number of sentences per extractor process, '
+                        'default: %(default)s')
+    parser.add_argument('--cache-dir', metavar='DIR',
+                        help='cache of metric statistics, default: '
+                        'WORK_DIR/cache')
+    parser.add_argument('--seed', metavar='N', default=0, type=int,
+                        help='random seed for the optimizer, '
+                        'default: %(default)s')
+    parser.add_argument('--restarts', metavar='N', default=1, type=int,
+                        help='number of optimizer runs with different seeds '
+                        'and perturbed initial weights, the best run on the '
+                        'dev set is kept, default: %(default)s')
+    parser.add_argument('--perturb', metavar='FLOAT', default=0.1,
+                        type=float,
+                        help='maximum random change of initial weights in '
+                        'restarts, default: %(default)s')
     parser.add_argument('--sparse', metavar='FILE',
                         help='sparse feature weights')
     parser.add_argument('--sparse-prefix', metavar='STR',
                         help='prefix for sparse features')
+    parser.add_argument('--stats', metavar='FILE',
+                        help='save timing, throughput and memory statistics '
+                        'as JSON')
+    parser.add_argument('--stats-interval', metavar='SEC', default=60,
+                        type=float,
+                        help='update statistics every SEC seconds, '
+                        'default: %(default)s')
     return parser.parse_args()
 
 
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Transforms dense features of an n-best list in a single streaming pass with
+# a chain of transforms declared in a JSON spec, see transform.py. Features of
+# batches of hypotheses are transformed as matrices.
+
+import sys
+import argparse
+
+import numpy as np
+
+import compressed
+import nbestbin
+from transform import FeatureTransformer, load_spec, save_spec
+
+FEATURE_FIELD = 2
+
+
+def main():
+    args = parse_user_args()
+
+    try:
+        transformer = FeatureTransformer(load_spec(args.spec),
+                                         fit=bool(args.fit))
+        if nbestbin.is_binary(args.input):
+            transform_binary(nbestbin.load(args.input.name), transformer,
+                             args)
+        else:
+            transform_text(args.input, transformer, args)
+    except ValueError as e:
+        sys.stderr.write('Error: {}\n'.format(e))
+        sys.exit(1)
+
+    if args.fit:
+        save_spec(transformer.fitted_spec(), args.fit)
+
+
+def transform_text(nbest, transformer, args):
+    batch = []
+    for line in nbest:
+        batch.append([f.strip() for f in line.split('|||')])
+        if len(batch) == args.batch:
+            transform_lines(batch, transformer, args)
+            batch = []
+    if batch:
+        transform_lines(batch, transformer, args)
+
+
+def transform_lines(lines, transformer, args):
+    # Lines with the same features are transformed together
+    groups = {}
+    for n, fields in enumerate(lines):
+        schema, values = nbestbin.parse_features(fields[FEATURE_FIELD])
+        indices, matrix = groups.setdefault(tuple(schema), ([], []))
+        indices.append(n)
+        matrix.append(values)
+
+    for schema, (indices, matrix) in groups.items():
+        out_schema, matrix = transformer.transform(
+            schema, np.reshape(matrix, (len(indices), -1)))
+        if args.fit:
+            continue
+        for n, values in zip(indices, matrix.tolist()):
+            lines[n][FEATURE_FIELD] = nbestbin.format_features(out_schema,
+                                                               values)
+    if not args.fit:
+        for fields in lines:
+            args.output.write(' ||| '.join(fields) + '\n')
+
+
+def transform_binary(nbest, transformer, args):
+    writer = None
+    if not args.fit:
+        output = getattr(args.output, 'buffer', args.output)
+        writer = nbestbin.NBestWriter(output, dtype=nbest.dtype)
+    sents = list(nbest.iterate_sentences())
+    for b in range(0, len(sents), args.batch):
+        batch = sents[b:b + args.batch]
+        begin = batch[0][1]
+        end = batch[-1][2]
+        schema, matrix = transformer.transform(nbest.schema,
+                                               nbest.features[begin:end])
+        if writer is None:
+            continue
+        for sid, start, stop in batch:
+            for i in range(start, stop):
+                writer.add(sid, nbest.hyp_text(i), schema,
+                           matrix[i - begin].tolist(), nbest.scores[i],
+                           nbest.hyp_extra(i))
+    if writer is not None:
+        writer.close()
+
+
+def parse_user_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', metavar='FILE', nargs='?',
+                        type=compressed.FileType('r'), default=sys.stdin,
+                        help='input n-best list, default: STDIN')
+    parser.add_argument('-o', '--output', metavar='FILE', nargs='?',
+                        type=compressed.FileType('w'), default=sys.stdout,
+                        help='output n-best list, default: STDOUT')
+    parser.add_argument('-s', '--spec', metavar='FILE', required=True,
+                        help='JSON spec of transforms')
+    parser.add_argument('--fit', metavar='FILE',
+                        help='estimate statistics for standardization on '
+                        'the input and save the spec with them to FILE '
+                        'instead of writing an n-best list')
+    parser.add_argument('-b', '--batch', metavar='N', type=int, default=1000,
+                        help='number of lines, or sentences of binary '
+                        'n-best lists, transformed at once, '
+                        'default: %(default)s')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
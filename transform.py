@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+# Transformations of dense feature values declared in a JSON spec, e.g.:
+#
+#   [{"op": "merge", "features": ["EditIns", "EditDel"], "name": "Edits"},
+#    {"op": "rename", "features": ["F0"], "name": "LM"},
+#    {"op": "log", "features": ["LenRatio"]},
+#    {"op": "clip", "features": ["LM"], "min": -100, "max": 0},
+#    {"op": "scale", "features": ["Edits"], "factor": 0.1},
+#    {"op": "standardize", "features": ["LM", "Edits"]},
+#    {"op": "drop", "features": ["F1"]}]
+#
+# Transforms are applied in order to matrices of feature values of many
+# hypotheses at once, and are compiled once for each schema of features.
+# Transforms without "features" apply to all features. Merging sums all values
+# of the features into a single value placed at the first of them. Logarithms
+# of zero are -100 as with add-features.py --log. Means and standard deviations
+# for standardization are estimated on a dev set while fitting and stored in
+# the spec; standardization itself is not applied while fitting.
+
+import sys
+import json
+
+import numpy as np
+
+OPS = ['merge', 'rename', 'log', 'clip', 'scale', 'standardize', 'drop']
+
+
+def load_spec(path):
+    with open(path) as f:
+        spec = json.load(f)
+    for t in spec:
+        if t.get('op') not in OPS:
+            raise ValueError('Unknown transform: {}'.format(t.get('op')))
+        if t['op'] in ('merge', 'rename') and 'name' not in t:
+            raise ValueError("Transform '{}' requires a name".format(t['op']))
+        # Names of features are str in Python 2 as in n-best lists
+        if 'features' in t:
+            t['features'] = [str(f) for f in t['features']]
+        if 'name' in t:
+            t['name'] = str(t['name'])
+    return spec
+
+
+def save_spec(spec, path):
+    with open(path, 'w') as f:
+        json.dump(spec, f, indent=2, sort_keys=True, separators=(',', ': '))
+        f.write('\n')
+
+
+class FeatureTransformer(object):
+
+    def __init__(self, spec, fit=False):
+        self.spec = spec
+        self.fit = fit
+        self.plans = {}
+        # Count, sums and sums of squares of values for each standardization
+        self.moments = [{} for _ in spec]
+
+    def transform(self, schema, values):
+        key = tuple(schema)
+        if key not in self.plans:
+            self.plans[key] = self.compile(list(schema))
+        out_schema, steps = self.plans[key]
+        # Always a copy, so steps can modify values in place
+        values = np.array(values, dtype=np.float64)
+        for step in steps:
+            values = step(values)
+        return out_schema, values
+
+    def compile(self, schema):
+        steps = []
+        for i, t in enumerate(self.spec):
+            positions = feature_positions(schema)
+            names = t.get('features') or [name for name, _ in schema]
+            present = [f for f in names if f in positions]
+            for f in names:
+                if f not in positions:
+                    sys.stderr.write("Warning: Feature '{}' not found in {}\n"
+                                     .format(f, format_schema(schema)))
+            if not present:
+                continue
+            cols = [c for f in present for c in positions[f]]
+
+            op = t['op']
+            if op == 'merge':
+                schema, step = self.compile_merge(schema, positions, present,
+                                                  t['name'])
+            elif op == 'rename':
+                schema = [(t['name'] if name in present else name, n)
+                          for name, n in schema]
+                continue
+            elif op == 'drop':
+                keep = [c for name, _ in schema if name not in present
+                        for c in positions[name]]
+                schema = [(name, n) for name, n in schema
+                          if name not in present]
+                step = select_columns(keep)
+            elif op == 'log':
+                step = log_columns(cols)
+            elif op == 'clip':
+                step = clip_columns(cols, t.get('min'), t.get('max'))
+            elif op == 'scale':
+                step = scale_columns(cols, t['factor'])
+            elif self.fit:
+                step = self.accumulate(i, present, positions)
+            else:
+                step = standardize_columns(cols, *self.read_moments(t,
+                                                                    present))
+            steps.append(step)
+        return schema, steps
+
+    def compile_merge(self, schema, positions, present, new_name):
+        new_schema = []
+        keep = []
+        for name, n in schema:
+            if name == present[0]:
+                merged = sum(n for _, n in new_schema)
+                new_schema.append((new_name, 1))
+            elif name not in present:
+                new_schema.append((name, n))
+                keep.extend(positions[name])
+        cols = [c for f in present for c in positions[f]]
+        # Columns of the output except the merged one
+        dest = [j for j in range(len(keep) + 1) if j != merged]
+
+        def merge(values):
+            out = np.empty((values.shape[0], len(keep) + 1))
+            out[:, merged] = values[:, cols].sum(axis=1)
+            out[:, dest] = values[:, keep]
+            return out
+        return new_schema, merge
+
+    def accumulate(self, i, present, positions):
+        moments = self.moments[i]
+
+        def step(values):
+            for f in present:
+                sub = values[:, positions[f]]
+                count, total, squares = moments.get(f, (0, 0.0, 0.0))
+                moments[f] = (count + sub.shape[0], total + sub.sum(axis=0),
+                              squares + (sub ** 2).sum(axis=0))
+            return values
+        return step
+
+    def read_moments(self, t, present):
+        if 'mean' not in t:
+            raise ValueError('Standardization is not fitted, use --fit')
+        mean = []
+        std = []
+        for f in present:
+            if f not in t['mean']:
+                raise ValueError("No statistics of feature '{}' for "
+                                 "standardization".format(f))
+            mean.extend(t['mean'][f])
+            std.extend(t['std'][f])
+        return np.array(mean), np.array(std)
+
+    # Returns a copy of the spec with estimated statistics for standardization
+    def fitted_spec(self):
+        spec = [dict(t) for t in self.spec]
+        for t, moments in zip(spec, self.moments):
+            if t['op'] != 'standardize':
+                continue
+            t['mean'] = {}
+            t['std'] = {}
+            for f, (count, total, squares) in moments.items():
+                mean = total / count
+                var = np.maximum(squares / count - mean ** 2, 0.0)
+                t['mean'][f] = mean.tolist()
+                t['std'][f] = np.sqrt(var).tolist()
+        return spec
+
+
+def feature_positions(schema):
+    positions = {}
+    start = 0
+    for name, n in schema:
+        positions[name] = list(range(start, start + n))
+        start += n
+    return positions
+
+
+def format_schema(schema):
+    return ' '.join(name + '=' for name, _ in schema)
+
+
+def select_columns(cols):
+    return lambda values: values[:, cols]
+
+
+def log_columns(cols):
+    def step(values):
+        sub = values[:, cols]
+        if (sub < 0).any():
+            raise ValueError('Logarithm of a negative feature value')
+        with np.errstate(divide='ignore'):
+            values[:, cols] = np.where(sub == 0, -100.0, np.log(sub))
+        return values
+    return step
+
+
+def clip_columns(cols, low, high):
+    def step(values):
+        sub = values[:, cols]
+        if low is not None:
+            sub = np.maximum(sub, low)
+        if high is not None:
+            sub = np.minimum(sub, high)
+        values[:, cols] = sub
+        return values
+    return step
+
+
+def scale_columns(cols, factor):
+    def step(values):
+        values[:, cols] *= factor
+        return values
+    return step
+
+
+def standardize_columns(cols, mean, std):
+    std = np.where(std > 0, std, 1.0)
+
+    def step(values):
+        values[:, cols] = (values[:, cols] - mean) / std
+        return values
+    return step